@@ -0,0 +1,188 @@
+# python-services/digitalpersona/ansi378.py
+"""
+ANSI INCITS 378-2004 finger minutiae record parsing
+Decodes FMR templates into compact NumPy minutiae arrays
+"""
+import struct
+
+import numpy as np
+
+FMR_MAGIC = b'FMR\x00'
+FMR_VERSION = b' 20\x00'
+
+# One finger minutia, packed: 7 bytes per point
+MINUTIA_DTYPE = np.dtype([
+    ('x', '<u2'),
+    ('y', '<u2'),
+    ('angle', 'u1'),    # ANSI units of 2 degrees (0-179)
+    ('type', 'u1'),     # 0 other, 1 ridge ending, 2 bifurcation
+    ('quality', 'u1'),
+])
+
+MINUTIA_OTHER = 0
+MINUTIA_RIDGE_ENDING = 1
+MINUTIA_BIFURCATION = 2
+
+
+class TemplateFormatError(ValueError):
+    """Raised when bytes are not a valid ANSI 378 minutiae record"""
+
+
+class FingerMinutiaeRecord:
+    """Parsed ANSI 378 record (first finger view)"""
+
+    __slots__ = (
+        'width', 'height', 'x_resolution', 'y_resolution',
+        'finger_position', 'impression_type', 'finger_quality',
+        'view_count', 'minutiae'
+    )
+
+    def __init__(self, width, height, x_resolution, y_resolution,
+                 finger_position, impression_type, finger_quality,
+                 view_count, minutiae):
+        self.width = width
+        self.height = height
+        self.x_resolution = x_resolution
+        self.y_resolution = y_resolution
+        self.finger_position = finger_position
+        self.impression_type = impression_type
+        self.finger_quality = finger_quality
+        self.view_count = view_count
+        self.minutiae = minutiae
+
+    @property
+    def minutiae_count(self):
+        return len(self.minutiae)
+
+
+def parse_template(data):
+    """
+    Parse an ANSI 378 finger minutiae record
+    Returns: FingerMinutiaeRecord for the first finger view
+    """
+    data = bytes(data)
+
+    if len(data) < 26 or data[:4] != FMR_MAGIC:
+        raise TemplateFormatError('Not an ANSI 378 finger minutiae record')
+    if data[4:8] != FMR_VERSION:
+        raise TemplateFormatError(f"Unsupported FMR version: {data[4:8]!r}")
+
+    # Record length is 2 bytes, or 0x0000 followed by a 4 byte length
+    offset = 8
+    (record_length,) = struct.unpack_from('>H', data, offset)
+    offset += 2
+    if record_length == 0:
+        (record_length,) = struct.unpack_from('>I', data, offset)
+        offset += 4
+
+    if record_length > len(data):
+        raise TemplateFormatError('Truncated ANSI 378 record')
+
+    # CBEFF product id (4) and capture equipment (2)
+    offset += 6
+    width, height, x_res, y_res, view_count = struct.unpack_from('>HHHHB', data, offset)
+    offset += 10  # includes the reserved byte
+
+    if view_count < 1:
+        raise TemplateFormatError('Record has no finger views')
+
+    if offset + 4 > record_length:
+        raise TemplateFormatError('Truncated finger view header')
+
+    finger_position, view_impression, finger_quality, count = struct.unpack_from(
+        '>BBBB', data, offset
+    )
+    offset += 4
+
+    end = offset + count * 6
+    if end > record_length:
+        raise TemplateFormatError('Truncated minutiae block')
+
+    # 6 bytes per minutia: type(2 bits)+x(14), reserved(2)+y(14), angle, quality
+    raw = np.frombuffer(data, dtype='>u2', count=count * 3, offset=offset).reshape(count, 3)
+    tail = np.frombuffer(data, dtype=np.uint8, count=count * 6, offset=offset).reshape(count, 6)
+
+    minutiae = np.empty(count, dtype=MINUTIA_DTYPE)
+    minutiae['x'] = raw[:, 0] & 0x3FFF
+    minutiae['y'] = raw[:, 1] & 0x3FFF
+    minutiae['type'] = raw[:, 0] >> 14
+    minutiae['angle'] = tail[:, 4]
+    minutiae['quality'] = tail[:, 5]
+
+    return FingerMinutiaeRecord(
+        width=width,
+        height=height,
+        x_resolution=x_res,
+        y_resolution=y_res,
+        finger_position=finger_position,
+        impression_type=view_impression & 0x0F,
+        finger_quality=finger_quality,
+        view_count=view_count,
+        minutiae=minutiae
+    )
+
+
+def encode_template(minutiae, width=355, height=391, resolution=197,
+                    finger_position=0, finger_quality=60):
+    """
+    Build an ANSI 378 record with a single finger view
+    minutiae: array with MINUTIA_DTYPE fields
+    """
+    minutiae = np.asarray(minutiae, dtype=MINUTIA_DTYPE)
+    count = len(minutiae)
+    if count > 255:
+        raise ValueError('A finger view holds at most 255 minutiae')
+
+    body = np.empty((count, 3), dtype='>u2')
+    body[:, 0] = (minutiae['type'].astype(np.uint16) << 14) | (minutiae['x'] & 0x3FFF)
+    body[:, 1] = minutiae['y'] & 0x3FFF
+    body[:, 2] = (minutiae['angle'].astype(np.uint16) << 8) | minutiae['quality']
+
+    record_length = 26 + 4 + count * 6 + 2
+
+    return b''.join([
+        FMR_MAGIC,
+        FMR_VERSION,
+        struct.pack('>H', record_length),
+        struct.pack('>IH', 0, 0),
+        struct.pack('>HHHHBB', width, height, resolution, resolution, 1, 0),
+        struct.pack('>BBBB', finger_position, 0, finger_quality, count),
+        body.tobytes(),
+        struct.pack('>H', 0),  # no extended data
+    ])
+
+
+def synthetic_minutiae(rng, count=40, width=355, height=391):
+    """Random but plausible minutiae, for mock captures and benchmarks"""
+    minutiae = np.empty(count, dtype=MINUTIA_DTYPE)
+    minutiae['x'] = rng.integers(20, width - 20, count)
+    minutiae['y'] = rng.integers(20, height - 20, count)
+    minutiae['angle'] = rng.integers(0, 180, count)
+    minutiae['type'] = rng.integers(1, 3, count)
+    minutiae['quality'] = rng.integers(40, 101, count)
+    return minutiae
+
+
+def distort_minutiae(rng, minutiae, rotation_deg=10, shift=15, jitter=3, keep=0.8):
+    """
+    Simulate a second impression of the same finger
+    Rotates, shifts and jitters the points and drops some of them
+    """
+    theta = np.deg2rad(rng.uniform(-rotation_deg, rotation_deg))
+    cx, cy = minutiae['x'].mean(), minutiae['y'].mean()
+    dx = minutiae['x'] - cx
+    dy = minutiae['y'] - cy
+
+    x = cx + dx * np.cos(theta) - dy * np.sin(theta) + rng.uniform(-shift, shift)
+    y = cy + dx * np.sin(theta) + dy * np.cos(theta) + rng.uniform(-shift, shift)
+    x += rng.normal(0, jitter, len(minutiae))
+    y += rng.normal(0, jitter, len(minutiae))
+    # ANSI angles run counter-clockwise with y pointing down, hence the minus
+    angle = (minutiae['angle'] - np.rad2deg(theta) / 2 + rng.normal(0, 1, len(minutiae))) % 180
+
+    result = minutiae.copy()
+    result['x'] = np.clip(x, 0, 0x3FFF)
+    result['y'] = np.clip(y, 0, 0x3FFF)
+    result['angle'] = angle.astype(np.uint8) % 180
+
+    return result[rng.random(len(result)) < keep]
@@ -0,0 +1,279 @@
+# python-services/digitalpersona/asgi_service.py
+"""
+ASGI mode of the fingerprint service
+Captures and scan streams are served by asyncio handlers: device I/O runs on
+a dedicated thread pool, a capture is cancelled when its client disconnects,
+and idle stream clients hold no thread. Every other endpoint is the Flask
+app behind an ASGI adapter. The asyncio handlers skip the Flask request
+hooks, so they record http_request_seconds, sampled traces and CORS headers
+themselves (instrumented)
+Run: uvicorn asgi_service:app --port 5000 (one worker; it owns the readers)
+FINGERPRINT_SERVICE=usb serves the USB service instead of the SDK one
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+from image_codec import ImageCodec
+from reader_registry import ReaderNotFound
+from scan_events import stream_events_async
+
+SERVICE_MODULES = {
+    'sdk': 'digitalpersona_service',
+    'usb': 'digitalpersona_service_usb'
+}
+
+# The service module registers its reader class with the shared app
+importlib.import_module(SERVICE_MODULES[os.getenv('FINGERPRINT_SERVICE', 'sdk')])
+service = importlib.import_module('fingerprint_service')
+
+# Threads for blocking reader calls (captures and lift waits)
+DEVICE_THREADS = int(os.getenv('FINGERPRINT_DEVICE_THREADS', 4))
+
+logger = logging.getLogger(__name__)
+
+device_executor = ThreadPoolExecutor(DEVICE_THREADS, thread_name_prefix='device')
+flask_app = WsgiToAsgi(service.app)
+
+
+def request_data(scope, body):
+    """JSON body and query arguments of a request, as plain dicts"""
+    try:
+        data = json.loads(body) if body else {}
+    except ValueError:
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    query = {
+        key: values[-1]
+        for key, values in parse_qs(scope.get('query_string', b'').decode()).items()
+    }
+    return data, query
+
+
+def truthy(value):
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+async def read_body(receive):
+    body = b''
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return None
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+
+async def wait_for_disconnect(receive, cancel=None):
+    """Resolve once the client goes away, setting cancel if given"""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            if cancel is not None:
+                cancel.set()
+            return
+
+
+async def send_json(send, body, status=200):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'access-control-allow-origin', b'*')
+        ]
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps(body).encode()})
+
+
+def instrumented(handler, endpoint):
+    """
+    Time a handler in http_request_seconds and trace it when sampled, as the
+    Flask hooks do: both end when the response starts. The trace is not the
+    event loop thread's; the handler gets it to pass to its executor calls
+    """
+    async def run(scope, receive, send):
+        method = scope['method']
+        started = time.perf_counter()
+        trace = service.profiler.begin(f'{method} {endpoint}', bind=False)
+        ended = False
+
+        async def send_timed(message):
+            nonlocal ended
+            if message['type'] == 'http.response.start' and not ended:
+                ended = True
+                status = message['status']
+                service.http_seconds.observe(time.perf_counter() - started, method, endpoint, str(status))
+                service.profiler.end(trace, status)
+            await send(message)
+
+        try:
+            await handler(scope, receive, send_timed, trace)
+        finally:
+            if not ended:
+                # No response: the client went away or the handler failed
+                service.profiler.end(trace)
+
+    return run
+
+
+async def capture_fingerprint(scope, receive, send, trace=None):
+    """
+    POST /fingerprint/capture, as in the Flask service
+    The capture is awaited on the device pool and cancelled if the client
+    disconnects while the reader is still waiting for a finger
+    """
+    body = await read_body(receive)
+    if body is None:
+        return
+    data, query = request_data(scope, body)
+
+    try:
+        timeout = float(data.get('timeout', 10))
+        reader_id = query.get('readerId') or data.get('readerId') or service.readers.default_id
+        device = service.readers.get(reader_id)
+        codec = ImageCodec.from_request(dict(data, **query), service.image_codec)
+        include_image = truthy(query.get('image', data.get('includeImage', service.INCLUDE_IMAGE)))
+    except ReaderNotFound as e:
+        return await send_json(send, {'success': False, 'message': str(e)}, 404)
+    except ValueError as e:
+        return await send_json(send, {'success': False, 'message': str(e)}, 400)
+
+    if not service.supervisor.available(reader_id):
+        service.captures_total.inc('unavailable')
+        return await send_json(send, service.unavailable_body(reader_id), 503)
+
+    loop = asyncio.get_running_loop()
+    cancel = threading.Event()
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive, cancel))
+
+    def acquire():
+        with service.capture_seconds.time('acquire'), service.profiler.span('acquire'):
+            return device.acquire_frame(timeout, cancel)
+
+    try:
+        frame = await loop.run_in_executor(
+            device_executor, service.profiler.run_in, trace, acquire
+        )
+        if watcher.done():
+            # Client went away mid-capture; nobody to answer
+            if frame is not None:
+                frame.release()
+            service.captures_total.inc('cancelled')
+            logger.info(f"Capture on {reader_id} cancelled by client disconnect")
+            return
+
+        result, status = await loop.run_in_executor(
+            None, service.profiler.run_in, trace,
+            partial(service.finish_capture, reader_id, device, frame, codec, include_image)
+        )
+        await send_json(send, result, status)
+
+    except asyncio.CancelledError:
+        cancel.set()
+        raise
+    except Exception as e:
+        service.captures_total.inc('error')
+        logger.error(f"Capture endpoint error: {e}")
+        await send_json(send, {'success': False, 'message': str(e)}, 500)
+    finally:
+        watcher.cancel()
+
+
+async def stream_scans(scope, receive, send, trace=None):
+    """GET /monitoring/stream, as in the Flask service, on the event loop"""
+    _, query = request_data(scope, b'')
+    headers = dict(scope.get('headers', []))
+    resume = headers.get(b'last-event-id', b'').decode() or query.get('resume')
+
+    try:
+        render = None
+        if truthy(query.get('image', False)):
+            render = partial(service.with_image, ImageCodec.from_request(query, service.image_codec))
+    except ValueError as e:
+        return await send_json(send, {'success': False, 'message': str(e)}, 400)
+
+    subscriber = service.scan_events.subscribe(resume, loop=asyncio.get_running_loop())
+    events = stream_events_async(service.scan_events, subscriber, service.STREAM_HEARTBEAT, render)
+    watcher = asyncio.ensure_future(wait_for_disconnect(receive))
+
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'text/event-stream'),
+            (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'),
+            (b'access-control-allow-origin', b'*')
+        ]
+    })
+
+    try:
+        while True:
+            chunk = asyncio.ensure_future(events.__anext__())
+            await asyncio.wait({chunk, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if not chunk.done():
+                # Client gone: cancelling the pending read ends the generator
+                chunk.cancel()
+                await asyncio.wait({chunk})
+                break
+            try:
+                text = chunk.result()
+            except StopAsyncIteration:
+                break
+            await send({'type': 'http.response.body', 'body': text.encode(), 'more_body': True})
+        if not watcher.done():
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        watcher.cancel()
+        await events.aclose()
+
+
+ROUTES = {
+    ('POST', '/fingerprint/capture'): instrumented(capture_fingerprint, '/fingerprint/capture'),
+    ('GET', '/monitoring/stream'): instrumented(stream_scans, '/monitoring/stream')
+}
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            # Blocking on purpose: nothing is served until the gallery is loaded
+            service.start_service()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            service.supervisor.stop()
+            service.readers.stop_all()
+            device_executor.shutdown(wait=False)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    handler = None
+    if scope['type'] == 'http':
+        handler = ROUTES.get((scope['method'], scope['path']))
+    if handler is None:
+        return await flask_app(scope, receive, send)
+    return await handler(scope, receive, send)
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('FINGERPRINT_SERVICE_PORT', 5000)))
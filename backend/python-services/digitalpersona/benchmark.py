@@ -0,0 +1,417 @@
+# python-services/digitalpersona/benchmark.py
+"""
+Benchmarks of the capture, encode, compare and identify hot paths
+Runs in mock mode without hardware against synthetic ANSI 378 galleries and
+reports throughput and p50/p95/p99 latency for each stage, and for the HTTP
+endpoints under concurrent load, as JSON to compare releases and size hosts
+Run: python benchmark.py --gallery-sizes 1000,10000 --output bench.json
+With --url the HTTP load goes to a running service instead of an
+in-process server (its synthetic enrollments are removed afterwards)
+"""
+import os
+import json
+import time
+import base64
+import socket
+import logging
+import platform
+import argparse
+import importlib
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from ansi378 import distort_minutiae, encode_template, synthetic_minutiae
+from frame_pool import pixels_image
+from frame_quality import assess_quality
+from gallery_search import SearchOptions
+from image_codec import FORMATS, ImageCodec
+
+SERVICE_MODULES = {
+    'sdk': 'digitalpersona_service',
+    'usb': 'digitalpersona_service_usb'
+}
+
+# Mock frames match the U.are.U 4500 capture size
+FRAME_WIDTH, FRAME_HEIGHT = 355, 391
+
+BENCH_ID_PREFIX = 'bench-'
+
+
+def latency_stats(samples_ns, elapsed=None):
+    """Count, throughput and latency percentiles (ms) of per-call timings"""
+    samples = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    if not len(samples):
+        return {'count': 0}
+    elapsed = elapsed if elapsed is not None else samples.sum() / 1000.0
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        'count': int(len(samples)),
+        'seconds': round(elapsed, 6),
+        'throughputPerSecond': round(len(samples) / elapsed, 2) if elapsed > 0 else None,
+        'meanMs': round(float(samples.mean()), 4),
+        'p50Ms': round(float(p50), 4),
+        'p95Ms': round(float(p95), 4),
+        'p99Ms': round(float(p99), 4),
+        'maxMs': round(float(samples.max()), 4)
+    }
+
+
+def measure(fn, iterations, warmup=3):
+    """Time iterations calls of fn() one by one, after warmup untimed calls"""
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(iterations, dtype=np.int64)
+    started = time.perf_counter()
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        fn()
+        samples[i] = time.perf_counter_ns() - start
+    return latency_stats(samples, time.perf_counter() - started)
+
+
+def template_b64(minutiae):
+    return base64.b64encode(encode_template(minutiae, FRAME_WIDTH, FRAME_HEIGHT)).decode()
+
+
+def synthetic_gallery(rng, size, minutiae_count=40):
+    """
+    size enrolled {id, template} entries and the minutiae behind them
+    Returns: (entries, minutiae list)
+    """
+    minutiae = [
+        synthetic_minutiae(rng, minutiae_count, FRAME_WIDTH, FRAME_HEIGHT)
+        for _ in range(size)
+    ]
+    entries = [
+        {'id': f'{BENCH_ID_PREFIX}{i}', 'template': template_b64(points)}
+        for i, points in enumerate(minutiae)
+    ]
+    return entries, minutiae
+
+
+def probe_templates(rng, minutiae, count, genuine_share=0.5):
+    """Probes: distorted impressions of enrolled fingers, plus unknown fingers"""
+    probes = []
+    for _ in range(count):
+        if minutiae and rng.random() < genuine_share:
+            points = distort_minutiae(rng, minutiae[int(rng.integers(len(minutiae)))])
+        else:
+            points = synthetic_minutiae(rng, 40, FRAME_WIDTH, FRAME_HEIGHT)
+        probes.append(template_b64(points))
+    return probes
+
+
+def synthetic_frame(rng, height=FRAME_HEIGHT, width=FRAME_WIDTH):
+    """Noisy concentric ridges, like the mock reader's frames"""
+    y, x = np.ogrid[:height, :width]
+    ridges = 150 + 60 * np.sin(np.hypot(x - width / 2, y - height / 2) / 1.6)
+    return np.clip(ridges + rng.normal(0, 10, (height, width)), 0, 255).astype(np.uint8)
+
+
+class MockFid:
+    """Stand-in for an SDK capture result, for the FID copy stage"""
+
+    def __init__(self, pixels):
+        self.height, self.width = pixels.shape
+        self.data = pixels.tobytes()
+
+
+def cycle(items):
+    """fn() that returns the next item on every call, round robin"""
+    state = {'next': 0}
+
+    def next_item():
+        item = items[state['next'] % len(items)]
+        state['next'] += 1
+        return item
+    return next_item
+
+
+def bench_stages(service, rng, args):
+    """Per-call cost of the capture-side stages and 1:1 / 1:M comparison"""
+    reader = service.reader
+    pixels = synthetic_frame(rng)
+    stages = {}
+
+    if hasattr(reader, '_fid_pixels'):
+        fid = MockFid(pixels)
+        pool = service.frame_pool
+        stages['fidCopy'] = measure(lambda: pool.release(reader._fid_pixels(fid)), args.iterations)
+
+    stages['quality'] = measure(lambda: assess_quality(pixels), args.iterations)
+    stages['render'] = measure(lambda: pixels_image(pixels), args.iterations)
+
+    image = pixels_image(pixels)
+    # The service's configured preview codec, then every format it can be switched to
+    codec = service.image_codec
+    stages['encode'] = measure(lambda: codec.encode(image, pixels), args.iterations)
+    stages['encode']['format'] = codec.format
+    for format in FORMATS:
+        try:
+            codec = ImageCodec(format, args.image_max_size, compress_level=service.PNG_COMPRESS_LEVEL)
+        except ValueError as e:
+            stages[f'encode.{format}'] = {'count': 0, 'skipped': str(e)}
+            continue
+        stages[f'encode.{format}'] = measure(lambda: codec.encode(image, pixels), args.iterations)
+
+    entries, minutiae = synthetic_gallery(rng, args.batch_size)
+    probes = cycle(probe_templates(rng, minutiae, 64))
+    templates = cycle([entry['template'] for entry in entries])
+    stages['compare'] = measure(lambda: reader.compare_templates(probes(), templates()), args.iterations)
+
+    batch = [(entry['id'], entry['template']) for entry in entries]
+    stages['compareBatch'] = measure(lambda: reader.compare_many(probes(), batch), args.iterations)
+    stages['compareBatch']['batchSize'] = args.batch_size
+
+    return stages
+
+
+def bench_identify(service, rng, args):
+    """1:N identification against galleries of each requested size"""
+    results = {}
+    gallery = service.gallery
+    threshold = args.threshold
+    entries, minutiae = [], []
+
+    for size in args.gallery_sizes:
+        entries, minutiae = synthetic_gallery(rng, size)
+
+        started = time.perf_counter()
+        gallery.enroll_many(entries, replace_all=True)
+        enroll_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        gallery.coarse_index()
+        index_seconds = time.perf_counter() - started
+
+        probes = cycle(probe_templates(rng, minutiae, 64))
+        comparisons = []
+
+        def identify():
+            _, stats = service.reader.identify(probes(), threshold, SearchOptions())
+            comparisons.append(stats.comparisons)
+
+        stats = measure(identify, args.identify_iterations)
+        stats.update({
+            'gallerySize': size,
+            'enrollSeconds': round(enroll_seconds, 4),
+            'indexSeconds': round(index_seconds, 4),
+            'meanComparisons': round(float(np.mean(comparisons)), 1)
+        })
+        results[str(size)] = stats
+
+    return results, entries, minutiae
+
+
+def http_load(base_url, method, path, body, count, concurrency, timeout=30.0):
+    """count requests from concurrency client threads, each reusing its connection"""
+    target = urlsplit(base_url)
+    payload = json.dumps(body).encode() if body is not None else None
+    headers = {'Content-Type': 'application/json'} if payload is not None else {}
+    local = threading.local()
+
+    def one(_):
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection(
+                target.hostname, target.port or 80, timeout=timeout
+            )
+        start = time.perf_counter_ns()
+        try:
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            local.connection = None
+            ok = False
+        return time.perf_counter_ns() - start, ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(one, range(count)))
+    elapsed = time.perf_counter() - started
+
+    stats = latency_stats([duration for duration, _ in results], elapsed)
+    stats['errors'] = sum(1 for _, ok in results if not ok)
+    stats['concurrency'] = concurrency
+    return stats
+
+
+def serve_in_process(app):
+    """Serve the Flask app on a free local port in a background thread"""
+    from werkzeug.serving import make_server
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def bench_http(base_url, rng, entries, minutiae, args):
+    """Endpoint latency under concurrent load"""
+    probes = probe_templates(rng, minutiae, 2)
+    batch = entries[:args.batch_size]
+    endpoints = {
+        'GET /health': ('GET', '/health', None),
+        'POST /fingerprint/compare': ('POST', '/fingerprint/compare', {
+            'template1': probes[0], 'template2': entries[0]['template']
+        }),
+        'POST /fingerprint/compare/batch': ('POST', '/fingerprint/compare/batch', {
+            'probe': probes[1], 'templates': batch
+        }),
+        'POST /fingerprint/identify': ('POST', '/fingerprint/identify', {
+            'template': probes[1]
+        })
+    }
+
+    results = {}
+    for name, (method, path, body) in endpoints.items():
+        results[name] = http_load(base_url, method, path, body, args.requests, args.concurrency)
+
+    if args.capture:
+        # Sequential: a reader captures one finger at a time
+        results['POST /fingerprint/capture'] = http_load(
+            base_url, 'POST', '/fingerprint/capture', {'timeout': 10}, args.capture, 1, timeout=30.0
+        )
+    return results
+
+
+def remote_mock_mode(base_url):
+    """mock_mode reported by the /health of a running service"""
+    target = urlsplit(base_url)
+    connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+    try:
+        connection.request('GET', '/health')
+        response = connection.getresponse()
+        body = response.read()
+        if response.status >= 400:
+            raise RuntimeError(f'/health returned {response.status}')
+    finally:
+        connection.close()
+    return json.loads(body).get('mock_mode')
+
+
+def remote_gallery(base_url, entries, enroll=True):
+    """Enroll (or remove) the synthetic templates on a running service"""
+    target = urlsplit(base_url)
+    connection = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=120)
+    if enroll:
+        path, body = '/gallery/enroll', {'templates': entries}
+    else:
+        path, body = '/gallery/remove', {'ids': [entry['id'] for entry in entries]}
+    try:
+        connection.request('POST', path, json.dumps(body), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        if response.status >= 400:
+            raise RuntimeError(f'{path} returned {response.status}')
+    finally:
+        connection.close()
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--service', choices=sorted(SERVICE_MODULES), default='usb',
+                        help='service whose reader and matcher are measured (usb matches without the SDK)')
+    parser.add_argument('--gallery-sizes', default='100,1000,10000',
+                        help='comma-separated identification gallery sizes')
+    parser.add_argument('--iterations', type=int, default=200, help='timed calls per stage')
+    parser.add_argument('--identify-iterations', type=int, default=50, help='timed identifications per gallery size')
+    parser.add_argument('--batch-size', type=int, default=100, help='templates per batch compare')
+    parser.add_argument('--image-max-size', type=int, default=0, help='thumbnail side for encode stages, 0 for full size')
+    parser.add_argument('--threshold', type=float, default=0.6)
+    parser.add_argument('--match-workers', type=int, default=1,
+                        help='matching pool processes (FINGERPRINT_MATCH_WORKERS)')
+    parser.add_argument('--requests', type=int, default=500, help='requests per HTTP endpoint, 0 to skip HTTP')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent HTTP clients')
+    parser.add_argument('--capture', type=int, default=0,
+                        help='sequential /fingerprint/capture requests (real readers; mock ones wait a second)')
+    parser.add_argument('--url', help='load-test this running service instead of an in-process server')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON results file (default: stdout)')
+    parser.add_argument('--verbose', action='store_true', help='keep the service INFO logs')
+
+    args = parser.parse_args(argv)
+    args.gallery_sizes = [int(size) for size in args.gallery_sizes.split(',') if size.strip()]
+    return args
+
+
+def load_service(args):
+    """Import a service configured for benchmarking: in-memory gallery, no compare cache"""
+    os.environ['FINGERPRINT_GALLERY_DIR'] = ''
+    os.environ['FINGERPRINT_COMPARE_CACHE_SIZE'] = '0'
+    os.environ['FINGERPRINT_MATCH_WORKERS'] = str(args.match_workers)
+    os.environ.setdefault('FINGERPRINT_ROLE', 'standalone')
+
+    # The service module registers its reader class with the shared app
+    importlib.import_module(SERVICE_MODULES[args.service])
+    service = importlib.import_module('fingerprint_service')
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+        # werkzeug sets its own level for the per-request log
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    service.start_service()
+    return service
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+    service = load_service(args)
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'host': {
+            'hostname': socket.gethostname(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpus': os.cpu_count()
+        },
+        'service': args.service,
+        # Whether the measured readers run without hardware (the remote service's with --url)
+        'mockMode': remote_mock_mode(args.url) if args.url else service.mock_mode(),
+        'settings': {
+            key: value for key, value in vars(args).items()
+            if key not in ('output', 'verbose')
+        }
+    }
+
+    report['stages'] = bench_stages(service, rng, args)
+    report['identify'], entries, minutiae = bench_identify(service, rng, args)
+
+    if args.requests > 0 and entries:
+        if args.url:
+            remote_gallery(args.url, entries)
+            try:
+                report['http'] = bench_http(args.url, rng, entries, minutiae, args)
+            finally:
+                remote_gallery(args.url, entries, enroll=False)
+            report['http']['url'] = args.url
+        else:
+            base_url, server = serve_in_process(service.app)
+            try:
+                report['http'] = bench_http(base_url, rng, entries, minutiae, args)
+            finally:
+                server.shutdown()
+
+    if service.matching_pool is not None:
+        service.matching_pool.shutdown()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+# python-services/digitalpersona/capture_pipeline.py
+"""
+Staged capture pipeline for monitoring mode
+A capture thread owns the reader and only waits for fingers; template
+extraction and image encoding run in their own worker threads, fed through
+bounded queues. A full queue blocks the stage before it (backpressure), so
+post-processing never sits between the reader and its next capture
+"""
+import time
+import queue
+import threading
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's input
+_STOP = object()
+
+
+class CapturedFrame:
+    """
+    One raw capture on its way through the pipeline
+    raw is the device frame (e.g. an SDK FID); template and image are
+    filled in by the stages that need them
+    pixels is the frame's uint8 array, taken from pool when one is given;
+    quality is its FrameQuality once assessed
+    """
+
+    __slots__ = ('raw', 'template', 'image', 'pixels', 'pool', 'quality', 'timestamp', 'captured_at')
+
+    def __init__(self, raw=None, template=None, image=None, pixels=None, pool=None):
+        self.raw = raw
+        self.template = template
+        self.image = image
+        self.pixels = pixels
+        self.pool = pool
+        self.quality = None
+        self.timestamp = datetime.now().isoformat()
+        self.captured_at = time.perf_counter()
+
+    def release(self):
+        """Hand the pixel buffer back to its pool; the image is unusable after this"""
+        pixels, self.pixels = self.pixels, None
+        self.image = None
+        self.raw = None
+        if pixels is not None and self.pool is not None:
+            self.pool.release(pixels)
+
+
+class StageStats:
+    """Counters and cumulative time of one pipeline stage"""
+
+    __slots__ = ('processed', 'failed', 'seconds')
+
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.seconds = 0.0
+
+    def to_dict(self):
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'avgMs': round(self.seconds / self.processed * 1000, 2) if self.processed else 0.0
+        }
+
+
+class CapturePipeline:
+    """
+    capture_fn(cancel) -> CapturedFrame, or None when no finger was placed;
+    it should return early once the cancel event is set
+    extract_fn(frame) -> event dict, or None to drop the frame
+    encode_fn(frame, event) -> finished event, handed to publish_fn(event)
+    lift_fn(cancel) -> True once the finger left the sensor, False if
+    cancelled, None if the reader cannot tell (then cooldown applies)
+    observe_fn(stage, seconds), when given, is told the time of every
+    completed stage, and of every scan from capture to publish as 'latency'
+    """
+
+    def __init__(self, capture_fn, extract_fn, encode_fn, publish_fn,
+                 extract_workers=1, encode_workers=1, queue_depth=4, lift_fn=None,
+                 cooldown=3.0, idle_wait=0.5, error_wait=1.0, observe_fn=None):
+        self.capture_fn = capture_fn
+        self.extract_fn = extract_fn
+        self.encode_fn = encode_fn
+        self.publish_fn = publish_fn
+        self.lift_fn = lift_fn
+        self.observe_fn = observe_fn
+        self.extract_workers = extract_workers
+        self.encode_workers = encode_workers
+        self.queue_depth = queue_depth
+        self.cooldown = cooldown        # after a capture when the lift can't be seen, so one touch is one scan
+        self.idle_wait = idle_wait      # least time per capture attempt without a finger
+        self.error_wait = error_wait
+        self._extract_queue = None
+        self._encode_queue = None
+        self._threads = []
+        self._extractors_left = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stats = {name: StageStats() for name in ('capture', 'lift', 'extract', 'encode')}
+        self.stalls = 0                 # captures that waited on a full extract queue
+        self.latency = 0.0              # cumulative capture-to-publish seconds
+
+    def _observe(self, stats, name, seconds):
+        # Stage workers can run several threads each
+        with self._lock:
+            stats.processed += 1
+            stats.seconds += seconds
+        if self.observe_fn is not None:
+            self.observe_fn(name, seconds)
+
+    def _failed(self, stats, seconds=0.0):
+        with self._lock:
+            stats.failed += 1
+            stats.seconds += seconds
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    @property
+    def active(self):
+        """Running and not asked to stop"""
+        return self.running and not self._stop.is_set()
+
+    def start(self):
+        """Start the capture thread and stage workers"""
+        with self._start_lock:
+            if self.running and not self._stop.is_set():
+                return
+            # A stopped pipeline may still be draining; let it finish first
+            for thread in self._threads:
+                thread.join()
+            self._stop.clear()
+            self._extractors_left = self.extract_workers
+            self._extract_queue = queue.Queue(maxsize=self.queue_depth)
+            self._encode_queue = queue.Queue(maxsize=self.queue_depth)
+
+            self._threads = [threading.Thread(target=self._capture_loop, name='capture', daemon=True)]
+            self._threads += [
+                threading.Thread(target=self._extract_loop, name=f'extract-{i}', daemon=True)
+                for i in range(self.extract_workers)
+            ]
+            self._threads += [
+                threading.Thread(target=self._encode_loop, name=f'encode-{i}', daemon=True)
+                for i in range(self.encode_workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+
+        logger.info(
+            f"Capture pipeline started ({self.extract_workers} extract, "
+            f"{self.encode_workers} encode workers)"
+        )
+
+    def stop(self):
+        """
+        Stop capturing; frames already captured still finish their stages
+        A capture or lift wait in progress is cancelled through the stop event
+        """
+        self._stop.set()
+
+    def _put(self, target, item):
+        """Blocking put that still notices stop(); False if stopped first"""
+        while True:
+            try:
+                target.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                if self._stop.is_set():
+                    return False
+
+    def _capture_loop(self):
+        stats = self._stats['capture']
+        lift = self._stats['lift']
+        logger.info("Monitoring loop started")
+
+        while not self._stop.is_set():
+            try:
+                started = time.perf_counter()
+                frame = self.capture_fn(self._stop)
+                if frame is None:
+                    # Only pause when the attempt returned early (e.g. an error), never after a full wait
+                    self._stop.wait(max(0.0, self.idle_wait - (time.perf_counter() - started)))
+                    continue
+
+                self._observe(stats, 'capture', time.perf_counter() - started)
+                if self._extract_queue.full():
+                    with self._lock:
+                        self.stalls += 1
+                if not self._put(self._extract_queue, frame):
+                    # Stopped while the queue was full: nobody will take the frame
+                    frame.release()
+                    break
+
+                logger.info("Fingerprint captured in monitoring mode")
+
+                # One touch is one scan: wait for the finger to leave the sensor
+                started = time.perf_counter()
+                lifted = self.lift_fn(self._stop) if self.lift_fn else None
+                if lifted is None:
+                    self._stop.wait(self.cooldown)
+                elif lifted:
+                    self._observe(lift, 'lift', time.perf_counter() - started)
+
+            except Exception as e:
+                self._failed(stats)
+                logger.error(f"Monitoring loop error: {e}")
+                self._stop.wait(self.error_wait)
+
+        for _ in range(self.extract_workers):
+            self._extract_queue.put(_STOP)
+        logger.info("Monitoring loop stopped")
+
+    def _extract_loop(self):
+        stats = self._stats['extract']
+
+        while True:
+            frame = self._extract_queue.get()
+            if frame is _STOP:
+                break
+            try:
+                started = time.perf_counter()
+                event = self.extract_fn(frame)
+                if event is None:
+                    self._failed(stats, time.perf_counter() - started)
+                    frame.release()
+                    continue
+                self._observe(stats, 'extract', time.perf_counter() - started)
+                self._encode_queue.put((frame, event))
+            except Exception as e:
+                self._failed(stats)
+                frame.release()
+                logger.error(f"Template extraction stage error: {e}")
+
+        # The last extract worker to finish stops the encoders
+        with self._lock:
+            self._extractors_left -= 1
+            last = self._extractors_left == 0
+        if last:
+            for _ in range(self.encode_workers):
+                self._encode_queue.put(_STOP)
+
+    def _encode_loop(self):
+        stats = self._stats['encode']
+
+        while True:
+            item = self._encode_queue.get()
+            if item is _STOP:
+                break
+            frame, event = item
+            try:
+                started = time.perf_counter()
+                event = self.encode_fn(frame, event)
+                self._observe(stats, 'encode', time.perf_counter() - started)
+                self.publish_fn(event)
+                latency = time.perf_counter() - frame.captured_at
+                with self._lock:
+                    self.latency += latency
+                if self.observe_fn is not None:
+                    self.observe_fn('latency', latency)
+            except Exception as e:
+                self._failed(stats)
+                logger.error(f"Image encoding stage error: {e}")
+
+    def stats(self):
+        with self._lock:
+            stages = {name: stage.to_dict() for name, stage in self._stats.items()}
+            published = self._stats['encode'].processed
+            stalls = self.stalls
+            latency = self.latency
+        return {
+            'running': self.running,
+            'stages': stages,
+            'queues': {
+                'extract': self._extract_queue.qsize() if self._extract_queue else 0,
+                'encode': self._encode_queue.qsize() if self._encode_queue else 0,
+                'depth': self.queue_depth
+            },
+            'stalls': stalls,
+            'avgLatencyMs': round(latency / published * 1000, 2) if published else 0.0
+        }
@@ -0,0 +1,137 @@
+# python-services/digitalpersona/compare_cache.py
+"""
+Result cache for repeated 1:1 comparisons
+Clock-in retries and verify-then-clock-in flows compare the same probe and
+template again within seconds; results are cached by content digest so the
+repeat skips the matcher
+"""
+import base64
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def template_digest(template):
+    """Digest of a template given as raw bytes or base64"""
+    if isinstance(template, str):
+        template = base64.b64decode(template)
+    return hashlib.blake2b(template, digest_size=16).digest()
+
+
+class CompareCache:
+    """
+    Bounded LRU cache of (match, similarity) results with a TTL
+    Keyed by the digests of both templates and the threshold
+    """
+
+    def __init__(self, max_entries=4096, ttl=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()   # key -> (expires, result)
+        self._by_digest = {}            # digest -> keys that include it
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(template1, template2, threshold):
+        return (template_digest(template1), template_digest(template2), float(threshold))
+
+    def get(self, key):
+        """Cached result for a key, or None"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, result = entry
+            if expires < time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            for digest in key[:2]:
+                self._by_digest.setdefault(digest, set()).add(key)
+
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        """Remove one entry; caller holds the lock"""
+        self._entries.pop(key, None)
+        for digest in key[:2]:
+            keys = self._by_digest.get(digest)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_digest[digest]
+
+    def invalidate(self, templates):
+        """
+        Drop every result involving any of these templates (raw bytes)
+        Returns: number of entries dropped
+        """
+        dropped = 0
+        with self._lock:
+            for template in templates:
+                for key in list(self._by_digest.get(template_digest(template), ())):
+                    self._drop(key)
+                    dropped += 1
+            self.invalidations += dropped
+        return dropped
+
+    def on_gallery_change(self, templates):
+        """TemplateGallery listener: forget results for templates that left it"""
+        if templates is None:
+            self.clear()
+        else:
+            self.invalidate(templates)
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._by_digest.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
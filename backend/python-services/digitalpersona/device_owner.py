@@ -0,0 +1,166 @@
+# python-services/digitalpersona/device_owner.py
+"""
+Multi-worker serving: one device-owner process, many HTTP workers
+The owner is the normal service with the readers, the monitoring pipeline
+and the writable gallery, listening on a local Unix socket. Pre-forked
+workers answer compare/identify/health themselves from a read-only replica
+of the gallery files and forward every other request to the owner
+Stack samples are taken by whichever process answers; ?process=owner sends
+any request to the owner
+"""
+import json
+import socket
+import logging
+import http.client
+from urllib.parse import quote
+
+from flask import Response, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+# Endpoints a worker answers itself; everything else goes to the owner
+WORKER_ENDPOINTS = {
+    '/health',
+    '/fingerprint/compare',
+    '/fingerprint/compare/batch',
+    '/fingerprint/identify',
+    '/gallery/status',
+    '/admin/profile/stacks'
+}
+
+# Worker endpoints that read the gallery, refreshed from the store first
+GALLERY_ENDPOINTS = {'/fingerprint/identify', '/gallery/status'}
+
+# Not passed through in either direction; the worker sets its own
+HOP_HEADERS = {
+    'connection', 'keep-alive', 'transfer-encoding', 'content-length',
+    'host', 'server', 'date'
+}
+
+# /health fields a worker reports from the owner, which holds the readers
+OWNER_HEALTH_FIELDS = ('reader_connected', 'readers', 'monitoring', 'mock_mode')
+
+READ_SIZE = 64 * 1024
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix domain socket"""
+
+    def __init__(self, socket_path, timeout):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class OwnerClient:
+    """
+    Forwards requests to the device owner
+    One connection per request: connecting to a local socket costs
+    microseconds, and streamed responses keep their connection to themselves
+    """
+
+    def __init__(self, socket_path, timeout=60.0, health_timeout=2.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self.health_timeout = health_timeout
+
+    def _request(self, method, path, body=None, headers=None, timeout=None):
+        connection = UnixHTTPConnection(self.socket_path, timeout or self.timeout)
+        try:
+            connection.request(method, path, body=body, headers=headers or {})
+            return connection, connection.getresponse()
+        except Exception:
+            connection.close()
+            raise
+
+    def forward(self, incoming):
+        """Relay a Flask request to the owner and return its response"""
+        path = quote(incoming.path)
+        if incoming.query_string:
+            path += '?' + incoming.query_string.decode('latin-1')
+        headers = {
+            name: value for name, value in incoming.headers.items()
+            if name.lower() not in HOP_HEADERS
+        }
+
+        try:
+            connection, response = self._request(
+                incoming.method, path, incoming.get_data(), headers
+            )
+        except (OSError, http.client.HTTPException) as e:
+            logger.error(f"Device owner unavailable for {incoming.method} {incoming.path}: {e}")
+            return jsonify({
+                'success': False,
+                'message': f'Device owner unavailable: {e}'
+            }), 503
+
+        reply_headers = [
+            (name, value) for name, value in response.getheaders()
+            if name.lower() not in HOP_HEADERS
+            and not name.lower().startswith('access-control-')
+        ]
+
+        if response.getheader('Content-Type', '').startswith('text/event-stream'):
+            def relay():
+                try:
+                    while True:
+                        chunk = response.read1(READ_SIZE)
+                        if not chunk:
+                            break
+                        yield chunk
+                except (OSError, http.client.HTTPException) as e:
+                    logger.warning(f"Device owner stream ended: {e!r}")
+                finally:
+                    connection.close()
+
+            return Response(relay(), status=response.status, headers=reply_headers)
+
+        try:
+            body = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            logger.error(f"Device owner reply lost for {incoming.method} {incoming.path}: {e!r}")
+            return jsonify({
+                'success': False,
+                'message': f'Device owner unavailable: {e!r}'
+            }), 503
+        finally:
+            connection.close()
+        return Response(body, status=response.status, headers=reply_headers)
+
+    def health(self):
+        """Reader fields of the owner's /health, with whether it answered"""
+        try:
+            connection, response = self._request('GET', '/health', timeout=self.health_timeout)
+            try:
+                status = json.loads(response.read())
+            finally:
+                connection.close()
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            logger.warning(f"Device owner health check failed: {e}")
+            return {'owner': False, 'reader_connected': False, 'readers': 0, 'monitoring': False}
+
+        health = {key: status[key] for key in OWNER_HEALTH_FIELDS if key in status}
+        health['owner'] = True
+        return health
+
+
+def install_worker(app, owner, gallery):
+    """
+    Route a worker's requests: its own endpoints are served locally, the
+    rest is forwarded to the owner. A memory-only gallery exists only in
+    the owner, so gallery reads are forwarded too in that case
+    """
+    local = set(WORKER_ENDPOINTS)
+    if gallery.persistence_status() is None:
+        local -= GALLERY_ENDPOINTS
+
+    @app.before_request
+    def route_to_owner():
+        if request.path not in local or request.args.get('process') == 'owner':
+            return owner.forward(request)
+        if request.path in GALLERY_ENDPOINTS:
+            gallery.refresh()
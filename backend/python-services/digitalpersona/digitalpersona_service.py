@@ -2,23 +2,23 @@
 """
 DigitalPersona U.are.U 4500 Fingerprint Reader Service
 Real-time fingerprint capture and template extraction
+The routes and monitoring are shared with the USB service (fingerprint_service.py)
 """
-import os
-import sys
-import time
 import base64
-import json
+import binascii
+import threading
+import time
 from datetime import datetime
-from typing import Optional, Dict, Any
 import logging
 
-# Flask for REST API
-from flask import Flask, jsonify, request
-from flask_cors import CORS
-
 # Image processing
 import numpy as np
-from PIL import Image
+
+from capture_pipeline import CapturedFrame
+from fingerprint_service import (
+    FINGER_POLL_INTERVAL, MOCK_LIFT_DELAY, BaseReader, compares_total, frame_pool, main, profiler, setup
+)
+from matching_pool import SCORER_SDK
 
 # DigitalPersona SDK
 try:
@@ -28,34 +28,19 @@ except ImportError:
     DPFPDD_AVAILABLE = False
     print("WARNING: dpfpdd not available. Using mock mode.")
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)
-
-# Global state
-reader = None
-latest_scan = None
-is_monitoring = False
-scan_callback = None
 
-
-class DigitalPersonaReader:
+class DigitalPersonaReader(BaseReader):
     """Wrapper for DigitalPersona U.are.U 4500 Reader"""
     
-    def __init__(self):
+    def __init__(self, reader_id=None):
+        super().__init__(reader_id)  # reader_id is the SDK reader name
         self.reader = None
-        self.template = None
-        self.image = None
-        self.is_connected = False
-        
-    def connect(self):
-        """Connect to the fingerprint reader"""
+        self.mock_mode = not DPFPDD_AVAILABLE
+    
+    def _open(self):
+        """Open the reader through the SDK (mock mode without it)"""
         try:
             if not DPFPDD_AVAILABLE:
                 logger.warning("dpfpdd not available - using mock mode")
@@ -72,10 +57,18 @@ class DigitalPersonaReader:
                 logger.error("No DigitalPersona readers found")
                 return False
             
-            # Connect to first available reader
-            self.reader.open(readers[0])
+            # Connect to the named reader, or the first available one
+            selected = next(
+                (name for name in readers if self.reader_id in (None, str(name))),
+                None
+            )
+            if selected is None:
+                logger.error(f"Reader {self.reader_id} not found")
+                return False
+            
+            self.reader.open(selected)
             self.is_connected = True
-            logger.info(f"Connected to reader: {readers[0]}")
+            logger.info(f"Connected to reader: {selected}")
             return True
             
         except Exception as e:
@@ -83,6 +76,17 @@ class DigitalPersonaReader:
             self.is_connected = False
             return False
     
+    def status_fields(self):
+        """Reader-specific fields of /reader/status"""
+        return {'dpfpdd_available': DPFPDD_AVAILABLE}
+    
+    def check(self):
+        """Whether the reader is still attached, for the connection supervisor"""
+        if not DPFPDD_AVAILABLE:
+            return True
+        names = [str(name) for name in dpfpdd.get_readers()]
+        return bool(names) if self.reader_id is None else self.reader_id in names
+    
     def disconnect(self):
         """Disconnect from the reader"""
         try:
@@ -93,50 +97,114 @@ class DigitalPersonaReader:
         except Exception as e:
             logger.error(f"Error disconnecting: {e}")
     
-    def capture_fingerprint(self, timeout=10):
+    def acquire_frame(self, timeout=10, cancel=None):
         """
-        Capture a fingerprint image
-        Returns: (success, image_data, template_data)
+        Wait for a finger and return the raw capture, without post-processing
+        Setting the cancel event (threading.Event) ends the wait early
+        Returns: CapturedFrame, or None on timeout, cancellation or error
         """
+        cancel = cancel or threading.Event()
+        
         try:
             if not DPFPDD_AVAILABLE:
                 # Mock mode for testing
-                return self._mock_capture()
+                return self._mock_capture(cancel)
             
             if not self.is_connected:
-                self.connect()
+                # Connecting is the supervisor's job, never a capture's
+                logger.warning("Reader not connected")
+                return None
             
             # Capture fingerprint image
             logger.info("Waiting for finger placement...")
-            start_time = time.time()
+            deadline = time.time() + timeout
             
-            while time.time() - start_time < timeout:
+            while time.time() < deadline and not cancel.is_set():
                 try:
                     # Capture image from reader
-                    fid = self.reader.capture(dpfpdd.QUALITY_GOOD)
+                    with profiler.span('reader.capture'):
+                        fid = self.reader.capture(dpfpdd.QUALITY_GOOD)
                     
                     if fid:
-                        # Convert to image
-                        self.image = self._fid_to_image(fid)
-                        
-                        # Extract template
-                        self.template = self._extract_template(fid)
-                        
                         logger.info("Fingerprint captured successfully")
-                        
-                        return True, self.image, self.template
+                        with profiler.span('fid_copy'):
+                            pixels = self._fid_pixels(fid)
+                        return CapturedFrame(fid, pixels=pixels, pool=frame_pool)
                         
                 except dpfpdd.ReaderException as e:
                     # Reader is waiting for finger
-                    time.sleep(0.1)
+                    self._wait_for_finger(cancel, deadline)
                     continue
             
-            logger.warning("Capture timeout - no finger detected")
-            return False, None, None
+            if cancel.is_set():
+                logger.info("Capture cancelled")
+            else:
+                logger.warning("Capture timeout - no finger detected")
+            return None
             
         except Exception as e:
             logger.error(f"Capture error: {e}")
-            return False, None, None
+            return None
+    
+    def finger_present(self):
+        """
+        Finger-detect status of the sensor
+        Returns: True/False, or None if the reader does not report it
+        """
+        get_status = getattr(self.reader, 'get_status', None)
+        if not DPFPDD_AVAILABLE or get_status is None:
+            return None
+        try:
+            return bool(getattr(get_status(), 'finger_detected', False))
+        except Exception:
+            return None
+    
+    def _wait_for_finger(self, cancel, deadline):
+        """
+        Wait for the finger-detect status before the next capture call
+        Without a status, pause one poll interval; cancel ends either wait
+        """
+        while not cancel.is_set() and time.time() < deadline:
+            present = self.finger_present()
+            if present:
+                return
+            cancel.wait(FINGER_POLL_INTERVAL)
+            if present is None:
+                return
+    
+    def wait_for_lift(self, cancel=None):
+        """
+        Block until the finger leaves the sensor
+        Returns: True once lifted, False if cancelled, None if the reader
+        cannot tell (the caller falls back to a fixed pause)
+        """
+        cancel = cancel or threading.Event()
+        
+        if not DPFPDD_AVAILABLE:
+            # Mock finger lifts shortly after the capture
+            return not cancel.wait(MOCK_LIFT_DELAY)
+        
+        while not cancel.is_set():
+            present = self.finger_present()
+            if present is None:
+                return None
+            if not present:
+                return True
+            cancel.wait(FINGER_POLL_INTERVAL)
+        return False
+    
+    def extract_frame(self, frame):
+        """
+        Extract the template of a captured frame, once
+        Frames scoring below MIN_QUALITY are rejected before create_fmd runs
+        """
+        if not self.quality_ok(frame):
+            return None
+        if frame.template is None:
+            frame.template = self._extract_template(frame.raw)
+            # The FID is only needed for extraction; its pixels are in the pool
+            frame.raw = None
+        return frame.template
     
     def _extract_template(self, fid):
         """Extract fingerprint template from FID"""
@@ -145,7 +213,8 @@ class DigitalPersonaReader:
                 return base64.b64encode(b"MOCK_TEMPLATE_DATA").decode()
             
             # Create feature set
-            feature_set = dpfpdd.create_fmd(fid, dpfpdd.FMD_FORMAT_ANSI_378_2004)
+            with profiler.span('create_fmd'):
+                feature_set = dpfpdd.create_fmd(fid, dpfpdd.FMD_FORMAT_ANSI_378_2004)
             
             # Convert to base64
             template_bytes = bytes(feature_set)
@@ -157,348 +226,114 @@ class DigitalPersonaReader:
             logger.error(f"Template extraction error: {e}")
             return None
     
-    def _fid_to_image(self, fid):
-        """Convert FID to PIL Image"""
+    def _fid_pixels(self, fid):
+        """
+        Copy the FID's image into a pooled buffer
+        The only copy on the image path; views and encoders read the buffer
+        """
         try:
-            if not DPFPDD_AVAILABLE:
-                # Create mock image
-                img_array = np.random.randint(0, 255, (500, 400), dtype=np.uint8)
-                return Image.fromarray(img_array, mode='L')
-            
-            # Get image data from FID
             width = fid.width
             height = fid.height
-            data = fid.data
-            
-            # Create numpy array
-            img_array = np.frombuffer(data, dtype=np.uint8)
-            img_array = img_array.reshape((height, width))
             
-            # Convert to PIL Image
-            return Image.fromarray(img_array, mode='L')
+            pixels = frame_pool.frame(height, width)
+            np.copyto(pixels, np.frombuffer(fid.data, dtype=np.uint8, count=height * width).reshape(height, width))
+            return pixels
             
         except Exception as e:
             logger.error(f"Image conversion error: {e}")
             return None
     
-    def _mock_capture(self):
+    def _mock_capture(self, cancel):
         """Mock capture for testing without hardware"""
         logger.info("MOCK MODE: Simulating fingerprint capture")
-        time.sleep(1)  # Simulate capture delay
+        if cancel.wait(1):  # Simulate capture delay
+            return None
         
-        # Create mock grayscale fingerprint image
-        img_array = np.random.randint(100, 200, (500, 400), dtype=np.uint8)
-        mock_image = Image.fromarray(img_array, mode='L')
+        # Create mock grayscale fingerprint image: noisy concentric ridges
+        pixels = frame_pool.frame(500, 400)
+        y, x = np.ogrid[:500, :400]
+        ridges = 150 + 60 * np.sin(np.hypot(x - 200, y - 250) / 1.6)
+        pixels[...] = np.clip(ridges + np.random.normal(0, 10, pixels.shape), 0, 255)
         
         # Create mock template
         mock_template = base64.b64encode(
             f"MOCK_TEMPLATE_{datetime.now().timestamp()}".encode()
         ).decode()
         
-        return True, mock_image, mock_template
-    
-    def image_to_base64(self, image):
-        """Convert PIL Image to base64 string"""
-        try:
-            from io import BytesIO
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            return img_str
-        except Exception as e:
-            logger.error(f"Image encoding error: {e}")
-            return None
+        return CapturedFrame(template=mock_template, pixels=pixels, pool=frame_pool)
     
-    def compare_templates(self, template1, template2, threshold=0.6):
+    def compare_templates(self, template1, template2, threshold=None):
         """
-        Compare two fingerprint templates
+        Compare two fingerprint templates using the SDK
         Returns: (match, similarity_score)
         """
-        try:
-            if not DPFPDD_AVAILABLE:
-                # Mock comparison
-                return True, 0.85
-            
-            # Decode base64 templates
-            t1_bytes = base64.b64decode(template1)
-            t2_bytes = base64.b64decode(template2)
-            
-            # Compare using DigitalPersona SDK
-            result = dpfpdd.compare(t1_bytes, t2_bytes)
-            
-            # result is dissimilarity score (0 = identical, higher = more different)
-            similarity = 1.0 - (result / 100000.0)
-            match = similarity >= threshold
-            
-            return match, similarity
-            
-        except Exception as e:
-            logger.error(f"Comparison error: {e}")
-            return False, 0.0
-
-
-# Initialize global reader
-reader = DigitalPersonaReader()
-
-
-# ==================== REST API ENDPOINTS ====================
-
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'running',
-        'service': 'DigitalPersona Fingerprint Service',
-        'reader_connected': reader.is_connected,
-        'monitoring': is_monitoring,
-        'dpfpdd_available': DPFPDD_AVAILABLE,
-        'timestamp': datetime.now().isoformat()
-    })
-
-
-@app.route('/reader/connect', methods=['POST'])
-def connect_reader():
-    """Connect to the fingerprint reader"""
-    success = reader.connect()
+        if not DPFPDD_AVAILABLE:
+            # Mock comparison
+            compares_total.inc('mock')
+            return True, 0.85
+        return super().compare_templates(template1, template2, threshold)
     
-    return jsonify({
-        'success': success,
-        'connected': reader.is_connected,
-        'message': 'Connected successfully' if success else 'Connection failed'
-    })
-
-
-@app.route('/reader/disconnect', methods=['POST'])
-def disconnect_reader():
-    """Disconnect from the fingerprint reader"""
-    reader.disconnect()
+    def decode_template(self, template):
+        """Raw FMD bytes of a base64 template, or None if it is not base64"""
+        try:
+            return base64.b64decode(template, validate=True)
+        except (binascii.Error, TypeError, ValueError) as e:
+            logger.warning(f"Unreadable template: {e}")
+            return None
     
-    return jsonify({
-        'success': True,
-        'connected': reader.is_connected,
-        'message': 'Disconnected successfully'
-    })
-
-
-@app.route('/reader/status', methods=['GET'])
-def reader_status():
-    """Get reader connection status"""
-    return jsonify({
-        'connected': reader.is_connected,
-        'monitoring': is_monitoring,
-        'dpfpdd_available': DPFPDD_AVAILABLE
-    })
-
-
-@app.route('/fingerprint/capture', methods=['POST'])
-def capture_fingerprint():
-    """
-    Capture a single fingerprint
-    Returns image and template
-    """
-    try:
-        timeout = request.json.get('timeout', 10) if request.json else 10
-        
-        success, image, template = reader.capture_fingerprint(timeout)
-        
-        if not success:
-            return jsonify({
-                'success': False,
-                'message': 'Fingerprint capture failed or timeout'
-            }), 400
-        
-        # Convert image to base64
-        image_b64 = reader.image_to_base64(image) if image else None
-        
-        return jsonify({
-            'success': True,
-            'template': template,
-            'image': image_b64,
-            'timestamp': datetime.now().isoformat(),
-            'message': 'Fingerprint captured successfully'
-        })
-        
-    except Exception as e:
-        logger.error(f"Capture endpoint error: {e}")
-        return jsonify({
-            'success': False,
-            'message': str(e)
-        }), 500
-
-
-@app.route('/fingerprint/compare', methods=['POST'])
-def compare_fingerprints():
-    """
-    Compare two fingerprint templates
-    Body: { template1, template2, threshold }
-    """
-    try:
-        data = request.json
-        template1 = data.get('template1')
-        template2 = data.get('template2')
-        threshold = data.get('threshold', 0.6)
-        
-        if not template1 or not template2:
-            return jsonify({
-                'success': False,
-                'message': 'Both templates required'
-            }), 400
-        
-        match, similarity = reader.compare_templates(template1, template2, threshold)
-        
-        return jsonify({
-            'success': True,
-            'match': match,
-            'similarity': similarity,
-            'threshold': threshold
-        })
+    def similarity(self, t1_bytes, t2_bytes):
+        """Similarity of two already-decoded templates using the SDK"""
+        # Compare using DigitalPersona SDK
+        result = dpfpdd.compare(t1_bytes, t2_bytes)
         
-    except Exception as e:
-        logger.error(f"Compare endpoint error: {e}")
-        return jsonify({
-            'success': False,
-            'message': str(e)
-        }), 500
-
-
-@app.route('/monitoring/start', methods=['POST'])
-def start_monitoring():
-    """Start continuous monitoring mode"""
-    global is_monitoring
+        # result is dissimilarity score (0 = identical, higher = more different)
+        return 1.0 - (result / 100000.0)
     
-    try:
-        if not reader.is_connected:
-            reader.connect()
+    def score_rows(self, probe_bytes, view, rows):
+        """
+        Score a decoded probe against GalleryView rows (a slice or index array)
+        Gallery templates are already raw bytes
+        Returns: float32 array of similarity scores
+        """
+        if isinstance(rows, slice):
+            rows = range(len(view))[rows]
         
-        is_monitoring = True
+        if not DPFPDD_AVAILABLE:
+            # Mock comparison
+            return np.full(len(rows), 0.85, dtype=np.float32)
         
-        # Start monitoring in background thread
-        import threading
-        monitoring_thread = threading.Thread(target=monitoring_loop, daemon=True)
-        monitoring_thread.start()
+        scores = np.zeros(len(rows), dtype=np.float32)
         
-        return jsonify({
-            'success': True,
-            'monitoring': is_monitoring,
-            'message': 'Monitoring started'
-        })
+        for i, row in enumerate(rows):
+            try:
+                scores[i] = self.similarity(probe_bytes, view.data[row])
+            except Exception as e:
+                logger.error(f"Comparison error for {view.ids[row]}: {e}")
         
-    except Exception as e:
-        logger.error(f"Start monitoring error: {e}")
-        return jsonify({
-            'success': False,
-            'message': str(e)
-        }), 500
-
-
-@app.route('/monitoring/stop', methods=['POST'])
-def stop_monitoring():
-    """Stop continuous monitoring mode"""
-    global is_monitoring, latest_scan
-    
-    is_monitoring = False
-    latest_scan = None
-    
-    return jsonify({
-        'success': True,
-        'monitoring': is_monitoring,
-        'message': 'Monitoring stopped'
-    })
+        return scores
 
 
-@app.route('/monitoring/poll', methods=['GET'])
-def poll_latest_scan():
-    """
-    Poll for latest fingerprint scan
-    Used by kiosk clients
-    """
-    global latest_scan
-    
-    if latest_scan:
-        scan_data = latest_scan
-        latest_scan = None  # Clear after retrieval
-        
-        return jsonify({
-            'hasNewScan': True,
-            'template': scan_data['template'],
-            'image': scan_data.get('image'),
-            'timestamp': scan_data['timestamp']
-        })
-    
-    return jsonify({
-        'hasNewScan': False,
-        'template': None,
-        'timestamp': None
-    })
-
+def enumerate_readers():
+    """Names of the attached readers; a single mock reader without the SDK"""
+    if not DPFPDD_AVAILABLE:
+        return ['mock']
+    return [str(name) for name in dpfpdd.get_readers()]
 
-def monitoring_loop():
-    """
-    Background monitoring loop
-    Continuously captures fingerprints when monitoring is active
-    """
-    global is_monitoring, latest_scan
-    
-    logger.info("Monitoring loop started")
-    
-    while is_monitoring:
-        try:
-            if not reader.is_connected:
-                reader.connect()
-            
-            # Capture fingerprint (with short timeout for continuous monitoring)
-            success, image, template = reader.capture_fingerprint(timeout=2)
-            
-            if success and template:
-                # Store latest scan
-                latest_scan = {
-                    'template': template,
-                    'image': reader.image_to_base64(image) if image else None,
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                logger.info(f"Fingerprint captured in monitoring mode")
-                
-                # Wait before next capture to avoid duplicates
-                time.sleep(3)
-            else:
-                # No finger detected, wait briefly
-                time.sleep(0.5)
-                
-        except Exception as e:
-            logger.error(f"Monitoring loop error: {e}")
-            time.sleep(1)
-    
-    logger.info("Monitoring loop stopped")
 
+setup(
+    DigitalPersonaReader,
+    enumerate_readers,
+    'DigitalPersona Fingerprint Service',
+    info={'dpfpdd_available': DPFPDD_AVAILABLE},
+    scorer=SCORER_SDK if DPFPDD_AVAILABLE else None
+)
 
-# ==================== MAIN ====================
 
 if __name__ == '__main__':
-    port = int(os.getenv('FINGERPRINT_SERVICE_PORT', 5000))
-    
-    logger.info("=" * 60)
-    logger.info("DigitalPersona U.are.U 4500 Fingerprint Service")
-    logger.info("=" * 60)
-    logger.info(f"Starting on port {port}...")
     logger.info(f"DPFPDD SDK Available: {DPFPDD_AVAILABLE}")
     
     if not DPFPDD_AVAILABLE:
         logger.warning("Running in MOCK MODE - no actual hardware connection")
         logger.warning("For production, install: pip install dpfpdd")
     
-    # Auto-connect to reader on startup
-    if reader.connect():
-        logger.info("✓ Reader connected on startup")
-    else:
-        logger.warning("⚠ Reader not connected - will retry on first use")
-    
-    logger.info("=" * 60)
-    
-    # Run Flask app
-    app.run(
-        host='0.0.0.0',
-        port=port,
-        debug=False,
-        threaded=True
-    )
\ No newline at end of file
+    main()
@@ -2,61 +2,68 @@
 """
 DigitalPersona U.are.U 4500 Fingerprint Reader Service (USB Version)
 Works directly with USB without proprietary SDK
+The routes and monitoring are shared with the SDK service (fingerprint_service.py)
 """
-import os
-import sys
-import time
 import base64
-import json
-from datetime import datetime
-from typing import Optional, Dict, Any
+import threading
+import time
 import logging
 
-from flask import Flask, jsonify, request
-from flask_cors import CORS
+from flask import jsonify
 
 import numpy as np
-from PIL import Image
 import usb.core
 import usb.util
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# ANSI 378 parsing and vectorized minutiae matching
+from ansi378 import encode_template, parse_template, synthetic_minutiae
+from minutiae_matcher import score_batch, score_pair
+
+from capture_pipeline import CapturedFrame
+from fingerprint_service import (
+    FINGER_POLL_INTERVAL, MOCK_LIFT_DELAY, BaseReader, app, frame_pool, main, setup
 )
-logger = logging.getLogger(__name__)
+from matching_pool import SCORER_MINUTIAE
 
-app = Flask(__name__)
-CORS(app)
+logger = logging.getLogger(__name__)
 
 # DigitalPersona U.are.U 4500 USB IDs
 DIGITALPERSONA_VENDOR_ID = 0x05ba  # DigitalPersona/Crossmatch
 DIGITALPERSONA_PRODUCT_ID = 0x000a  # U.are.U 4500
 
-# Global state
-reader = None
-latest_scan = None
-is_monitoring = False
+enumeration_error = None  # last USB enumeration failure, logged once
+
 
+def usb_reader_id(device):
+    """Stable id of a reader for as long as it stays plugged in"""
+    return f"usb-{device.bus}-{device.address}"
 
-class DigitalPersonaUSBReader:
+
+class DigitalPersonaUSBReader(BaseReader):
     """Direct USB communication with DigitalPersona U.are.U 4500"""
     
-    def __init__(self):
+    threshold = 0.65
+    
+    def __init__(self, reader_id=None):
+        super().__init__(reader_id)  # None (or 'mock') takes the first reader found
         self.device = None
         self.endpoint_in = None
         self.endpoint_out = None
-        self.is_connected = False
-        self.mock_mode = False
-        
+    
     def find_device(self):
         """Find DigitalPersona device on USB"""
         try:
-            # Find the device
-            device = usb.core.find(
-                idVendor=DIGITALPERSONA_VENDOR_ID,
-                idProduct=DIGITALPERSONA_PRODUCT_ID
+            # Find the device, or the first one when no id was given
+            device = next(
+                (
+                    dev for dev in usb.core.find(
+                        find_all=True,
+                        idVendor=DIGITALPERSONA_VENDOR_ID,
+                        idProduct=DIGITALPERSONA_PRODUCT_ID
+                    )
+                    if self.reader_id in (None, 'mock', usb_reader_id(dev))
+                ),
+                None
             )
             
             if device is None:
@@ -73,8 +80,8 @@ class DigitalPersonaUSBReader:
             logger.error(f"Error finding device: {e}")
             return None
     
-    def connect(self):
-        """Connect to the fingerprint reader"""
+    def _open(self):
+        """Find and configure the USB device, falling back to mock mode"""
         try:
             logger.info("Searching for DigitalPersona U.are.U 4500...")
             
@@ -132,6 +139,20 @@ class DigitalPersonaUSBReader:
             self.is_connected = True
             return True
     
+    def check(self):
+        """Whether the device is still on the bus, for the connection supervisor"""
+        if self.mock_mode or self.device is None:
+            return True
+        current = usb_reader_id(self.device)
+        return any(
+            usb_reader_id(dev) == current
+            for dev in usb.core.find(
+                find_all=True,
+                idVendor=DIGITALPERSONA_VENDOR_ID,
+                idProduct=DIGITALPERSONA_PRODUCT_ID
+            )
+        )
+    
     def disconnect(self):
         """Disconnect from the reader"""
         try:
@@ -145,14 +166,21 @@ class DigitalPersonaUSBReader:
         except Exception as e:
             logger.error(f"Error disconnecting: {e}")
     
-    def capture_fingerprint(self, timeout=10):
+    def acquire_frame(self, timeout=10, cancel=None):
         """
-        Capture a fingerprint image
-        Returns: (success, image_data, template_data)
+        Wait for a finger and return the capture for the monitoring pipeline
+        Setting the cancel event (threading.Event) ends the wait early
+        Returns: CapturedFrame, or None on timeout, cancellation or error
         """
+        cancel = cancel or threading.Event()
+        
         try:
-            if self.mock_mode or not self.is_connected:
-                return self._mock_capture()
+            if not self.is_connected:
+                # Connecting is the supervisor's job, never a capture's
+                logger.warning("Reader not connected")
+                return None
+            if self.mock_mode:
+                return self._mock_capture(cancel)
             
             logger.info("Waiting for finger placement on real device...")
             
@@ -162,7 +190,7 @@ class DigitalPersonaUSBReader:
             start_time = time.time()
             
             # Try to read from device
-            while time.time() - start_time < timeout:
+            while time.time() - start_time < timeout and not cancel.is_set():
                 try:
                     # Read image data from device
                     # DigitalPersona devices typically send raw image data
@@ -171,300 +199,133 @@ class DigitalPersonaUSBReader:
                     # This is where you'd implement the actual USB protocol
                     # For now, fall back to mock
                     logger.info("Real USB capture not fully implemented - using mock")
-                    return self._mock_capture()
+                    return self._mock_capture(cancel)
                     
                 except usb.core.USBError as e:
                     if e.errno == 110:  # Timeout
-                        time.sleep(0.1)
+                        cancel.wait(FINGER_POLL_INTERVAL)
                         continue
                     else:
                         logger.error(f"USB error: {e}")
                         break
             
-            logger.warning("Capture timeout - no finger detected")
-            return False, None, None
+            if cancel.is_set():
+                logger.info("Capture cancelled")
+            else:
+                logger.warning("Capture timeout - no finger detected")
+            return None
             
         except Exception as e:
             logger.error(f"Capture error: {e}")
-            return False, None, None
+            return None
     
-    def _mock_capture(self):
+    def wait_for_lift(self, cancel=None):
+        """
+        Block until the finger leaves the sensor
+        Returns: True once lifted, False if cancelled, None if the reader
+        cannot tell (the caller falls back to a fixed pause)
+        """
+        cancel = cancel or threading.Event()
+        
+        if self.mock_mode:
+            # Mock finger lifts shortly after the capture
+            return not cancel.wait(MOCK_LIFT_DELAY)
+        
+        # Finger-detect status is not part of the implemented USB protocol yet
+        return None
+    
+    def extract_frame(self, frame):
+        """Template of a captured frame (already extracted at capture), unless its quality is too low"""
+        if not self.quality_ok(frame):
+            return None
+        return frame.template
+    
+    def _mock_capture(self, cancel):
         """Mock capture for testing without hardware"""
         logger.info("MOCK MODE: Simulating fingerprint capture")
-        time.sleep(1)  # Simulate capture delay
+        if cancel.wait(1):  # Simulate capture delay
+            return None
         
         # Create mock fingerprint image (355x391 for U.are.U 4500)
         width, height = 355, 391
         
-        # Create a fingerprint-like pattern
-        img_array = np.random.randint(100, 200, (height, width), dtype=np.uint8)
+        # Create a fingerprint-like pattern in a pooled buffer
+        pixels = frame_pool.frame(height, width)
+        pixels[...] = np.random.randint(100, 200, (height, width), dtype=np.uint8)
         
         # Add some fingerprint-like ridges
         for i in range(0, height, 10):
-            img_array[i:i+2, :] = np.random.randint(50, 100, width)
+            pixels[i:i+2, :] = np.random.randint(50, 100, width)
         
-        mock_image = Image.fromarray(img_array, mode='L')
-        
-        # Create mock template
+        # Create mock ANSI 378 template with random minutiae
+        minutiae = synthetic_minutiae(np.random.default_rng(), width=width, height=height)
         mock_template = base64.b64encode(
-            f"DIGITALPERSONA_4500_TEMPLATE_{datetime.now().timestamp()}".encode()
+            encode_template(minutiae, width=width, height=height)
         ).decode()
         
-        return True, mock_image, mock_template
+        return CapturedFrame(template=mock_template, pixels=pixels, pool=frame_pool)
     
-    def image_to_base64(self, image):
-        """Convert PIL Image to base64 string"""
-        try:
-            from io import BytesIO
-            buffered = BytesIO()
-            image.save(buffered, format="PNG")
-            img_str = base64.b64encode(buffered.getvalue()).decode()
-            return img_str
-        except Exception as e:
-            logger.error(f"Image encoding error: {e}")
-            return None
+    def status_fields(self):
+        """Reader-specific fields of /reader/status"""
+        return {'device_found': self.device is not None}
     
-    def compare_templates(self, template1, template2, threshold=0.65):
+    def decode_template(self, template):
         """
-        Compare two fingerprint templates
-        In production, use proper fingerprint matching algorithm
+        Decode a base64 ANSI 378 template into its minutiae array
+        Returns None if the template is not a valid record
         """
         try:
-            # Mock comparison based on string similarity
-            if template1 == template2:
-                return True, 1.0
-            
-            # Simple mock similarity
-            similarity = 0.5 + (0.4 * np.random.random())
-            match = similarity >= threshold
-            
-            return match, similarity
-            
+            return parse_template(base64.b64decode(template)).minutiae
         except Exception as e:
-            logger.error(f"Comparison error: {e}")
-            return False, 0.0
-
-
-# Initialize global reader
-reader = DigitalPersonaUSBReader()
-
-
-# ==================== REST API ENDPOINTS ====================
-
-@app.route('/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'running',
-        'service': 'DigitalPersona Fingerprint Service (USB)',
-        'reader_connected': reader.is_connected,
-        'mock_mode': reader.mock_mode,
-        'monitoring': is_monitoring,
-        'device_model': 'U.are.U 4500',
-        'timestamp': datetime.now().isoformat()
-    })
-
-
-@app.route('/reader/connect', methods=['POST'])
-def connect_reader():
-    """Connect to the fingerprint reader"""
-    success = reader.connect()
+            logger.warning(f"Unreadable template: {e}")
+            return None
     
-    return jsonify({
-        'success': success,
-        'connected': reader.is_connected,
-        'mock_mode': reader.mock_mode,
-        'message': 'Connected successfully' if success else 'Connection failed'
-    })
-
-
-@app.route('/reader/disconnect', methods=['POST'])
-def disconnect_reader():
-    """Disconnect from the fingerprint reader"""
-    reader.disconnect()
+    def similarity(self, minutiae1, minutiae2):
+        """Similarity of two parsed minutiae arrays, no SDK required"""
+        return score_pair(minutiae1, minutiae2)
     
-    return jsonify({
-        'success': True,
-        'connected': reader.is_connected,
-        'message': 'Disconnected successfully'
-    })
-
-
-@app.route('/reader/status', methods=['GET'])
-def reader_status():
-    """Get reader connection status"""
-    return jsonify({
-        'connected': reader.is_connected,
-        'mock_mode': reader.mock_mode,
-        'monitoring': is_monitoring,
-        'device_found': reader.device is not None
-    })
-
-
-@app.route('/fingerprint/capture', methods=['POST'])
-def capture_fingerprint():
-    """Capture a single fingerprint"""
-    try:
-        timeout = request.json.get('timeout', 10) if request.json else 10
-        
-        success, image, template = reader.capture_fingerprint(timeout)
-        
-        if not success:
-            return jsonify({
-                'success': False,
-                'message': 'Fingerprint capture failed or timeout'
-            }), 400
-        
-        image_b64 = reader.image_to_base64(image) if image else None
-        
-        return jsonify({
-            'success': True,
-            'template': template,
-            'image': image_b64,
-            'timestamp': datetime.now().isoformat(),
-            'mock_mode': reader.mock_mode,
-            'message': 'Fingerprint captured successfully'
-        })
-        
-    except Exception as e:
-        logger.error(f"Capture endpoint error: {e}")
-        return jsonify({
-            'success': False,
-            'message': str(e)
-        }), 500
-
-
-@app.route('/fingerprint/compare', methods=['POST'])
-def compare_fingerprints():
-    """Compare two fingerprint templates"""
-    try:
-        data = request.json
-        template1 = data.get('template1')
-        template2 = data.get('template2')
-        threshold = data.get('threshold', 0.65)
-        
-        if not template1 or not template2:
-            return jsonify({
-                'success': False,
-                'message': 'Both templates required'
-            }), 400
+    def score_rows(self, minutiae, view, rows):
+        """
+        Score parsed probe minutiae against GalleryView rows (a slice or index array)
+        One vectorized pass over the pre-parsed, packed gallery minutiae
+        Returns: float32 array of similarity scores
+        """
+        packed = view.packed.select(rows)
         
-        match, similarity = reader.compare_templates(template1, template2, threshold)
+        if minutiae is None:
+            return np.zeros(len(packed), dtype=np.float32)
         
-        return jsonify({
-            'success': True,
-            'match': match,
-            'similarity': similarity,
-            'threshold': threshold
-        })
-        
-    except Exception as e:
-        logger.error(f"Compare endpoint error: {e}")
-        return jsonify({
-            'success': False,
-            'message': str(e)
-        }), 500
+        return score_batch(minutiae, packed)
 
 
-@app.route('/monitoring/start', methods=['POST'])
-def start_monitoring():
-    """Start continuous monitoring mode"""
-    global is_monitoring
+def enumerate_readers():
+    """Ids of the attached readers; a single mock reader when none is plugged in"""
+    global enumeration_error
     
     try:
-        if not reader.is_connected:
-            reader.connect()
-        
-        is_monitoring = True
-        
-        import threading
-        monitoring_thread = threading.Thread(target=monitoring_loop, daemon=True)
-        monitoring_thread.start()
-        
-        return jsonify({
-            'success': True,
-            'monitoring': is_monitoring,
-            'mock_mode': reader.mock_mode,
-            'message': 'Monitoring started'
-        })
-        
+        devices = usb.core.find(
+            find_all=True,
+            idVendor=DIGITALPERSONA_VENDOR_ID,
+            idProduct=DIGITALPERSONA_PRODUCT_ID
+        )
+        enumeration_error = None
+        return [usb_reader_id(dev) for dev in devices] or ['mock']
     except Exception as e:
-        logger.error(f"Start monitoring error: {e}")
-        return jsonify({
-            'success': False,
-            'message': str(e)
-        }), 500
-
-
-@app.route('/monitoring/stop', methods=['POST'])
-def stop_monitoring():
-    """Stop continuous monitoring mode"""
-    global is_monitoring, latest_scan
-    
-    is_monitoring = False
-    latest_scan = None
-    
-    return jsonify({
-        'success': True,
-        'monitoring': is_monitoring,
-        'message': 'Monitoring stopped'
-    })
-
-
-@app.route('/monitoring/poll', methods=['GET'])
-def poll_latest_scan():
-    """Poll for latest fingerprint scan"""
-    global latest_scan
-    
-    if latest_scan:
-        scan_data = latest_scan
-        latest_scan = None
-        
-        return jsonify({
-            'hasNewScan': True,
-            'template': scan_data['template'],
-            'image': scan_data.get('image'),
-            'timestamp': scan_data['timestamp'],
-            'mock_mode': reader.mock_mode
-        })
-    
-    return jsonify({
-        'hasNewScan': False,
-        'template': None,
-        'timestamp': None
-    })
-
-
-def monitoring_loop():
-    """Background monitoring loop"""
-    global is_monitoring, latest_scan
-    
-    logger.info("Monitoring loop started")
-    
-    while is_monitoring:
-        try:
-            if not reader.is_connected:
-                reader.connect()
-            
-            success, image, template = reader.capture_fingerprint(timeout=2)
-            
-            if success and template:
-                latest_scan = {
-                    'template': template,
-                    'image': reader.image_to_base64(image) if image else None,
-                    'timestamp': datetime.now().isoformat()
-                }
-                
-                logger.info(f"Fingerprint captured in monitoring mode (Mock: {reader.mock_mode})")
-                time.sleep(3)
-            else:
-                time.sleep(0.5)
-                
-        except Exception as e:
-            logger.error(f"Monitoring loop error: {e}")
-            time.sleep(1)
-    
-    logger.info("Monitoring loop stopped")
+        # The supervisor enumerates on every hotplug check; warn once per failure
+        if str(e) != enumeration_error:
+            logger.warning(f"USB enumeration failed ({e}) - using MOCK mode")
+        enumeration_error = str(e)
+        return ['mock']
+
+
+setup(
+    DigitalPersonaUSBReader,
+    enumerate_readers,
+    'DigitalPersona Fingerprint Service (USB)',
+    info={'device_model': 'U.are.U 4500'},
+    scorer=SCORER_MINUTIAE,
+    placeholder='mock'
+)
 
 
 # ==================== USB INFO ENDPOINT ====================
@@ -507,24 +368,4 @@ def list_usb_devices():
 
 
 if __name__ == '__main__':
-    port = int(os.getenv('FINGERPRINT_SERVICE_PORT', 5000))
-    
-    logger.info("=" * 60)
-    logger.info("DigitalPersona U.are.U 4500 Fingerprint Service (USB)")
-    logger.info("=" * 60)
-    logger.info(f"Starting on port {port}...")
-    
-    # Auto-connect to reader on startup
-    if reader.connect():
-        logger.info(f"✓ Reader connected (Mock Mode: {reader.mock_mode})")
-    else:
-        logger.warning("⚠ Reader not connected")
-    
-    logger.info("=" * 60)
-    
-    app.run(
-        host='0.0.0.0',
-        port=port,
-        debug=False,
-        threaded=True
-    )
\ No newline at end of file
+    main()
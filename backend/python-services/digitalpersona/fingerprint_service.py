@@ -0,0 +1,1474 @@
+# python-services/digitalpersona/fingerprint_service.py
+"""
+Fingerprint service app shared by the SDK and USB services
+Routes, request hooks, the monitoring pipeline stages and startup live here;
+a service module defines its reader class (a BaseReader) and template
+matcher and hands them to setup() when it is imported
+"""
+import os
+import sys
+import time
+import hmac
+import threading
+from datetime import datetime
+from functools import partial
+from concurrent.futures.process import BrokenProcessPool
+import logging
+
+# Flask for REST API
+from flask import Flask, Response, g, jsonify, request
+from flask_cors import CORS
+
+from capture_pipeline import CapturePipeline
+from compare_cache import CompareCache
+from device_owner import OwnerClient, install_worker
+from frame_buffer import FrameBuffer
+from frame_pool import FramePool, pixels_image
+from frame_quality import assess_quality
+from gallery_snapshot import GalleryStore
+from image_codec import ImageCodec
+from metrics import CONTENT_TYPE, MetricsRegistry, SharedMetrics, register_service_metrics
+from profiling import Profiler, SharedProfile, folded_spans
+from gallery_search import SearchOptions, search_rows
+from matching_pool import MatchingPool
+from reader_registry import ReaderNotFound, ReaderRegistry
+from reader_supervisor import ReaderSupervisor
+from scan_events import ScanBroadcaster, ScanEventLog, stream_events
+from template_gallery import GalleryView, TemplateGallery, template_entries
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+CORS(app)
+
+# Gallery persistence (set FINGERPRINT_GALLERY_DIR empty to keep it in memory only)
+GALLERY_DIR = os.getenv(
+    'FINGERPRINT_GALLERY_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gallery')
+)
+GALLERY_COMPACT_INTERVAL = int(os.getenv('FINGERPRINT_GALLERY_COMPACT_INTERVAL', 60))
+GALLERY_COMPACT_RECORDS = int(os.getenv('FINGERPRINT_GALLERY_COMPACT_RECORDS', 1000))
+
+# Serving role: standalone (one process), owner (holds the readers and serves the workers
+# on OWNER_SOCKET) or worker (pre-forked HTTP worker, see wsgi_service.py)
+SERVICE_ROLE = os.getenv('FINGERPRINT_ROLE', 'standalone')
+OWNER_SOCKET = os.getenv('FINGERPRINT_OWNER_SOCKET', '/tmp/digitalpersona-owner.sock')
+OWNER_TIMEOUT = float(os.getenv('FINGERPRINT_OWNER_TIMEOUT', 60))
+# Workers write their counters and histograms here for the owner's /metrics
+METRICS_DIR = os.getenv('FINGERPRINT_METRICS_DIR', '/tmp/digitalpersona-metrics')
+METRICS_WRITE_INTERVAL = float(os.getenv('FINGERPRINT_METRICS_WRITE_INTERVAL', 5))
+if SERVICE_ROLE not in ('standalone', 'owner', 'worker'):
+    raise ValueError(f"FINGERPRINT_ROLE must be standalone, owner or worker, not {SERVICE_ROLE}")
+
+# Multi-process 1:N matching (set FINGERPRINT_MATCH_WORKERS to 1 to disable)
+# HTTP workers already scale matching out, so they default to matching in-process
+MATCH_WORKERS = int(os.getenv(
+    'FINGERPRINT_MATCH_WORKERS',
+    1 if SERVICE_ROLE == 'worker' else os.cpu_count() or 1
+))
+POOL_MIN_GALLERY = int(os.getenv('FINGERPRINT_POOL_MIN_GALLERY', 2000))
+
+# Triplet pre-filter ahead of full 1:N matching (set FINGERPRINT_PREFILTER to 0 to disable)
+PREFILTER_ENABLED = os.getenv('FINGERPRINT_PREFILTER', '1') != '0'
+
+# Cache of recent 1:1 compare results (set FINGERPRINT_COMPARE_CACHE_SIZE to 0 to disable)
+COMPARE_CACHE_SIZE = int(os.getenv('FINGERPRINT_COMPARE_CACHE_SIZE', 4096))
+COMPARE_CACHE_TTL = float(os.getenv('FINGERPRINT_COMPARE_CACHE_TTL', 60))
+
+# Scan events kept for pollers and stream resumes, and the most one poll returns
+SCAN_BUFFER_DEPTH = int(os.getenv('FINGERPRINT_SCAN_BUFFER_DEPTH', 256))
+POLL_BATCH_LIMIT = int(os.getenv('FINGERPRINT_POLL_BATCH_LIMIT', 50))
+
+# Scan event streaming: per-client queue depth, keep-alive seconds
+STREAM_CLIENT_DEPTH = int(os.getenv('FINGERPRINT_STREAM_CLIENT_DEPTH', 64))
+STREAM_HEARTBEAT = float(os.getenv('FINGERPRINT_STREAM_HEARTBEAT', 15))
+
+# Preview images are opt-in (includeImage / ?image=1); raw frames are kept this long for on-demand encoding
+INCLUDE_IMAGE = os.getenv('FINGERPRINT_INCLUDE_IMAGE', '0') == '1'
+IMAGE_BUFFER_FRAMES = int(os.getenv('FINGERPRINT_IMAGE_BUFFER_FRAMES', 32))
+IMAGE_BUFFER_TTL = float(os.getenv('FINGERPRINT_IMAGE_BUFFER_TTL', 30))
+
+# Default preview encoding (raw, png, webp or jpeg), overridable per request
+IMAGE_FORMAT = os.getenv('FINGERPRINT_IMAGE_FORMAT', 'png')
+IMAGE_MAX_SIZE = int(os.getenv('FINGERPRINT_IMAGE_MAX_SIZE', 0))  # thumbnail side, 0 for full size
+IMAGE_QUALITY = int(os.getenv('FINGERPRINT_IMAGE_QUALITY', 80))
+PNG_COMPRESS_LEVEL = int(os.getenv('FINGERPRINT_PNG_COMPRESS_LEVEL', 1))
+
+# Reusable capture buffers: how many, and the pixels each holds (frames above that are allocated)
+FRAME_POOL_SIZE = int(os.getenv('FINGERPRINT_FRAME_POOL_SIZE', 48))
+FRAME_POOL_PIXELS = int(os.getenv('FINGERPRINT_FRAME_POOL_PIXELS', 500 * 400))
+
+# Captures scoring below this (0-100) are rejected before template extraction (0 to disable)
+MIN_QUALITY = int(os.getenv('FINGERPRINT_MIN_QUALITY', 30))
+
+# Finger detection: status poll interval, and the pause after a scan when the reader can't report a lift
+FINGER_POLL_INTERVAL = float(os.getenv('FINGERPRINT_FINGER_POLL_MS', 20)) / 1000.0
+SCAN_COOLDOWN = float(os.getenv('FINGERPRINT_SCAN_COOLDOWN', 3))
+MOCK_LIFT_DELAY = 0.5  # seconds a mock finger stays on the sensor after a capture
+
+# Monitoring pipeline: template extraction and frame buffering threads, queue depth per stage
+EXTRACT_WORKERS = int(os.getenv('FINGERPRINT_EXTRACT_WORKERS', 1))
+ENCODE_WORKERS = int(os.getenv('FINGERPRINT_ENCODE_WORKERS', 1))
+PIPELINE_QUEUE_DEPTH = int(os.getenv('FINGERPRINT_PIPELINE_QUEUE_DEPTH', 4))
+
+# Identify every monitored scan against the local gallery (overridable per /monitoring/start)
+MONITOR_IDENTIFY = os.getenv('FINGERPRINT_MONITOR_IDENTIFY', '0') == '1'
+MONITOR_THRESHOLD = os.getenv('FINGERPRINT_MONITOR_THRESHOLD')  # unset: the reader's match threshold
+
+# Reader supervisor: health/hotplug check interval, reconnect backoff bounds (seconds)
+RECONNECT_INTERVAL = float(os.getenv('FINGERPRINT_RECONNECT_INTERVAL', 2))
+RECONNECT_BACKOFF_MIN = float(os.getenv('FINGERPRINT_RECONNECT_BACKOFF_MIN', 1))
+RECONNECT_BACKOFF_MAX = float(os.getenv('FINGERPRINT_RECONNECT_BACKOFF_MAX', 60))
+HOTPLUG_ENABLED = os.getenv('FINGERPRINT_HOTPLUG', '1') != '0'
+
+# Sampled request traces and on-demand stack samples (switchable at runtime via /admin/profile)
+PROFILE_ENABLED = os.getenv('FINGERPRINT_PROFILE', '0') == '1'
+PROFILE_SAMPLE_RATE = float(os.getenv('FINGERPRINT_PROFILE_SAMPLE_RATE', 0.01))
+PROFILE_TRACES = int(os.getenv('FINGERPRINT_PROFILE_TRACES', 100))
+PROFILE_SYNC_INTERVAL = float(os.getenv('FINGERPRINT_PROFILE_SYNC_INTERVAL', 1))
+
+# Required in X-Admin-Token for /admin endpoints when set; without it they
+# answer local clients only
+ADMIN_TOKEN = os.getenv('FINGERPRINT_ADMIN_TOKEN', '')
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+# Global state (the service's reader, registry and supervisor are set by setup())
+SERVICE_NAME = None
+SERVICE_INFO = {}  # extra /health fields of the service
+reader = None  # matches templates for compare/identify
+readers = None
+supervisor = None
+matching_pool = None
+owner = None  # OwnerClient in worker processes
+monitor_identify = None  # (threshold, SearchOptions) while scans are identified
+
+# Prometheus metrics (/metrics); queue depths and cache stats are read when scraped
+metrics = MetricsRegistry()
+shared_metrics = SharedMetrics(METRICS_DIR)
+http_seconds = metrics.histogram('http_request_seconds', 'HTTP request handling time', ['method', 'endpoint', 'status'])
+capture_seconds = metrics.histogram('capture_stage_seconds', 'Time per /fingerprint/capture stage', ['stage'])
+captures_total = metrics.counter('captures_total', '/fingerprint/capture results', ['result'])
+compare_seconds = metrics.histogram('compare_stage_seconds', 'Time per compare_templates stage', ['stage'])
+compares_total = metrics.counter('compares_total', 'compare_templates results', ['result'])
+search_seconds = metrics.histogram('search_seconds', 'Batch compare and 1:N identification time', ['kind'])
+search_comparisons = metrics.counter('search_comparisons_total', 'Templates scored by batch compares and identification', ['kind'])
+pipeline_seconds = metrics.histogram('pipeline_stage_seconds', 'Time per monitoring pipeline stage', ['reader', 'stage'])
+scan_latency = metrics.histogram('scan_latency_seconds', 'Monitored scans from capture to publish', ['reader'])
+reader_connects = metrics.counter('reader_connects_total', 'Reader connection attempts', ['reader', 'result'])
+
+# Hot-path profiling; spans are no-ops unless the current request was sampled
+profiler = Profiler(PROFILE_ENABLED, PROFILE_SAMPLE_RATE, PROFILE_TRACES)
+shared_profile = SharedProfile(METRICS_DIR)
+
+
+class BaseReader:
+    """
+    Capture post-processing and template matching shared by both readers
+    A reader class adds connect/_open, check, disconnect, acquire_frame,
+    wait_for_lift and extract_frame for its device, plus decode_template,
+    similarity and score_rows for its matcher
+    """
+    
+    threshold = 0.6  # default match threshold of the matcher
+    
+    def __init__(self, reader_id=None):
+        self.reader_id = reader_id  # None takes the first reader found
+        self.is_connected = False
+        self.mock_mode = False
+        self.matching_pool = None
+        self.compare_cache = CompareCache(0)
+    
+    def connect(self):
+        """Connect to the fingerprint reader, counting the attempt"""
+        connected = self._open()
+        result = 'failed' if not connected else 'mock' if self.mock_mode else 'ok'
+        reader_connects.inc(self.reader_id or 'default', result)
+        return connected
+    
+    def status_fields(self):
+        """Reader-specific fields of /reader/status"""
+        return {}
+    
+    def capture_fingerprint(self, timeout=10):
+        """
+        Capture a fingerprint image
+        Returns: (success, image_data, template_data)
+        """
+        frame = self.acquire_frame(timeout)
+        
+        if frame is None:
+            return False, None, None
+        
+        template = self.extract_frame(frame)
+        return True, self.render_frame(frame), template
+    
+    def assess_frame(self, frame):
+        """Quality of a captured frame, assessed once"""
+        if frame.quality is None and frame.pixels is not None:
+            frame.quality = assess_quality(frame.pixels)
+        return frame.quality
+    
+    def quality_ok(self, frame):
+        """False if the frame scores below MIN_QUALITY"""
+        quality = self.assess_frame(frame)
+        if quality is not None and quality.score < MIN_QUALITY:
+            logger.info(f"Capture rejected: quality {quality.score} below {MIN_QUALITY}")
+            return False
+        return True
+    
+    def render_frame(self, frame):
+        """PIL image of a captured frame, reading its pooled pixels in place"""
+        if frame.image is None and frame.pixels is not None:
+            frame.image = pixels_image(frame.pixels)
+        return frame.image
+    
+    def encode_frame(self, frame, codec):
+        """
+        Preview image of a captured frame
+        Returns: (base64 data, format info) from the ImageCodec, or None
+        """
+        with profiler.span('render'):
+            image = self.render_frame(frame)
+        if not image:
+            return None
+        with profiler.span(f'codec.{codec.format}'):
+            return codec.encode(image, frame.pixels)
+    
+    def compare_templates(self, template1, template2, threshold=None):
+        """
+        Compare two fingerprint templates
+        Recent results are served from the compare cache
+        Returns: (match, similarity_score)
+        """
+        threshold = self.threshold if threshold is None else threshold
+        try:
+            with compare_seconds.time('cache'), profiler.span('compare.cache'):
+                key = self.compare_cache.key(template1, template2, threshold)
+                cached = self.compare_cache.get(key)
+            if cached is not None:
+                compares_total.inc('cached')
+                return cached
+            
+            with compare_seconds.time('decode'), profiler.span('compare.decode'):
+                probe1 = self.decode_template(template1)
+                probe2 = self.decode_template(template2)
+            
+            if probe1 is None or probe2 is None:
+                compares_total.inc('invalid')
+                return False, 0.0
+            
+            with compare_seconds.time('match'), profiler.span('compare.match'):
+                similarity = self.similarity(probe1, probe2)
+            match = similarity >= threshold
+            
+            self.compare_cache.put(key, (match, similarity))
+            compares_total.inc('match' if match else 'no_match')
+            return match, similarity
+            
+        except Exception as e:
+            compares_total.inc('error')
+            logger.error(f"Comparison error: {e}")
+            return False, 0.0
+    
+    def decode_probe(self, probe):
+        """
+        Decode a base64 probe for score_view and rank_view
+        Raises ValueError if it cannot be decoded
+        """
+        decoded = self.decode_template(probe)
+        if decoded is None:
+            raise ValueError('Invalid probe template')
+        return decoded
+    
+    def score_view(self, decoded, view):
+        """
+        Score a decoded probe against every template in a GalleryView
+        Returns: float32 array of similarity scores aligned with view.ids
+        """
+        return self.score_rows(decoded, view, slice(0, len(view)))
+    
+    def rank_view(self, decoded, view, options, rows=None):
+        """
+        Rank GalleryView rows for a decoded probe, best first
+        Honours the early-exit, top-k and budget rules in options
+        rows limits the search to pre-filtered candidate rows
+        Large searches are sharded across the matching pool when it runs,
+        and run in this thread once a pool worker has crashed
+        Returns: (rows, scores, SearchStats)
+        """
+        searched = len(view) if rows is None else len(rows)
+        
+        pool = self.matching_pool
+        if pool is not None and pool.running and searched >= POOL_MIN_GALLERY:
+            try:
+                return pool.search(view, decoded, options, snapshot_path=view.path, rows=rows)
+            except BrokenProcessPool:
+                pass
+        
+        return search_rows(
+            lambda selected: self.score_rows(decoded, view, selected),
+            len(view),
+            options,
+            rows=rows
+        )
+    
+    def identify(self, probe, threshold=None, options=None):
+        """
+        Identify a base64 probe against the enrolled gallery (1:N)
+        The probe is decoded once, before anything is searched
+        Raises ValueError if it cannot be decoded
+        Returns: (candidates sorted by similarity, SearchStats)
+        """
+        threshold = self.threshold if threshold is None else threshold
+        decoded = self.decode_probe(probe)
+        return gallery.identify(probe, partial(self.rank_view, decoded), threshold, options)
+    
+    def compare_many(self, probe, entries, threshold=None):
+        """
+        Compare one probe against many templates
+        The probe is decoded once for the whole batch
+        entries: list of (id, template) pairs
+        Raises ValueError if the probe cannot be decoded
+        Returns: list of (id, match, similarity_score)
+        """
+        threshold = self.threshold if threshold is None else threshold
+        decoded = self.decode_probe(probe)
+        view = GalleryView.from_entries(entries)
+        scores = self.score_view(decoded, view)
+        
+        return [
+            (template_id, bool(score >= threshold), float(score))
+            for template_id, score in zip(view.ids, scores)
+        ]
+    
+    def compare_matrix(self, probes, entries, threshold=None):
+        """
+        Compare every probe against every template (N x M)
+        Probes and templates are decoded once for the whole matrix
+        Raises ValueError if a probe cannot be decoded
+        Returns: list of (probe_id, [(id, match, similarity_score)])
+        """
+        threshold = self.threshold if threshold is None else threshold
+        decoded = [(probe_id, self.decode_probe(probe)) for probe_id, probe in probes]
+        view = GalleryView.from_entries(entries)
+        
+        return [
+            (probe_id, [
+                (template_id, bool(score >= threshold), float(score))
+                for template_id, score in zip(view.ids, self.score_view(probe, view))
+            ])
+            for probe_id, probe in decoded
+        ]
+
+
+def mock_mode():
+    """True while any registered reader runs without hardware"""
+    return any(device.mock_mode for _, device in readers.items())
+
+
+# Enrolled template gallery for 1:N identification and the capture buffers
+# (the readers are registered by setup() once the service defines them)
+gallery = TemplateGallery(
+    GalleryStore(GALLERY_DIR) if GALLERY_DIR else None,
+    read_only=SERVICE_ROLE == 'worker',
+    prefilter=PREFILTER_ENABLED
+)
+compare_cache = CompareCache(COMPARE_CACHE_SIZE, COMPARE_CACHE_TTL)
+gallery.add_listener(compare_cache.on_gallery_change)
+scan_log = ScanEventLog(SCAN_BUFFER_DEPTH)
+scan_events = ScanBroadcaster(scan_log, STREAM_CLIENT_DEPTH)
+frame_buffer = FrameBuffer(IMAGE_BUFFER_FRAMES, IMAGE_BUFFER_TTL)
+frame_pool = FramePool(FRAME_POOL_PIXELS, FRAME_POOL_SIZE)
+image_codec = ImageCodec(IMAGE_FORMAT, IMAGE_MAX_SIZE, IMAGE_QUALITY, PNG_COMPRESS_LEVEL)
+
+
+def requested_reader_id():
+    """Reader id from ?readerId= or the JSON body; None means the default reader"""
+    data = request.get_json(silent=True) or {}
+    return request.args.get('readerId') or data.get('readerId')
+
+
+def image_requested(default=INCLUDE_IMAGE):
+    """Whether the caller opted into preview images (?image= or includeImage)"""
+    value = request.args.get('image')
+    if value is None:
+        value = (request.get_json(silent=True) or {}).get('includeImage', default)
+    return str(value).lower() in ('1', 'true', 'yes')
+
+
+def requested_codec():
+    """Image codec from ?imageFormat=&imageMaxSize=&imageQuality= or the JSON body"""
+    data = dict(request.get_json(silent=True) or {})
+    data.update(request.args.to_dict())
+    return ImageCodec.from_request(data, image_codec)
+
+
+def with_image(codec, event):
+    """Copy of a scan event with its preview image, encoded on first use"""
+    image_b64, image_format = frame_buffer.image(event.get('imageId'), codec) or (None, None)
+    return dict(event, image=image_b64, imageFormat=image_format)
+
+
+def reader_not_found(e):
+    return jsonify({
+        'success': False,
+        'message': str(e)
+    }), 404
+
+
+def reader_unavailable(reader_id):
+    """503 for a reader the supervisor is still (re)connecting"""
+    return jsonify(unavailable_body(reader_id)), 503
+
+
+def unavailable_body(reader_id):
+    return {
+        'success': False,
+        'readerId': reader_id,
+        'connection': supervisor.status(reader_id),
+        'message': f'Reader {reader_id} unavailable, reconnecting in the background'
+    }
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if not request.path.startswith('/admin/'):
+        endpoint = request.url_rule.rule if request.url_rule else request.path
+        profiler.begin(f'{request.method} {endpoint}')
+
+
+@app.after_request
+def record_request_time(response):
+    started = g.get('request_started')
+    # An owner's requests all come through workers, which time them end to end
+    if started is not None and SERVICE_ROLE != 'owner':
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_seconds.observe(time.perf_counter() - started, request.method, endpoint, str(response.status_code))
+    profiler.finish(response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_request_trace(error=None):
+    # Unhandled errors skip after_request; keep their trace too
+    profiler.finish(500 if error is not None else None)
+
+
+@app.before_request
+def check_admin_token():
+    if not request.path.startswith('/admin/'):
+        return None
+    if ADMIN_TOKEN:
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+            return jsonify({
+                'success': False,
+                'message': 'Admin token required'
+            }), 403
+    elif SERVICE_ROLE != 'owner' and request.remote_addr not in LOCAL_ADDRESSES:
+        # The owner's socket is local; its workers have checked the client already
+        return jsonify({
+            'success': False,
+            'message': 'Admin endpoints are local-only unless FINGERPRINT_ADMIN_TOKEN is set'
+        }), 403
+
+
+# Workers hand reader, monitoring and gallery-write requests to the device owner
+if SERVICE_ROLE == 'worker':
+    owner = OwnerClient(OWNER_SOCKET, OWNER_TIMEOUT)
+    install_worker(app, owner, gallery)
+
+
+# ==================== REST API ENDPOINTS ====================
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """Health check endpoint"""
+    status = {
+        'status': 'running',
+        'service': SERVICE_NAME,
+        'reader_connected': any(device.is_connected for _, device in readers.items()),
+        'readers': len(readers.ids()),
+        'mock_mode': mock_mode(),
+        'monitoring': bool(readers.monitoring()),
+        'role': SERVICE_ROLE,
+        'timestamp': datetime.now().isoformat(),
+        **SERVICE_INFO
+    }
+    
+    if owner is not None:
+        # Reader state lives in the device owner
+        status.update(owner.health())
+    
+    return jsonify(status)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Prometheus metrics: per-stage latency histograms, counters and queue depths
+    A device owner adds the counters and histograms its workers wrote to
+    METRICS_DIR (up to METRICS_WRITE_INTERVAL old); workers forward /metrics here
+    """
+    others = shared_metrics.collect() if SERVICE_ROLE == 'owner' else ()
+    return Response(metrics.render(others), content_type=CONTENT_TYPE)
+
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+def profile_settings():
+    """
+    Request trace sampling status; POST switches it at runtime
+    Body (POST): { enabled, sampleRate, clear }
+    A device owner passes the settings on to its workers within
+    PROFILE_SYNC_INTERVAL; clear only empties the owner's buffer
+    """
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            if not isinstance(data.get('clear', False), bool):
+                raise ValueError('clear must be true or false')
+            profiler.configure(data.get('enabled'), data.get('sampleRate'))
+            if data.get('clear'):
+                profiler.clear()
+            if SERVICE_ROLE == 'owner':
+                shared_profile.write_settings(profiler)
+            logger.info(f"Profiling {'enabled' if profiler.enabled else 'disabled'}, sample rate {profiler.sample_rate}")
+        
+        return jsonify(dict(profiler.status(), success=True))
+        
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+
+
+@app.route('/admin/profile/traces', methods=['GET'])
+def profile_traces():
+    """
+    Recently sampled request span trees, newest first
+    Query (optional): limit, format=json|folded (span self time in microseconds)
+    A device owner adds the traces its workers wrote to METRICS_DIR; each
+    trace carries the pid of the process that recorded it
+    """
+    try:
+        limit = int(request.args.get('limit', 0)) or None
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    traces = [trace.to_dict() for trace in profiler.traces()]
+    if SERVICE_ROLE == 'owner':
+        traces.extend(shared_profile.collect_traces())
+        # ISO timestamps of one host sort by time
+        traces.sort(key=lambda trace: trace['timestamp'], reverse=True)
+    traces = traces[:limit] if limit else traces
+    
+    if request.args.get('format') == 'folded':
+        return Response(folded_spans(traces), content_type='text/plain; charset=utf-8')
+    
+    return jsonify({
+        'success': True,
+        'traces': traces
+    })
+
+
+@app.route('/admin/profile/stacks', methods=['GET'])
+def profile_stacks():
+    """
+    Sample every thread's stack for a while, as collapsed stacks for flamegraph tools
+    Query (optional): seconds (default 5), hz (default 100)
+    Samples the process that answers, named in X-Profile-Process: a worker
+    samples itself; ?process=owner samples the device owner instead
+    """
+    try:
+        folded = profiler.sample_stacks(
+            float(request.args.get('seconds', 5)),
+            int(request.args.get('hz', 100))
+        )
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    if folded is None:
+        return jsonify({
+            'success': False,
+            'message': 'A stack sampling window is already running'
+        }), 409
+    
+    return Response(
+        folded,
+        content_type='text/plain; charset=utf-8',
+        headers={'X-Profile-Process': f'{SERVICE_ROLE} {os.getpid()}'}
+    )
+
+
+@app.route('/readers', methods=['GET'])
+def list_readers():
+    """List every attached reader with its connection and monitoring state"""
+    monitoring = readers.monitoring()
+    
+    return jsonify({
+        'readers': [
+            {
+                'id': reader_id,
+                'connected': device.is_connected,
+                'connection': supervisor.status(reader_id),
+                'mock_mode': device.mock_mode,
+                'monitoring': reader_id in monitoring
+            }
+            for reader_id, device in readers.items()
+        ],
+        'default': readers.default_id
+    })
+
+
+@app.route('/readers/refresh', methods=['POST'])
+def refresh_readers():
+    """Register readers attached since startup"""
+    added = readers.refresh()
+    
+    return jsonify({
+        'success': True,
+        'added': added,
+        'readers': readers.ids()
+    })
+
+
+@app.route('/reader/connect', methods=['POST'])
+def connect_reader():
+    """
+    Connect to a fingerprint reader
+    Body (optional): { readerId }, defaults to the first attached reader
+    """
+    reader_id = requested_reader_id()
+    try:
+        device = readers.get(reader_id)
+    except ReaderNotFound as e:
+        return reader_not_found(e)
+    
+    success = supervisor.connect(reader_id or readers.default_id)
+    
+    return jsonify({
+        'success': success,
+        'readerId': reader_id or readers.default_id,
+        'connected': device.is_connected,
+        'connection': supervisor.status(reader_id or readers.default_id),
+        'mock_mode': device.mock_mode,
+        'message': 'Connected successfully' if success else 'Connection failed'
+    })
+
+
+@app.route('/reader/disconnect', methods=['POST'])
+def disconnect_reader():
+    """
+    Disconnect from a fingerprint reader
+    Body (optional): { readerId }, defaults to the first attached reader
+    """
+    reader_id = requested_reader_id()
+    try:
+        device = readers.get(reader_id)
+    except ReaderNotFound as e:
+        return reader_not_found(e)
+    
+    # Stays disconnected until /reader/connect; the supervisor leaves it alone
+    supervisor.disconnect(reader_id or readers.default_id)
+    
+    return jsonify({
+        'success': True,
+        'readerId': reader_id or readers.default_id,
+        'connected': device.is_connected,
+        'connection': supervisor.status(reader_id or readers.default_id),
+        'message': 'Disconnected successfully'
+    })
+
+
+@app.route('/reader/status', methods=['GET'])
+def reader_status():
+    """Get reader connection status (?readerId=, defaults to the first attached reader)"""
+    reader_id = requested_reader_id() or readers.default_id
+    try:
+        device = readers.get(reader_id)
+        pipeline = readers.pipeline(reader_id)
+    except ReaderNotFound as e:
+        return reader_not_found(e)
+    
+    return jsonify({
+        'readerId': reader_id,
+        'connected': device.is_connected,
+        'connection': supervisor.status(reader_id),
+        'mock_mode': device.mock_mode,
+        'monitoring': pipeline.active,
+        **device.status_fields(),
+        'scanBuffer': scan_log.stats(),
+        'stream': scan_events.stats(),
+        'frameBuffer': frame_buffer.stats(),
+        'framePool': frame_pool.stats(),
+        'pipeline': pipeline.stats()
+    })
+
+
+def finish_capture(reader_id, device, frame, codec, include_image):
+    """
+    Extract, quality-check and buffer a captured frame
+    Shared by the Flask endpoint and the ASGI capture handler
+    Returns: (response body, HTTP status)
+    """
+    if frame is None:
+        captures_total.inc('timeout')
+        return {
+            'success': False,
+            'message': 'Fingerprint capture failed or timeout'
+        }, 400
+    
+    with capture_seconds.time('quality'), profiler.span('quality'):
+        device.assess_frame(frame)
+    with capture_seconds.time('extract'), profiler.span('extract'):
+        template = device.extract_frame(frame)
+    quality = frame.quality.to_dict() if frame.quality else None
+    
+    if frame.quality is not None and frame.quality.score < MIN_QUALITY:
+        frame.release()
+        captures_total.inc('low_quality')
+        return {
+            'success': False,
+            'quality': quality,
+            'minQuality': MIN_QUALITY,
+            'message': 'Fingerprint quality too low, please place the finger again'
+        }, 400
+    
+    # Keep the raw frame; encode its image only if asked for
+    with capture_seconds.time('buffer'), profiler.span('buffer'):
+        image_id = frame_buffer.put(frame, device.encode_frame)
+    encoded = None
+    if include_image:
+        with capture_seconds.time('encode'), profiler.span('encode'):
+            encoded = frame_buffer.image(image_id, codec)
+    image_b64, image_format = encoded or (None, None)
+    
+    captures_total.inc('ok')
+    return {
+        'success': True,
+        'readerId': reader_id,
+        'template': template,
+        'image': image_b64,
+        'imageId': image_id,
+        'imageFormat': image_format,
+        'quality': quality,
+        'timestamp': datetime.now().isoformat(),
+        'mock_mode': device.mock_mode,
+        'message': 'Fingerprint captured successfully'
+    }, 200
+
+
+@app.route('/fingerprint/capture', methods=['POST'])
+def capture_fingerprint():
+    """
+    Capture a single fingerprint
+    Body (optional): { timeout, readerId, includeImage, imageFormat, imageMaxSize, imageQuality }
+    The preview image is only encoded with includeImage; otherwise it can
+    be fetched by imageId from /fingerprint/image while still buffered
+    """
+    try:
+        timeout = request.json.get('timeout', 10) if request.json else 10
+        reader_id = requested_reader_id() or readers.default_id
+        device = readers.get(reader_id)
+        codec = requested_codec()
+        
+        if not supervisor.available(reader_id):
+            captures_total.inc('unavailable')
+            return reader_unavailable(reader_id)
+        
+        with capture_seconds.time('acquire'), profiler.span('acquire'):
+            frame = device.acquire_frame(timeout)
+        body, status = finish_capture(reader_id, device, frame, codec, image_requested())
+        
+        with profiler.span('respond'):
+            response = jsonify(body)
+        return response, status
+        
+    except ReaderNotFound as e:
+        return reader_not_found(e)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        captures_total.inc('error')
+        logger.error(f"Capture endpoint error: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
+@app.route('/fingerprint/image/<image_id>', methods=['GET'])
+def fetch_fingerprint_image(image_id):
+    """
+    Preview image of a recent capture or scan, encoded on first fetch
+    Query (optional): imageFormat, imageMaxSize, imageQuality
+    """
+    try:
+        encoded = frame_buffer.image(image_id, requested_codec())
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    if encoded is None:
+        return jsonify({
+            'success': False,
+            'message': 'Image not found or expired'
+        }), 404
+    
+    image_b64, image_format = encoded
+    
+    return jsonify({
+        'success': True,
+        'imageId': image_id,
+        'image': image_b64,
+        'imageFormat': image_format
+    })
+
+
+@app.route('/fingerprint/compare', methods=['POST'])
+def compare_fingerprints():
+    """Compare two fingerprint templates"""
+    try:
+        data = request.json
+        template1 = data.get('template1')
+        template2 = data.get('template2')
+        threshold = data.get('threshold', reader.threshold)
+        
+        if not template1 or not template2:
+            return jsonify({
+                'success': False,
+                'message': 'Both templates required'
+            }), 400
+        
+        match, similarity = reader.compare_templates(template1, template2, threshold)
+        
+        return jsonify({
+            'success': True,
+            'match': match,
+            'similarity': similarity,
+            'threshold': threshold
+        })
+        
+    except Exception as e:
+        logger.error(f"Compare endpoint error: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
+@app.route('/fingerprint/compare/batch', methods=['POST'])
+def compare_fingerprints_batch():
+    """
+    Compare one probe against many templates, or every probe against every template
+    Body: { probe, templates: [{ id, template }], threshold }
+       or { probes: [{ id, template }], templates: [{ id, template }], threshold }
+    """
+    try:
+        data = request.json or {}
+        threshold = data.get('threshold', reader.threshold)
+        entries = template_entries(data.get('templates'))
+        
+        if data.get('probes') is not None:
+            probes = template_entries(data['probes'])
+            with search_seconds.time('matrix'), profiler.span('matrix'):
+                rows = reader.compare_matrix(probes, entries, threshold)
+            search_comparisons.inc('matrix', amount=len(probes) * len(entries))
+            
+            return jsonify({
+                'success': True,
+                'matrix': [
+                    {
+                        'probeId': probe_id,
+                        'results': [
+                            {'id': template_id, 'match': bool(match), 'similarity': float(similarity)}
+                            for template_id, match, similarity in results
+                        ]
+                    }
+                    for probe_id, results in rows
+                ],
+                'comparisons': len(probes) * len(entries),
+                'threshold': threshold
+            })
+        
+        probe = data.get('probe')
+        if not probe:
+            return jsonify({
+                'success': False,
+                'message': 'Probe template or probes list required'
+            }), 400
+        
+        with search_seconds.time('batch'), profiler.span('batch'):
+            compared = reader.compare_many(probe, entries, threshold)
+        search_comparisons.inc('batch', amount=len(compared))
+        
+        results = [
+            {'id': template_id, 'match': bool(match), 'similarity': float(similarity)}
+            for template_id, match, similarity in compared
+        ]
+        
+        return jsonify({
+            'success': True,
+            'results': results,
+            'matches': sum(1 for r in results if r['match']),
+            'comparisons': len(results),
+            'threshold': threshold
+        })
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Batch compare endpoint error: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
+@app.route('/fingerprint/identify', methods=['POST'])
+def identify_fingerprint():
+    """
+    Identify a probe template against the enrolled gallery (1:N)
+    Body: { template, threshold, limit, certainThreshold, maxComparisons, timeBudgetMs,
+            prefilter, prefilterFallback, maxCandidates }
+    certainThreshold stops at the first score at or above it; maxComparisons
+    and timeBudgetMs cap the work done for this request. The pre-filter
+    narrows the gallery to candidates first; search.prefilter reports the
+    candidate-set size and whether the full gallery had to be searched
+    """
+    try:
+        data = request.json or {}
+        probe = data.get('template')
+        threshold = data.get('threshold', reader.threshold)
+        options = SearchOptions.from_request(data)
+        
+        if not probe:
+            return jsonify({
+                'success': False,
+                'message': 'Probe template required'
+            }), 400
+        
+        with search_seconds.time('identify'), profiler.span('identify'):
+            candidates, stats = reader.identify(probe, threshold, options)
+        search_comparisons.inc('identify', amount=stats.comparisons)
+        best = candidates[0] if candidates and candidates[0]['match'] else None
+        
+        return jsonify({
+            'success': True,
+            'match': best is not None,
+            'bestMatch': best,
+            'candidates': candidates,
+            'gallerySize': len(gallery),
+            'comparisons': stats.comparisons,
+            'search': stats.to_dict(),
+            'threshold': threshold
+        })
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Identify endpoint error: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
+# ==================== GALLERY ENDPOINTS ====================
+
+@app.route('/gallery/enroll', methods=['POST'])
+def enroll_gallery_template():
+    """
+    Enroll templates into the identification gallery
+    Body: { id, template } or { templates: [{ id, template }], replace }
+    """
+    try:
+        data = request.json or {}
+        
+        if 'templates' in data:
+            size = gallery.enroll_many(data['templates'], data.get('replace', False))
+            enrolled = len(data['templates'])
+        else:
+            gallery.enroll(data.get('id'), data.get('template'))
+            size = len(gallery)
+            enrolled = 1
+        
+        return jsonify({
+            'success': True,
+            'enrolled': enrolled,
+            'gallerySize': size,
+            'message': 'Templates enrolled successfully'
+        })
+        
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Gallery enroll error: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
+@app.route('/gallery/remove', methods=['POST'])
+def remove_gallery_template():
+    """
+    Remove templates from the identification gallery
+    Body: { id } or { ids: [...] }
+    """
+    data = request.json or {}
+    ids = data.get('ids') or ([data['id']] if data.get('id') else [])
+    
+    if not ids:
+        return jsonify({
+            'success': False,
+            'message': 'Template id required'
+        }), 400
+    
+    removed = [template_id for template_id in ids if gallery.remove(template_id)]
+    
+    return jsonify({
+        'success': True,
+        'removed': removed,
+        'gallerySize': len(gallery)
+    })
+
+
+@app.route('/gallery/status', methods=['GET'])
+def gallery_status():
+    """Get identification gallery status and memory usage"""
+    return jsonify({
+        'gallerySize': len(gallery),
+        'ids': gallery.ids(),
+        'memory': gallery.memory_stats(),
+        'persistence': gallery.persistence_status(),
+        'matchingPool': matching_pool.stats() if matching_pool else None,
+        'compareCache': reader.compare_cache.stats()
+    })
+
+
+@app.route('/gallery/compact', methods=['POST'])
+def compact_gallery():
+    """Fold the gallery delta log into a new snapshot now"""
+    try:
+        compacted = gallery.compact()
+        
+        return jsonify({
+            'success': True,
+            'compacted': compacted,
+            'persistence': gallery.persistence_status()
+        })
+        
+    except Exception as e:
+        logger.error(f"Gallery compact error: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
+@app.route('/monitoring/start', methods=['POST'])
+def start_monitoring():
+    """
+    Start continuous monitoring mode
+    Body (optional): { readerId, identify, threshold, limit, certainThreshold, maxComparisons, timeBudgetMs }
+    Without readerId every attached reader is monitored; scans from all of
+    them arrive in the same event stream, tagged with their readerId
+    With identify every scan is matched against the gallery as soon as it
+    is captured, and its event carries the result
+    """
+    global monitor_identify
+    
+    try:
+        data = request.get_json(silent=True) or {}
+        reader_ids = readers.select(requested_reader_id())
+        
+        if data.get('identify', MONITOR_IDENTIFY):
+            threshold = float(data.get('threshold', MONITOR_THRESHOLD or reader.threshold))
+            monitor_identify = (threshold, SearchOptions.from_request(data, default_limit=3))
+        else:
+            monitor_identify = None
+        
+        for reader_id in reader_ids:
+            # Captures wait for the supervisor while the reader is reconnecting
+            readers.pipeline(reader_id).start()
+        
+        return jsonify({
+            'success': True,
+            'monitoring': bool(readers.monitoring()),
+            'readers': readers.monitoring(),
+            'mock_mode': mock_mode(),
+            'identify': monitor_identify is not None,
+            'message': 'Monitoring started'
+        })
+        
+    except ReaderNotFound as e:
+        return reader_not_found(e)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        logger.error(f"Start monitoring error: {e}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+
+@app.route('/monitoring/stop', methods=['POST'])
+def stop_monitoring():
+    """
+    Stop continuous monitoring mode
+    Body (optional): { readerId }, otherwise every reader stops
+    """
+    try:
+        reader_ids = readers.select(requested_reader_id())
+    except ReaderNotFound as e:
+        return reader_not_found(e)
+    
+    for reader_id in reader_ids:
+        readers.pipeline(reader_id).stop()
+    
+    monitoring = readers.monitoring()
+    if not monitoring:
+        # Scans nobody picked up are not handed to the next single-scan poll
+        scan_log.skip_pending()
+    
+    return jsonify({
+        'success': True,
+        'monitoring': bool(monitoring),
+        'readers': monitoring,
+        'message': 'Monitoring stopped'
+    })
+
+
+@app.route('/monitoring/poll', methods=['GET'])
+def poll_latest_scan():
+    """
+    Poll for fingerprint scans
+    Used by kiosk clients
+    With ?after=<sequence> every buffered scan after it is returned (at most
+    ?limit=), so each client sees each scan exactly once. Without it the
+    next scan not yet handed out is returned in the single-scan format
+    Preview images are included with ?image=1 (and ?imageFormat= etc.)
+    """
+    after = request.args.get('after')
+    
+    try:
+        render = partial(with_image, requested_codec()) if image_requested() else dict
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    if after is not None:
+        try:
+            after = int(after)
+            limit = max(1, min(int(request.args.get('limit', POLL_BATCH_LIMIT)), POLL_BATCH_LIMIT))
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'after and limit must be integers'
+            }), 400
+        
+        # A sequence from before a service restart starts over
+        reset = after > scan_log.sequence
+        if reset:
+            after = 0
+        events, missed = scan_log.after(after, limit)
+        
+        return jsonify({
+            'success': True,
+            'events': [dict(render(event), sequence=sequence) for sequence, event in events],
+            'lastSequence': events[-1][0] if events else after,
+            'latestSequence': scan_log.sequence,
+            'missed': missed,
+            'reset': reset,
+            'mock_mode': mock_mode()
+        })
+    
+    item = scan_log.take()
+    
+    if item:
+        sequence, scan_data = item
+        scan_data = render(scan_data)
+        
+        return jsonify({
+            'hasNewScan': True,
+            'sequence': sequence,
+            'template': scan_data['template'],
+            'image': scan_data.get('image'),
+            'imageId': scan_data.get('imageId'),
+            'imageFormat': scan_data.get('imageFormat'),
+            'quality': scan_data.get('quality'),
+            'identification': scan_data.get('identification'),
+            'timestamp': scan_data['timestamp'],
+            'mock_mode': mock_mode()
+        })
+    
+    return jsonify({
+        'hasNewScan': False,
+        'template': None,
+        'timestamp': None
+    })
+
+
+@app.route('/monitoring/stream', methods=['GET'])
+def stream_scans():
+    """
+    Stream scan events as Server-Sent Events
+    Every connected client gets every scan. Reconnecting with the last event
+    id (Last-Event-ID header, or ?resume=<token>) replays what was missed
+    Preview images are included with ?image=1 (and ?imageFormat= etc.)
+    """
+    resume = request.headers.get('Last-Event-ID') or request.args.get('resume')
+    
+    try:
+        render = partial(with_image, requested_codec()) if image_requested() else None
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    subscriber = scan_events.subscribe(resume)
+    
+    return Response(
+        stream_events(scan_events, subscriber, STREAM_HEARTBEAT, render),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+def identify_scan(template, settings):
+    """
+    Identify a freshly captured template against the local gallery
+    Gallery ids are the ids the backend enrolled, i.e. employee ids
+    Returns: identification details for the scan event
+    """
+    threshold, options = settings
+    
+    try:
+        with search_seconds.time('monitor'):
+            candidates, stats = reader.identify(template, threshold, options)
+        search_comparisons.inc('monitor', amount=stats.comparisons)
+    except Exception as e:
+        logger.error(f"Scan identification error: {e}")
+        return {'match': False, 'error': str(e)}
+    
+    best = candidates[0] if candidates and candidates[0]['match'] else None
+    
+    return {
+        'match': best is not None,
+        'employeeId': best['id'] if best else None,
+        'similarity': candidates[0]['similarity'] if candidates else None,
+        'candidates': candidates,
+        'threshold': threshold,
+        'search': stats.to_dict()
+    }
+
+
+def capture_scan(reader_id, device, cancel):
+    """Capture stage: wait for a finger; None if none was placed"""
+    # The supervisor reconnects the reader; wait for it rather than connecting here
+    if not supervisor.wait_ready(reader_id, cancel, timeout=10):
+        return None
+    
+    # Stopping the pipeline sets cancel and ends the wait early
+    return device.acquire_frame(timeout=10, cancel=cancel)
+
+
+def extract_scan(reader_id, device, frame):
+    """Extract stage: the scan's template, plus its gallery match when identifying"""
+    template = device.extract_frame(frame)
+    if not template:
+        return None
+    
+    scan = {
+        'readerId': reader_id,
+        'template': template,
+        'quality': frame.quality.to_dict() if frame.quality else None,
+        'timestamp': frame.timestamp
+    }
+    
+    # Match on the spot so the event already names the employee
+    settings = monitor_identify
+    if settings is not None:
+        scan['identification'] = identify_scan(template, settings)
+    
+    return scan
+
+
+def encode_scan(device, frame, scan):
+    """
+    Encode stage: buffer the raw frame under the scan's imageId
+    The image itself is encoded only when a client asks for it
+    """
+    scan['imageId'] = frame_buffer.put(frame, device.encode_frame)
+    return scan
+
+
+def observe_pipeline(reader_id, stage, seconds):
+    """Monitoring pipeline timings for /metrics"""
+    if stage == 'latency':
+        scan_latency.observe(seconds, reader_id)
+    else:
+        pipeline_seconds.observe(seconds, reader_id, stage)
+
+
+def create_pipeline(reader_id, device):
+    """
+    Background monitoring for one reader: buffer each scan for pollers and
+    push it to streaming clients
+    """
+    return CapturePipeline(
+        partial(capture_scan, reader_id, device),
+        partial(extract_scan, reader_id, device),
+        partial(encode_scan, device),
+        scan_events.publish,
+        extract_workers=EXTRACT_WORKERS,
+        encode_workers=ENCODE_WORKERS,
+        queue_depth=PIPELINE_QUEUE_DEPTH,
+        lift_fn=device.wait_for_lift,
+        cooldown=SCAN_COOLDOWN,
+        observe_fn=partial(observe_pipeline, reader_id)
+    )
+
+
+# ==================== SETUP ====================
+
+def setup(reader_class, enumerate_fn, name, info=None, scorer=None, placeholder=None):
+    """
+    Register the service's reader class and matcher with the app
+    reader_class: BaseReader subclass, constructed with a reader id
+    enumerate_fn: returns the ids of the attached readers
+    scorer: matching_pool scorer for multi-process 1:N matching, or None
+    to always match in-process
+    info: extra /health fields; placeholder: see ReaderRegistry
+    """
+    global SERVICE_NAME, SERVICE_INFO, reader, readers, supervisor, matching_pool
+    
+    SERVICE_NAME = name
+    SERVICE_INFO = info or {}
+    
+    matching_pool = MatchingPool(MATCH_WORKERS, scorer) if scorer is not None and MATCH_WORKERS > 1 else None
+    reader = reader_class()
+    reader.matching_pool = matching_pool
+    reader.compare_cache = compare_cache
+    
+    # Every attached reader, each with its own capture pipeline
+    readers = ReaderRegistry(enumerate_fn, reader_class, create_pipeline, placeholder=placeholder)
+    supervisor = ReaderSupervisor(
+        readers, RECONNECT_INTERVAL, RECONNECT_BACKOFF_MIN, RECONNECT_BACKOFF_MAX, HOTPLUG_ENABLED
+    )
+    if SERVICE_ROLE != 'worker':
+        readers.refresh()
+    register_service_metrics(
+        metrics, readers, scan_log, scan_events, frame_buffer, frame_pool, compare_cache, gallery
+    )
+
+
+# ==================== MAIN ====================
+
+def start_service():
+    """
+    Load the gallery, start the matching workers and connect the readers
+    Called once before serving, by main(), the ASGI lifespan startup or
+    each pre-forked worker (which leaves the readers to the device owner)
+    """
+    # Fork the matching workers first, while this is the only thread
+    if matching_pool is not None:
+        matching_pool.start()
+    
+    # Map the persisted gallery snapshot and replay its delta log
+    try:
+        logger.info(f"✓ Gallery loaded: {gallery.load()} templates")
+        gallery.start_compactor(GALLERY_COMPACT_INTERVAL, GALLERY_COMPACT_RECORDS)
+        if PREFILTER_ENABLED:
+            # Index the snapshot now rather than on the first identification
+            threading.Thread(target=gallery.coarse_index, daemon=True).start()
+    except Exception as e:
+        logger.error(f"⚠ Could not load gallery from {GALLERY_DIR}: {e}")
+    
+    if SERVICE_ROLE == 'worker':
+        shared_metrics.start(metrics, METRICS_WRITE_INTERVAL)
+        shared_profile.start(profiler, PROFILE_SYNC_INTERVAL)
+        return
+    if SERVICE_ROLE == 'owner':
+        # Counts and traces of an earlier owner's workers would never reset otherwise
+        shared_metrics.clear()
+        shared_profile.clear()
+        shared_profile.write_settings(profiler)
+    
+    # Connect every attached reader now; the supervisor keeps them connected
+    # and registers readers plugged in later
+    supervisor.start()
+    if not readers.ids():
+        logger.warning("⚠ No readers attached yet")
+    for reader_id, device in readers.items():
+        if device.is_connected:
+            logger.info(f"✓ Reader {reader_id} connected (Mock Mode: {device.mock_mode})")
+        else:
+            logger.warning(f"⚠ Reader {reader_id} not connected - retrying in the background")
+
+
+def main():
+    """Start the service and serve it until interrupted, run by the service's __main__"""
+    port = int(os.getenv('FINGERPRINT_SERVICE_PORT', 5000))
+    
+    logger.info("=" * 60)
+    logger.info(SERVICE_NAME)
+    logger.info("=" * 60)
+    logger.info(f"Starting on port {port}...")
+    
+    if SERVICE_ROLE == 'worker':
+        sys.exit("Workers are started by gunicorn: gunicorn -w 4 --threads 8 wsgi_service:app")
+    
+    start_service()
+    
+    logger.info("=" * 60)
+    
+    if SERVICE_ROLE == 'owner':
+        # Serve the HTTP workers over the local socket only
+        logger.info(f"Device owner listening on {OWNER_SOCKET}")
+        app.run(host=f'unix://{OWNER_SOCKET}', debug=False, threaded=True)
+    else:
+        # Run Flask app
+        app.run(
+            host='0.0.0.0',
+            port=port,
+            debug=False,
+            threaded=True
+        )
@@ -0,0 +1,126 @@
+# python-services/digitalpersona/frame_buffer.py
+"""
+Short-lived buffer of raw captured frames
+Captures keep their raw frame here instead of encoding a preview image up
+front; the image is encoded the first time someone asks for it, and only once
+per codec. Frames leaving the buffer are released back to their frame pool
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class BufferedFrame:
+    """One raw frame, its encoder and the images encoded from it so far"""
+
+    __slots__ = ('frame', 'encode_fn', 'expires', 'images', 'lock')
+
+    def __init__(self, frame, encode_fn, expires):
+        self.frame = frame
+        self.encode_fn = encode_fn
+        self.expires = expires
+        self.images = {}    # codec key -> encoded image
+        self.lock = threading.Lock()
+
+
+class FrameBuffer:
+    """
+    Bounded, TTL-limited store of frames keyed by a random image id
+    encode_fn(frame, codec) -> encoded image, or None; codec is an ImageCodec
+    and encoded images are kept per codec.key
+    """
+
+    def __init__(self, max_frames=32, ttl=30.0):
+        self.max_frames = max_frames
+        self.ttl = ttl
+        self._frames = OrderedDict()    # image id -> BufferedFrame, oldest first
+        self._lock = threading.Lock()
+        self.encoded = 0
+        self.served = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def _purge(self, now):
+        """
+        Drop expired frames; caller holds the lock
+        Returns: the dropped entries, to be released once the lock is let go
+        """
+        dropped = []
+        while self._frames:
+            image_id, entry = next(iter(self._frames.items()))
+            if entry.expires >= now:
+                break
+            del self._frames[image_id]
+            dropped.append(entry)
+            self.expired += 1
+        return dropped
+
+    @staticmethod
+    def _release(entries):
+        """Release dropped frames, waiting for any encode still reading them"""
+        for entry in entries:
+            with entry.lock:
+                if entry.frame is not None:
+                    entry.frame.release()
+                    entry.frame = None
+                entry.images.clear()
+
+    def put(self, frame, encode_fn):
+        """Keep a frame for later encoding and return its image id"""
+        image_id = os.urandom(8).hex()
+        now = time.monotonic()
+
+        with self._lock:
+            dropped = self._purge(now)
+            self._frames[image_id] = BufferedFrame(frame, encode_fn, now + self.ttl)
+            while len(self._frames) > self.max_frames:
+                dropped.append(self._frames.popitem(last=False)[1])
+                self.evicted += 1
+
+        self._release(dropped)
+        return image_id
+
+    def image(self, image_id, codec):
+        """
+        Encoded image of a buffered frame, encoding it on first use
+        Returns: the image, or None if the id is unknown or expired
+        """
+        if not image_id:
+            return None
+
+        with self._lock:
+            dropped = self._purge(time.monotonic())
+            entry = self._frames.get(image_id)
+        self._release(dropped)
+        if entry is None:
+            return None
+
+        # Concurrent fetches of the same frame wait for a single encode
+        with entry.lock:
+            image = entry.images.get(codec.key)
+            if image is None:
+                if entry.frame is None:
+                    return None     # released since it was looked up
+                image = entry.encode_fn(entry.frame, codec)
+                if image is None:
+                    return None
+                entry.images[codec.key] = image
+                self.encoded += 1
+            self.served += 1
+            return image
+
+    def stats(self):
+        with self._lock:
+            dropped = self._purge(time.monotonic())
+        self._release(dropped)
+        with self._lock:
+            return {
+                'frames': len(self._frames),
+                'maxFrames': self.max_frames,
+                'ttlSeconds': self.ttl,
+                'encoded': self.encoded,
+                'served': self.served,
+                'expired': self.expired,
+                'evicted': self.evicted
+            }
@@ -0,0 +1,78 @@
+# python-services/digitalpersona/frame_pool.py
+"""
+Pool of preallocated frame buffers
+Captured pixels are written into reusable uint8 buffers instead of fresh
+arrays; NumPy views and PIL images read those buffers in place, and a
+buffer goes back to the pool once its frame is released
+"""
+import threading
+
+import numpy as np
+from PIL import Image
+
+
+class FramePool:
+    """
+    count buffers of capacity pixels each, allocated up front
+    Frames larger than the capacity get a one-off array; when the pool is
+    empty a new buffer is allocated and kept on release, up to count
+    """
+
+    def __init__(self, capacity=500 * 400, count=16):
+        self.capacity = capacity
+        self.count = count
+        self._free = [np.empty(capacity, dtype=np.uint8) for _ in range(count)]
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.reused = 0
+        self.allocated = 0
+        self.oversized = 0
+
+    def frame(self, height, width):
+        """A (height, width) uint8 array backed by a pooled buffer"""
+        size = height * width
+        if size > self.capacity:
+            with self._lock:
+                self.acquired += 1
+                self.oversized += 1
+            return np.empty((height, width), dtype=np.uint8)
+
+        with self._lock:
+            self.acquired += 1
+            if self._free:
+                buffer = self._free.pop()
+                self.reused += 1
+            else:
+                buffer = None
+                self.allocated += 1
+        if buffer is None:
+            buffer = np.empty(self.capacity, dtype=np.uint8)
+
+        return buffer[:size].reshape(height, width)
+
+    def release(self, pixels):
+        """Return the buffer behind an array from frame() to the pool"""
+        buffer = pixels.base if pixels.base is not None else pixels
+        if buffer.ndim != 1 or buffer.size != self.capacity:
+            return
+        with self._lock:
+            if len(self._free) < self.count and not any(free is buffer for free in self._free):
+                self._free.append(buffer)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'buffers': self.count,
+                'free': len(self._free),
+                'capacityPixels': self.capacity,
+                'acquired': self.acquired,
+                'reused': self.reused,
+                'allocated': self.allocated,
+                'oversized': self.oversized
+            }
+
+
+def pixels_image(pixels):
+    """Grayscale PIL image that reads a (height, width) uint8 array in place"""
+    height, width = pixels.shape
+    return Image.frombuffer('L', (width, height), pixels, 'raw', 'L', 0, 1)
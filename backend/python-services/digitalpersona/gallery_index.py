@@ -0,0 +1,240 @@
+# python-services/digitalpersona/gallery_index.py
+"""
+Coarse pre-filter index for 1:N identification
+Hashes rotation/translation invariant minutia triplets (each minutia and
+pairs of its nearest neighbours) into an inverted index, so a probe only
+gets full minutiae scoring against templates that share enough triplets
+"""
+import numpy as np
+
+from minutiae_matcher import ansi_angle_to_radians
+
+# Nearest neighbours per minutia; every pair of them forms one triplet
+TRIPLET_NEIGHBOURS = 3
+LENGTH_BIN = 12                 # pixels
+LENGTH_BINS = 24
+ANGLE_BINS = 12                 # 30 degrees
+
+# Templates processed per vectorized step while building
+BUILD_CHUNK_SIZE = 512
+
+# Fallback rules
+MIN_GALLERY = 500               # smaller galleries are always searched in full
+MIN_PROBE_TRIPLETS = 8          # probes with fewer triplets are searched in full
+MIN_VOTES = 2                   # shared triplets for a template to be a candidate
+MIN_CANDIDATES = 32             # always hand at least this many to full scoring
+MAX_CANDIDATE_FRACTION = 0.1    # and at most this share of the gallery
+
+
+def _length_bin(distance):
+    distance = np.where(np.isfinite(distance), distance, 0)
+    return np.minimum((distance // LENGTH_BIN).astype(np.int64), LENGTH_BINS - 1)
+
+
+def _angle_bin(angle):
+    return (angle % (2 * np.pi) // (2 * np.pi / ANGLE_BINS)).astype(np.int64) % ANGLE_BINS
+
+
+def _triplet_keys(x, y, theta, mask):
+    """
+    Triplet hash keys for a batch of templates
+    x, y, theta, mask: (templates, minutiae) arrays
+    Returns: (keys, rows) flat int64 arrays, one entry per valid triplet
+    """
+    g, m = x.shape
+    if m < TRIPLET_NEIGHBOURS + 1:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    dx = x[:, None, :] - x[:, :, None]
+    dy = y[:, None, :] - y[:, :, None]
+    distance = np.sqrt(dx ** 2 + dy ** 2)
+    invalid = ~(mask[:, :, None] & mask[:, None, :]) | np.eye(m, dtype=bool)[None]
+    distance[invalid] = np.inf
+
+    # Indices of the nearest neighbours of every minutia, closest first
+    neighbours = np.argsort(distance, axis=2)[:, :, :TRIPLET_NEIGHBOURS]
+
+    keys = []
+    rows = []
+    row_index = np.broadcast_to(np.arange(g)[:, None], (g, m))
+    batch = np.arange(g)[:, None]
+    centre = np.arange(m)[None, :]
+
+    for a in range(TRIPLET_NEIGHBOURS):
+        for b in range(a + 1, TRIPLET_NEIGHBOURS):
+            na = neighbours[:, :, a]
+            nb = neighbours[:, :, b]
+
+            d_a = distance[batch, centre, na]
+            d_b = distance[batch, centre, nb]
+            d_ab = distance[batch, na, nb]
+            valid = mask & np.isfinite(d_a) & np.isfinite(d_b) & np.isfinite(d_ab)
+
+            # Directions relative to the centre minutia are rotation invariant
+            rel_a = theta[batch, na] - theta
+            rel_b = theta[batch, nb] - theta
+            bearing = np.arctan2(dy[batch, centre, na], dx[batch, centre, na]) - theta
+
+            key = _length_bin(d_a)
+            key = key * LENGTH_BINS + _length_bin(d_b)
+            key = key * LENGTH_BINS + _length_bin(d_ab)
+            key = key * ANGLE_BINS + _angle_bin(rel_a)
+            key = key * ANGLE_BINS + _angle_bin(rel_b)
+            key = key * ANGLE_BINS + _angle_bin(bearing)
+
+            keys.append(key[valid])
+            rows.append(row_index[valid])
+
+    return np.concatenate(keys), np.concatenate(rows)
+
+
+def _points(x, y, angle):
+    return x.astype(np.float32), y.astype(np.float32), ansi_angle_to_radians(angle)
+
+
+class TripletIndex:
+    """
+    Inverted index from triplet keys to the rows of one PackedMinutiae batch
+    Immutable once built; a gallery keeps one for its mapped snapshot and
+    one for the changes made since
+    """
+
+    __slots__ = ('size', 'keys', 'offsets', 'postings', 'unindexed')
+
+    def __init__(self, size, keys, offsets, postings, unindexed):
+        self.size = size
+        self.keys = keys
+        self.offsets = offsets
+        self.postings = postings
+        self.unindexed = unindexed
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.offsets.nbytes + self.postings.nbytes + self.unindexed.nbytes
+
+    @classmethod
+    def build(cls, packed):
+        """Index every template of a PackedMinutiae batch"""
+        size = len(packed)
+        all_keys = [np.empty(0, dtype=np.int64)]
+        all_rows = [np.empty(0, dtype=np.int64)]
+
+        for start in range(0, size, BUILD_CHUNK_SIZE):
+            chunk = packed.slice(start, start + BUILD_CHUNK_SIZE)
+            keys, rows = _triplet_keys(*_points(chunk.x, chunk.y, chunk.angle), chunk.mask)
+            all_keys.append(keys)
+            all_rows.append(rows + start)
+
+        # One posting per (key, template), grouped by key
+        pairs = np.unique(np.concatenate(all_keys) * max(size, 1) + np.concatenate(all_rows))
+        pair_keys = pairs // max(size, 1)
+        postings = (pairs % max(size, 1)).astype(np.int32)
+        keys, starts = np.unique(pair_keys, return_index=True)
+        offsets = np.append(starts, len(postings)).astype(np.int64)
+
+        indexed = np.zeros(size, dtype=bool)
+        indexed[postings] = True
+        unindexed = np.flatnonzero(~indexed).astype(np.int32)
+
+        return cls(size, keys, offsets, postings, unindexed)
+
+    def votes(self, probe_keys):
+        """Number of probe triplets each row shares"""
+        if not len(self.keys) or not len(probe_keys):
+            return np.zeros(self.size, dtype=np.int32)
+
+        slots = np.minimum(np.searchsorted(self.keys, probe_keys), len(self.keys) - 1)
+        slots = slots[self.keys[slots] == probe_keys]
+
+        # Concatenate the posting lists of every matched key
+        lengths = self.offsets[slots + 1] - self.offsets[slots]
+        starts = np.repeat(self.offsets[slots] - np.cumsum(lengths) + lengths, lengths)
+        positions = starts + np.arange(lengths.sum())
+        return np.bincount(self.postings[positions], minlength=self.size).astype(np.int32)
+
+
+def probe_keys(minutiae):
+    """Unique triplet keys of a probe's MINUTIA_DTYPE array"""
+    if minutiae is None or len(minutiae) < TRIPLET_NEIGHBOURS + 1:
+        return np.empty(0, dtype=np.int64)
+
+    x, y, theta = _points(minutiae['x'][None], minutiae['y'][None], minutiae['angle'][None])
+    keys, _ = _triplet_keys(x, y, theta, np.ones((1, len(minutiae)), dtype=bool))
+    return np.unique(keys)
+
+
+class CoarseIndex:
+    """
+    Pre-filter over one GalleryView, made of TripletIndex parts
+    Each part maps its own rows to view rows (-1 for rows no longer in
+    the view), so the snapshot's index is reused as the overlay changes
+    """
+
+    __slots__ = ('size', 'parts')
+
+    def __init__(self, size, parts):
+        self.size = size
+        self.parts = parts  # list of (TripletIndex, view rows)
+
+    @classmethod
+    def build(cls, packed):
+        """Single-part index over a whole view's packed minutiae"""
+        return cls(len(packed), [(TripletIndex.build(packed), np.arange(len(packed)))])
+
+    @property
+    def nbytes(self):
+        return sum(index.nbytes + rows.nbytes for index, rows in self.parts)
+
+    def votes(self, keys):
+        """Shared triplet counts for every view row"""
+        total = np.zeros(self.size, dtype=np.int32)
+        for index, rows in self.parts:
+            votes = index.votes(keys)
+            present = rows >= 0
+            total[rows[present]] += votes[present]
+        return total
+
+    def unindexed(self):
+        """View rows that yielded no triplets"""
+        parts = [rows[index.unindexed] for index, rows in self.parts]
+        rows = np.concatenate(parts) if parts else np.empty(0, dtype=np.intp)
+        return rows[rows >= 0]
+
+    def candidates(self, minutiae, max_candidates=None):
+        """
+        View rows worth full scoring, most shared triplets first
+
+        Fallback rules, each reported in info['reason']:
+        - galleries under MIN_GALLERY templates are scanned in full
+        - probes without MIN_PROBE_TRIPLETS triplets (unparsed, too few
+          minutiae) are scanned in full
+        - at least MIN_CANDIDATES rows are kept even without votes, and at
+          most max_candidates (default MAX_CANDIDATE_FRACTION of the view)
+        - templates that could not be indexed are always candidates
+
+        Returns: (rows, or None for a full scan, info dict)
+        """
+        info = {'used': False, 'candidates': self.size, 'reason': None}
+
+        if self.size < MIN_GALLERY:
+            info['reason'] = 'gallery below prefilter minimum'
+            return None, info
+
+        keys = probe_keys(minutiae)
+        if len(keys) < MIN_PROBE_TRIPLETS:
+            info['reason'] = 'probe has too few triplets'
+            return None, info
+
+        votes = self.votes(keys)
+        limit = max_candidates or max(MIN_CANDIDATES, int(self.size * MAX_CANDIDATE_FRACTION))
+
+        voted = int(np.count_nonzero(votes >= MIN_VOTES))
+        take = min(max(voted, MIN_CANDIDATES), limit, self.size)
+        rows = np.argsort(-votes, kind='stable')[:take]
+
+        unindexed = self.unindexed()
+        if len(unindexed):
+            rows = np.concatenate([rows, unindexed[~np.isin(unindexed, rows)]])
+
+        info.update(used=True, candidates=int(len(rows)), voted=voted, probeTriplets=int(len(keys)))
+        return rows.astype(np.intp), info
@@ -0,0 +1,213 @@
+# python-services/digitalpersona/gallery_search.py
+"""
+1:N search control
+Top-k ranking, early exit on a near-certain match, and per-request
+comparison/time budgets for gallery identification
+"""
+import time
+
+import numpy as np
+
+# Templates scored between early-exit/budget checks
+SEARCH_CHUNK_SIZE = 256
+
+
+def top_k(scores, limit=None):
+    """
+    Rows of the highest scores, best first
+    Returns: (rows, scores) arrays
+    """
+    scores = np.asarray(scores, dtype=np.float32)
+    if limit and limit < len(scores):
+        rows = np.argpartition(-scores, limit - 1)[:limit]
+    else:
+        rows = np.arange(len(scores))
+    rows = rows[np.argsort(-scores[rows], kind='stable')]
+    return rows, scores[rows]
+
+
+class SearchOptions:
+    """How much of the gallery a single identification may search"""
+
+    __slots__ = (
+        'limit', 'certain_threshold', 'max_comparisons', 'time_budget',
+        'prefilter', 'prefilter_fallback', 'max_candidates'
+    )
+
+    def __init__(self, limit=5, certain_threshold=None, max_comparisons=None, time_budget=None,
+                 prefilter=None, prefilter_fallback=True, max_candidates=None):
+        self.limit = limit
+        self.certain_threshold = certain_threshold
+        self.max_comparisons = max_comparisons
+        self.time_budget = time_budget  # seconds
+        self.prefilter = prefilter  # None uses the gallery default
+        self.prefilter_fallback = prefilter_fallback
+        self.max_candidates = max_candidates
+
+    @classmethod
+    def from_request(cls, data, default_limit=5):
+        """
+        Build options from a request body
+        Keys: limit, certainThreshold, maxComparisons, timeBudgetMs,
+        prefilter, prefilterFallback, maxCandidates
+        """
+        def optional(key, cast):
+            value = data.get(key)
+            if value is None:
+                return None
+            try:
+                value = cast(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be a number")
+            if value < 0:
+                raise ValueError(f"{key} must not be negative")
+            return value
+
+        def flag(key, default):
+            value = data.get(key, default)
+            if value is not None and not isinstance(value, bool):
+                raise ValueError(f"{key} must be true or false")
+            return value
+
+        time_budget_ms = optional('timeBudgetMs', float)
+
+        return cls(
+            limit=optional('limit', int) if data.get('limit') is not None else default_limit,
+            certain_threshold=optional('certainThreshold', float),
+            max_comparisons=optional('maxComparisons', int),
+            time_budget=time_budget_ms / 1000.0 if time_budget_ms is not None else None,
+            prefilter=flag('prefilter', None),
+            prefilter_fallback=flag('prefilterFallback', True),
+            max_candidates=optional('maxCandidates', int) or None
+        )
+
+    @property
+    def bounded(self):
+        """True if the search may stop before scoring every template"""
+        return (
+            self.certain_threshold is not None
+            or self.max_comparisons is not None
+            or self.time_budget is not None
+        )
+
+    def remaining(self, stats):
+        """Options for a follow-up pass with whatever budget stats left over"""
+        max_comparisons = self.max_comparisons
+        if max_comparisons is not None:
+            max_comparisons = max(max_comparisons - stats.comparisons, 0)
+
+        time_budget = self.time_budget
+        if time_budget is not None:
+            time_budget = max(time_budget - (time.perf_counter() - stats.started), 0.0)
+
+        return SearchOptions(
+            self.limit, self.certain_threshold, max_comparisons, time_budget,
+            self.prefilter, self.prefilter_fallback, self.max_candidates
+        )
+
+
+class SearchStats:
+    """What a search actually did"""
+
+    __slots__ = (
+        'gallery_size', 'candidates', 'comparisons', 'early_exit', 'budget_exhausted',
+        'prefilter', 'started', 'elapsed'
+    )
+
+    def __init__(self, gallery_size, candidates=None):
+        self.gallery_size = gallery_size
+        self.candidates = gallery_size if candidates is None else candidates
+        self.comparisons = 0
+        self.early_exit = False
+        self.budget_exhausted = False
+        self.prefilter = None
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def should_stop(self, options, best_score):
+        """Check the early-exit and budget rules after a chunk was scored"""
+        if options.certain_threshold is not None and best_score >= options.certain_threshold:
+            self.early_exit = True
+            return True
+
+        if options.max_comparisons is not None and self.comparisons >= options.max_comparisons:
+            self.budget_exhausted = True
+            return True
+
+        if options.time_budget is not None and time.perf_counter() - self.started >= options.time_budget:
+            self.budget_exhausted = True
+            return True
+
+        return False
+
+    def merge(self, other):
+        """Fold in a follow-up pass over more rows of the same gallery"""
+        self.candidates += other.candidates
+        self.comparisons += other.comparisons
+        self.early_exit = self.early_exit or other.early_exit
+        self.budget_exhausted = other.budget_exhausted
+        return self
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    def to_dict(self):
+        return {
+            'gallerySize': self.gallery_size,
+            'candidates': self.candidates,
+            'comparisons': self.comparisons,
+            'earlyExit': self.early_exit,
+            'budgetExhausted': self.budget_exhausted,
+            'prefilter': self.prefilter,
+            'elapsedMs': round(self.elapsed * 1000, 2)
+        }
+
+
+def search_rows(score_rows_fn, count, options, chunk_size=SEARCH_CHUNK_SIZE, rows=None):
+    """
+    Score gallery rows chunk by chunk, honouring early exit and budgets
+    score_rows_fn(rows) -> scores for a slice or an index array of rows
+    rows: candidate rows to search, in order, instead of the whole gallery
+    Returns: (rows, scores, stats) with rows/scores best first
+    """
+    total = count if rows is None else len(rows)
+    stats = SearchStats(count, total)
+
+    def select(start, stop):
+        return slice(start, stop) if rows is None else rows[start:stop]
+
+    def gallery_rows(positions):
+        return positions if rows is None else rows[positions]
+
+    if not options.bounded:
+        scores = score_rows_fn(select(0, total)) if total else np.empty(0, dtype=np.float32)
+        stats.comparisons = total
+        positions, best = top_k(scores, options.limit)
+        return gallery_rows(positions), best, stats.finish()
+
+    parts = []
+    best_score = -np.inf
+    start = 0
+
+    while start < total:
+        stop = min(total, start + chunk_size)
+        if options.max_comparisons is not None:
+            stop = min(stop, start + max(options.max_comparisons - stats.comparisons, 0))
+        if stop <= start:
+            stats.budget_exhausted = True
+            break
+
+        scores = score_rows_fn(select(start, stop))
+        parts.append(scores)
+        stats.comparisons += stop - start
+        if len(scores):
+            best_score = max(best_score, float(scores.max()))
+        start = stop
+
+        if start < total and stats.should_stop(options, best_score):
+            break
+
+    scores = np.concatenate(parts) if parts else np.empty(0, dtype=np.float32)
+    positions, best = top_k(scores, options.limit)
+    return gallery_rows(positions), best, stats.finish()
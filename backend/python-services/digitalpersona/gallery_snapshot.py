@@ -0,0 +1,344 @@
+# python-services/digitalpersona/gallery_snapshot.py
+"""
+Persistent gallery storage
+Versioned binary snapshots that are memory-mapped on boot, plus an
+append-only delta log of enrollments/removals since the last snapshot
+"""
+import os
+import json
+import mmap
+import struct
+import zlib
+import logging
+
+import numpy as np
+
+from minutiae_matcher import PackedMinutiae
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b'DPGALLRY'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGNMENT = 64
+SNAPSHOT_PREFIX = 'snapshot-'
+SNAPSHOT_SUFFIX = '.bin'
+DELTA_LOG_NAME = 'delta.log'
+
+# Delta log record: crc32, sequence, op, id length, data length
+LOG_HEADER = struct.Struct('<IQBHI')
+OP_ENROLL = 1
+OP_REMOVE = 2
+OP_CLEAR = 3
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot file is missing, corrupt or of another version"""
+
+
+class BlobSequence:
+    """Read-only sequence of byte strings stored back to back in one buffer"""
+
+    __slots__ = ('_buffer', '_offsets')
+
+    def __init__(self, buffer, offsets):
+        self._buffer = buffer
+        self._offsets = offsets
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return bytes(self._buffer[int(self._offsets[index]):int(self._offsets[index + 1])])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self):
+        return int(self._offsets[-1]) + self._offsets.nbytes
+
+
+def _blob_sections(items):
+    """Concatenate byte strings into (offsets, blob) arrays"""
+    lengths = np.fromiter((len(item) for item in items), dtype=np.uint64, count=len(items))
+    offsets = np.zeros(len(items) + 1, dtype=np.uint64)
+    np.cumsum(lengths, out=offsets[1:])
+    blob = np.frombuffer(b''.join(items), dtype=np.uint8)
+    return offsets, blob
+
+
+def write_snapshot(path, view, sequence):
+    """
+    Write a GalleryView to a snapshot file
+    The file is written to a temporary name and renamed into place
+    """
+    id_offsets, id_blob = _blob_sections([template_id.encode() for template_id in view.ids])
+    data_offsets, data_blob = _blob_sections(list(view.data))
+
+    sections = {
+        'id_offsets': id_offsets,
+        'id_blob': id_blob,
+        'data_offsets': data_offsets,
+        'data_blob': data_blob,
+        'minutiae_x': view.packed.x,
+        'minutiae_y': view.packed.y,
+        'minutiae_angle': view.packed.angle,
+        'minutiae_counts': view.packed.counts,
+    }
+
+    # Lay sections out after the header, each aligned for direct mapping
+    layout = {}
+    offset = 0
+    for name, array in sections.items():
+        array = np.ascontiguousarray(array)
+        sections[name] = array
+        layout[name] = {
+            'offset': offset,
+            'dtype': array.dtype.str,
+            'shape': list(array.shape),
+        }
+        offset += -(-array.nbytes // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+    header = json.dumps({
+        'version': SNAPSHOT_VERSION,
+        'count': len(view),
+        'sequence': sequence,
+        'sections': layout,
+    }).encode()
+    header_size = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header)) // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack('<II', SNAPSHOT_VERSION, len(header)))
+        f.write(header)
+        f.write(b'\0' * (header_size - f.tell()))
+        for name, array in sections.items():
+            f.seek(header_size + layout[name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(header_size + offset)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+
+
+class MappedSnapshot:
+    """
+    A snapshot file memory-mapped read-only
+    ids, data and packed minutiae are views of the mapped pages, so
+    processes mapping the same file share one copy in the page cache
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise SnapshotError(f"Empty snapshot file: {path}")
+
+        try:
+            self._load()
+        except Exception:
+            self.close()
+            raise
+
+    def _load(self):
+        buffer = self._mmap
+        if buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise SnapshotError(f"Not a gallery snapshot: {self.path}")
+
+        version, header_length = struct.unpack_from('<II', buffer, len(SNAPSHOT_MAGIC))
+        if version != SNAPSHOT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot version {version}: {self.path}")
+
+        start = len(SNAPSHOT_MAGIC) + 8
+        header = json.loads(bytes(buffer[start:start + header_length]))
+        header_size = -(-(start + header_length) // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+        arrays = {}
+        for name, section in header['sections'].items():
+            dtype = np.dtype(section['dtype'])
+            shape = tuple(section['shape'])
+            count = int(np.prod(shape)) if shape else 1
+            arrays[name] = np.frombuffer(
+                buffer, dtype=dtype, count=count, offset=header_size + section['offset']
+            ).reshape(shape)
+
+        self.count = header['count']
+        self.sequence = header['sequence']
+        self.nbytes = len(buffer)
+
+        counts = arrays['minutiae_counts']
+        width = arrays['minutiae_x'].shape[1]
+
+        self.ids = [
+            template_id.decode()
+            for template_id in BlobSequence(arrays['id_blob'], arrays['id_offsets'])
+        ]
+        self.data = BlobSequence(arrays['data_blob'], arrays['data_offsets'])
+        self.packed = PackedMinutiae(
+            arrays['minutiae_x'],
+            arrays['minutiae_y'],
+            arrays['minutiae_angle'],
+            np.arange(width)[None, :] < counts[:, None],
+            counts
+        )
+
+    def close(self):
+        try:
+            self.data = self.packed = None
+            self._mmap.close()
+        except (AttributeError, BufferError):
+            # Views may still reference the pages; they are released with them
+            pass
+        self._file.close()
+
+
+def _encode_record(sequence, op, template_id, data):
+    template_id = template_id.encode()
+    body = struct.pack('<QBHI', sequence, op, len(template_id), len(data)) + template_id + data
+    return struct.pack('<I', zlib.crc32(body)) + body
+
+
+class DeltaLog:
+    """Append-only log of gallery changes made after the last snapshot"""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = 0
+        self._file = None
+
+    def replay(self, after_sequence=0, repair=True):
+        """
+        Read valid records in order, skipping those already in the snapshot
+        With repair a torn or corrupt tail (e.g. after a crash) is truncated away
+        Returns: list of (sequence, op, template_id, data)
+        """
+        records = []
+        if not os.path.exists(self.path):
+            return records
+
+        with open(self.path, 'rb') as f:
+            content = f.read()
+
+        offset = 0
+        while offset + LOG_HEADER.size <= len(content):
+            crc, sequence, op, id_length, data_length = LOG_HEADER.unpack_from(content, offset)
+            end = offset + LOG_HEADER.size + id_length + data_length
+            if end > len(content) or zlib.crc32(content[offset + 4:end]) != crc:
+                break
+
+            body = content[offset + LOG_HEADER.size:end]
+            if sequence > after_sequence:
+                records.append((sequence, op, body[:id_length].decode(), body[id_length:]))
+            offset = end
+
+        if offset != len(content) and repair:
+            logger.warning(f"Discarding {len(content) - offset} corrupt bytes at the end of {self.path}")
+            with open(self.path, 'r+b') as f:
+                f.truncate(offset)
+
+        self.records = len(records)
+        return records
+
+    def append(self, sequence, op, template_id='', data=b''):
+        """Append one record; call sync() to make a batch durable"""
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._file = open(self.path, 'ab')
+
+        self._file.write(_encode_record(sequence, op, template_id, data))
+        self.records += 1
+
+    def sync(self):
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def rewrite(self, records):
+        """Replace the log with just these (sequence, op, id, data) records"""
+        self.close()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for record in records:
+                f.write(_encode_record(*record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        self.records = len(records)
+
+
+class GalleryStore:
+    """
+    Snapshot and delta log files for one gallery directory
+    Snapshots are named by the last log sequence they contain
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.log = DeltaLog(os.path.join(directory, DELTA_LOG_NAME))
+
+    def _snapshot_path(self, sequence):
+        return os.path.join(self.directory, f"{SNAPSHOT_PREFIX}{sequence:012d}{SNAPSHOT_SUFFIX}")
+
+    def _snapshot_files(self):
+        if not os.path.isdir(self.directory):
+            return []
+        names = [
+            name for name in os.listdir(self.directory)
+            if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIX)
+        ]
+        return [os.path.join(self.directory, name) for name in sorted(names, reverse=True)]
+
+    def open_snapshot(self):
+        """Map the newest readable snapshot, or return None if there is none"""
+        for path in self._snapshot_files():
+            try:
+                return MappedSnapshot(path)
+            except (SnapshotError, OSError, ValueError, KeyError) as e:
+                logger.error(f"Skipping unreadable snapshot {path}: {e}")
+        return None
+
+    def stamp(self):
+        """
+        Cheap marker of the files' state: the newest snapshot's path and the
+        delta log's inode, size and mtime. Changes whenever another process
+        appends to the log, compacts it or writes a snapshot
+        """
+        snapshots = self._snapshot_files()
+        try:
+            st = os.stat(self.log.path)
+            log = (st.st_ino, st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            log = None
+        return (snapshots[0] if snapshots else None, log)
+
+    def write_snapshot(self, view, sequence):
+        """Write a new snapshot and return its path"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshot_path(sequence)
+        write_snapshot(path, view, sequence)
+        return path
+
+    def remove_old_snapshots(self, keep_path):
+        """Delete superseded snapshots; files still mapped elsewhere are left alone"""
+        for path in self._snapshot_files():
+            if path == keep_path:
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.debug(f"Could not remove old snapshot {path}: {e}")
@@ -0,0 +1,118 @@
+# python-services/digitalpersona/image_codec.py
+"""
+Preview image encoding
+Raw grayscale bytes, low-compression PNG, or lossy WebP/JPEG previews,
+optionally downscaled to a thumbnail first
+"""
+import base64
+from io import BytesIO
+
+from PIL import Image, features
+
+# format -> MIME type of the encoded bytes
+FORMATS = {
+    'raw': 'application/octet-stream',
+    'png': 'image/png',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg'
+}
+
+
+class ImageCodec:
+    """How a preview image is encoded"""
+
+    __slots__ = ('format', 'max_size', 'quality', 'compress_level')
+
+    def __init__(self, format='png', max_size=None, quality=80, compress_level=1):
+        format = str(format).lower()
+        if format == 'jpg':
+            format = 'jpeg'
+        if format not in FORMATS:
+            raise ValueError(f"imageFormat must be one of {', '.join(FORMATS)}")
+        if format == 'webp' and not features.check('webp'):
+            raise ValueError("webp is not supported by this Pillow build")
+        if not 1 <= quality <= 100:
+            raise ValueError("imageQuality must be between 1 and 100")
+        if not 0 <= compress_level <= 9:
+            raise ValueError("PNG compress level must be between 0 and 9")
+
+        self.format = format
+        self.max_size = max_size or None    # longest side of a thumbnail, None for full size
+        self.quality = quality              # WebP/JPEG
+        self.compress_level = compress_level  # PNG, 0 (none) to 9 (smallest, slowest)
+
+    @classmethod
+    def from_request(cls, data, default):
+        """
+        Codec for one request, falling back to the default codec
+        Keys: imageFormat, imageMaxSize, imageQuality
+        """
+        def optional(key, fallback):
+            value = data.get(key)
+            if value is None or value == '':
+                return fallback
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{key} must be an integer")
+            if value < 0:
+                raise ValueError(f"{key} must not be negative")
+            return value
+
+        return cls(
+            format=data.get('imageFormat') or default.format,
+            max_size=optional('imageMaxSize', default.max_size),
+            quality=optional('imageQuality', default.quality),
+            compress_level=default.compress_level
+        )
+
+    @property
+    def key(self):
+        return (self.format, self.max_size, self.quality, self.compress_level)
+
+    def resize(self, image):
+        """The image downscaled so its longest side fits max_size"""
+        if not self.max_size or max(image.size) <= self.max_size:
+            return image
+        scale = self.max_size / max(image.size)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        return image.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+    def encode(self, image, pixels=None):
+        """
+        Encode a PIL image
+        pixels, the uint8 array the image reads from, lets full-size raw
+        output be base64-encoded straight from the frame buffer
+        Returns: (base64 data, format info with format, mimeType, width, height)
+        """
+        resized = self.resize(image)
+
+        if self.format == 'raw':
+            if pixels is not None and resized is image and pixels.flags['C_CONTIGUOUS']:
+                data = base64.b64encode(pixels).decode()
+            else:
+                data = base64.b64encode(resized.tobytes()).decode()
+        else:
+            buffered = BytesIO()
+            if self.format == 'png':
+                resized.save(buffered, format='PNG', compress_level=self.compress_level)
+            elif self.format == 'webp':
+                resized.save(buffered, format='WEBP', quality=self.quality, method=0)
+            else:
+                resized.save(buffered, format='JPEG', quality=self.quality)
+            # Base64 straight from the stream's buffer rather than a getvalue() copy
+            with buffered.getbuffer() as view:
+                data = base64.b64encode(view).decode()
+
+        info = {
+            'format': self.format,
+            'mimeType': FORMATS[self.format],
+            'width': resized.width,
+            'height': resized.height
+        }
+        if self.format == 'raw':
+            info['mode'] = resized.mode
+        elif self.format != 'png':
+            info['quality'] = self.quality
+
+        return data, info
@@ -0,0 +1,339 @@
+# python-services/digitalpersona/matching_pool.py
+"""
+Multi-process matching pool
+Shards 1:N identification across worker processes so scoring is not
+serialized on one core by the GIL. The gallery is shared with workers as a
+memory-mapped snapshot file, so every process reads the same pages
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+import logging
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+from gallery_search import SEARCH_CHUNK_SIZE, SearchStats, top_k
+from gallery_snapshot import MappedSnapshot, write_snapshot
+from minutiae_matcher import score_batch
+
+logger = logging.getLogger(__name__)
+
+SCORER_MINUTIAE = 'minutiae'
+SCORER_SDK = 'sdk'
+
+# Snapshots mapped inside a worker process, most recent last
+_worker_snapshots = {}
+_WORKER_SNAPSHOT_LIMIT = 2
+
+
+def _attach(path):
+    """Map a published gallery snapshot in this worker, reusing earlier maps"""
+    snapshot = _worker_snapshots.get(path)
+    if snapshot is None:
+        snapshot = MappedSnapshot(path)
+        _worker_snapshots[path] = snapshot
+        while len(_worker_snapshots) > _WORKER_SNAPSHOT_LIMIT:
+            oldest = next(iter(_worker_snapshots))
+            _worker_snapshots.pop(oldest).close()
+    return snapshot
+
+
+def _ready():
+    """Warm-up task: returns once a worker process is up"""
+    return os.getpid()
+
+
+def _sdk_scores(probe, snapshot, rows):
+    import dpfpdd
+
+    scores = np.zeros(len(rows), dtype=np.float32)
+    for i, row in enumerate(rows):
+        try:
+            # dpfpdd.compare returns a dissimilarity score (0 = identical)
+            scores[i] = 1.0 - (dpfpdd.compare(probe, snapshot.data[int(row)]) / 100000.0)
+        except Exception:
+            pass
+    return scores
+
+
+def _score_shard(path, scorer, probe, rows, limit):
+    """
+    Worker task: score one shard of a published gallery
+    rows: a slice of the gallery, or an index array of candidate rows
+    Returns: (rows, scores, comparisons) for the shard's best candidates
+    """
+    snapshot = _attach(path)
+    if isinstance(rows, slice):
+        rows = slice(rows.start, min(rows.stop, snapshot.count))
+        indices = np.arange(rows.start, rows.stop)
+    else:
+        indices = rows = rows[rows < snapshot.count]
+
+    if scorer == SCORER_SDK:
+        scores = _sdk_scores(probe, snapshot, indices)
+    else:
+        scores = score_batch(probe, snapshot.packed.select(rows))
+
+    positions, best = top_k(scores, limit)
+    return indices[positions], best, len(indices)
+
+
+class MatchingPool:
+    """
+    Persistent worker processes scoring shards of the gallery in parallel
+    Each shard's top-k comes back and is merged in the parent
+    A worker crash breaks the pool for good: forking replacements from a
+    process that is already serving requests could copy a lock held by
+    another thread. Callers check running and search in-process instead
+    """
+
+    def __init__(self, workers=None, scorer=SCORER_MINUTIAE, shards_per_worker=2, directory=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.scorer = scorer
+        self.shards_per_worker = shards_per_worker
+        self._directory = directory
+        self._own_directory = directory is None
+        self._executor = None
+        self._published = None     # (view, path, order)
+        self._writing = None       # (view, path, done event) while a pool file is written
+        self._retired = []         # superseded pool files, oldest first
+        self._order = 0            # publish requests, so a slow write never replaces a newer view
+        self._generation = 0
+        self._broken = False
+        self._searches = 0
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._executor is not None and not self._broken
+
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers)
+
+    def start(self):
+        """
+        Start the worker processes now rather than on the first search
+        Call it before the service starts other threads: on fork platforms
+        each worker is a copy of the process as it is at this point
+        """
+        with self._lock:
+            if self._executor is not None or self._broken:
+                return
+            if self._directory is None:
+                self._directory = tempfile.mkdtemp(prefix='dp-matching-')
+            os.makedirs(self._directory, exist_ok=True)
+            self._executor = executor = self._new_executor()
+
+        # The executor starts processes on demand; one task per worker starts them all
+        for future in [executor.submit(_ready) for _ in range(self.workers)]:
+            future.result()
+
+        logger.info(f"Matching pool started with {self.workers} workers ({self.scorer})")
+
+    def shutdown(self):
+        """Stop the workers and remove published gallery files"""
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._published = None
+
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if self._own_directory and self._directory:
+            shutil.rmtree(self._directory, ignore_errors=True)
+
+    def _break(self, broken):
+        """Stop using the pool after a worker crashed, until the service restarts"""
+        with self._lock:
+            if self._executor is not broken:
+                # Another search already noticed (or the pool was shut down)
+                return
+            self._broken = True
+
+        broken.shutdown(wait=False, cancel_futures=True)
+        logger.error("Matching pool worker crashed - searching in-process until the service restarts")
+
+    def _publish(self, view, snapshot_path=None):
+        """
+        Make a gallery view readable by the workers
+        A view that is already a mapped snapshot is shared as-is; otherwise
+        it is written once to a pool file, and only again after it changes.
+        The file is written outside the lock: searches of the published view
+        carry on meanwhile, and concurrent searches of the new view wait for
+        the one write
+        """
+        with self._lock:
+            if self._published is not None and self._published[0] is view:
+                return self._published[1]
+            self._order += 1
+            order = self._order
+
+            writing = None
+            if snapshot_path is not None:
+                path = snapshot_path
+            elif self._writing is not None and self._writing[0] is view:
+                writing = self._writing
+            else:
+                self._generation += 1
+                generation = self._generation
+                path = os.path.join(self._directory, f"gallery-{generation:08d}.bin")
+                self._writing = (view, path, threading.Event())
+
+        if writing is not None:
+            writing[2].wait()
+            if os.path.exists(writing[1]):
+                return writing[1]
+            # The write failed; try it here
+            return self._publish(view)
+
+        if snapshot_path is None:
+            try:
+                write_snapshot(path, view, generation)
+            finally:
+                with self._lock:
+                    done = self._writing[2]
+                    self._writing = None
+                done.set()
+
+        self._swap(view, path, order)
+        return path
+
+    def _swap(self, view, path, order):
+        """
+        Publish a ready view unless a newer one got there first
+        Pool files are retired, keeping one superseded file for searches
+        still in flight
+        """
+        with self._lock:
+            superseded = path
+            if self._published is None or order > self._published[2]:
+                superseded = self._published[1] if self._published is not None else None
+                self._published = (view, path, order)
+            if superseded and superseded.startswith(self._directory):
+                self._retired.append(superseded)
+            stale, self._retired = self._retired[:-1], self._retired[-1:]
+
+        for stale_path in stale:
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+
+    def _shard_bounds(self, count, options):
+        """
+        Split the gallery into shards; bounded searches use smaller shards
+        so an early exit or budget stop can skip the ones not yet started
+        """
+        if options.max_comparisons is not None:
+            count = min(count, options.max_comparisons)
+
+        shards = self.workers * self.shards_per_worker
+        if options.bounded:
+            shards = max(shards, count // SEARCH_CHUNK_SIZE)
+        shards = max(1, min(count, shards))
+
+        bounds = np.linspace(0, count, shards + 1).astype(int)
+        return [(int(start), int(stop)) for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+    def _collect(self, futures, options, stats):
+        """
+        Gather shard results as they finish, stopping early when allowed
+        Shards that have not started yet are cancelled on a stop
+        """
+        results = []
+        pending = set(futures)
+        best_score = -np.inf
+
+        while pending:
+            timeout = None
+            if options.time_budget is not None:
+                timeout = max(0.0, options.time_budget - (time.perf_counter() - stats.started))
+
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                stats.budget_exhausted = True
+                break
+
+            for future in done:
+                rows, scores, compared = future.result()
+                results.append((rows, scores))
+                stats.comparisons += compared
+                if len(scores):
+                    best_score = max(best_score, float(scores[0]))
+
+            if pending and stats.should_stop(options, best_score):
+                break
+
+        for future in pending:
+            future.cancel()
+
+        return results
+
+    def search(self, view, probe, options, snapshot_path=None, rows=None):
+        """
+        Score a probe against a view across the workers
+        probe: minutiae array (minutiae scorer) or raw template bytes (sdk scorer)
+        rows: candidate rows to search instead of the whole view
+        Returns: (rows, scores, stats) with rows/scores best first
+        Raises: BrokenProcessPool when a worker crashed; the pool stops running
+        """
+        if not self.running:
+            raise RuntimeError('Matching pool is not running')
+
+        total = len(view) if rows is None else len(rows)
+        stats = SearchStats(len(view), total)
+        shards = [
+            slice(start, stop) if rows is None else rows[start:stop]
+            for start, stop in self._shard_bounds(total, options)
+        ]
+
+        if not shards:
+            stats.budget_exhausted = total > 0
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float32), stats.finish()
+
+        for attempt in range(2):
+            path = self._publish(view, snapshot_path)
+            executor = self._executor
+            if executor is None:
+                raise RuntimeError('Matching pool is not running')
+            try:
+                futures = [
+                    executor.submit(_score_shard, path, self.scorer, probe, shard, options.limit)
+                    for shard in shards
+                ]
+                results = self._collect(futures, options, stats)
+                break
+            except BrokenProcessPool:
+                self._break(executor)
+                raise
+            except FileNotFoundError:
+                # The gallery snapshot was compacted away; publish a pool copy
+                if attempt or snapshot_path is None:
+                    raise
+                with self._lock:
+                    self._published = None
+                snapshot_path = None
+                stats.comparisons = 0
+
+        self._searches += 1
+        if stats.comparisons < total and not stats.early_exit:
+            stats.budget_exhausted = True
+
+        rows = np.concatenate([r for r, _ in results]) if results else np.empty(0, dtype=np.intp)
+        scores = np.concatenate([s for _, s in results]) if results else np.empty(0, dtype=np.float32)
+        order, best = top_k(scores, options.limit)
+
+        return rows[order], best, stats.finish()
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'workers': self.workers,
+            'scorer': self.scorer,
+            'searches': self._searches,
+            'broken': self._broken,
+            'publishedGeneration': self._generation
+        }
@@ -0,0 +1,371 @@
+# python-services/digitalpersona/metrics.py
+"""
+Prometheus-style metrics
+Counters, gauges and fixed-bucket histograms kept in process and rendered
+in the text exposition format for /metrics. Recording costs a bisect and a
+few adds under the metric's lock; values the services already keep (queue
+depths, cache and buffer stats) are read only when scraped
+With pre-forked workers, each worker writes its counters and histograms to
+a shared directory and the device owner's /metrics adds them to its own;
+gauges (reader, queue and buffer state) come from the owner alone
+"""
+import os
+import glob
+import json
+import time
+import atexit
+import logging
+import threading
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds, from sub-millisecond compares up to captures waiting for a finger
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+    shared = False  # summed across worker processes
+
+    def __init__(self, name, help, labels=(), fn=None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.fn = fn            # scrape-time values: a number, or {label values: number}
+        self._values = {}       # label values tuple -> number
+        self._lock = threading.Lock()
+
+    def _samples(self):
+        if self.fn is None:
+            with self._lock:
+                return list(self._values.items())
+        values = self.fn()
+        if isinstance(values, dict):
+            return [
+                (key if isinstance(key, tuple) else (key,), value)
+                for key, value in values.items()
+            ]
+        return [((), values)]
+
+    def snapshot(self):
+        """Samples as JSON-ready [label values, value] pairs"""
+        return [[list(key), value] for key, value in self._samples()]
+
+    def _merged(self, others):
+        samples = dict(self._samples())
+        for other in others:
+            for key, value in other:
+                key = tuple(key)
+                samples[key] = samples.get(key, 0) + value
+        return samples.items()
+
+    def render(self, others=()):
+        """others: snapshots of the same metric from other processes"""
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for key, value in self._merged(others) if self.shared else self._samples():
+            lines.append(f'{self.name}{_labels(self.label_names, key)} {_number(value)}')
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonic count; inc('label value', ...) or read from fn when scraped"""
+
+    kind = 'counter'
+    shared = True
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """Current value; set() or read from fn when scraped"""
+
+    kind = 'gauge'
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labels', 'started')
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed upper bounds"""
+
+    kind = 'histogram'
+    shared = True
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), sum, count
+                series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labels):
+        """Context manager observing the seconds its block took"""
+        return _Timer(self, labels)
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), [list(counts), total, count]] for key, (counts, total, count) in self._values.items()]
+
+    def render(self, others=()):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: [list(counts), total, count] for key, (counts, total, count) in self._values.items()}
+        for other in others:
+            for key, (counts, total, count) in other:
+                merged = series.setdefault(tuple(key), [[0] * (len(self.buckets) + 1), 0.0, 0])
+                if len(counts) == len(merged[0]):
+                    merged[0] = [a + b for a, b in zip(merged[0], counts)]
+                    merged[1] += total
+                    merged[2] += count
+
+        for key, (counts, total, count) in series.items():
+            cumulative = 0
+            for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket
+                le = f'le="{_number(bound)}"'
+                lines.append(f'{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.label_names, key)} {_number(total)}')
+            lines.append(f'{self.name}_count{_labels(self.label_names, key)} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """The metrics one process exposes, in registration order"""
+
+    def __init__(self, prefix='fingerprint_'):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=(), fn=None):
+        return self._add(Counter(self.prefix + name, help, labels, fn))
+
+    def gauge(self, name, help, labels=(), fn=None):
+        return self._add(Gauge(self.prefix + name, help, labels, fn))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, labels, buckets))
+
+    def snapshot(self):
+        """Counters and histograms by name, for another process to merge"""
+        values = {}
+        for metric in self._metrics:
+            if metric.shared:
+                try:
+                    values[metric.name] = metric.snapshot()
+                except Exception as e:
+                    logger.warning(f"Metric {metric.name} left out of snapshot: {e}")
+        return values
+
+    def render(self, others=()):
+        """
+        All metrics in the Prometheus text format
+        others: snapshot() results of other processes, added to this one's
+        """
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.render([other[metric.name] for other in others if metric.name in other]))
+            except Exception as e:
+                # A failing scrape-time source must not hide the other metrics
+                lines.append(f'# {metric.name} unavailable: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+class SharedMetrics:
+    """
+    Directory of per-process metric snapshots (metrics-<pid>.json)
+    Workers write theirs every interval and on exit; the owner reads them
+    all when scraped. Files are cumulative, so a worker's counts stay in
+    the totals after it exits, until the owner restarts and clears them
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._stop = threading.Event()
+
+    def clear(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def write(self, registry):
+        """Replace this process's snapshot file"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(registry.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    def start(self, registry, interval=5.0):
+        """Write the snapshot every interval seconds and once more at exit"""
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    self.write(registry)
+                except Exception as e:
+                    logger.warning(f"Could not write metrics to {self.directory}: {e}")
+
+        self.write(registry)
+        atexit.register(self.write, registry)
+        threading.Thread(target=run, name='metrics-writer', daemon=True).start()
+
+    def collect(self):
+        """Every process's snapshot but this one's"""
+        own = os.path.join(self.directory, f'metrics-{os.getpid()}.json')
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, 'metrics-*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Unreadable metrics snapshot {path}: {e}")
+        return snapshots
+
+
+def register_service_metrics(metrics, readers, scan_log, scan_events, frame_buffer,
+                             frame_pool, compare_cache, gallery):
+    """
+    Scrape-time metrics read from the stats the service already keeps:
+    reader state, pipeline queues and failures, scan buffer and stream,
+    frame buffer and pool, compare cache and gallery size
+    """
+    def per_reader(fn):
+        return lambda: {(reader_id,): fn(reader_id, device) for reader_id, device in readers.items()}
+
+    def per_pipeline(fn):
+        def collect():
+            values = {}
+            for reader_id, _ in readers.items():
+                stats = readers.pipeline(reader_id).stats()
+                for key, value in fn(stats).items():
+                    values[(reader_id,) + key] = value
+            return values
+        return collect
+
+    metrics.gauge(
+        'reader_connected', 'Whether each reader is connected', ['reader'],
+        fn=per_reader(lambda reader_id, device: int(device.is_connected))
+    )
+    metrics.gauge(
+        'monitoring_active', 'Whether each reader is being monitored', ['reader'],
+        fn=lambda: {(reader_id,): int(reader_id in readers.monitoring()) for reader_id in readers.ids()}
+    )
+    metrics.gauge(
+        'pipeline_queue_depth', 'Frames waiting in each monitoring pipeline queue', ['reader', 'queue'],
+        fn=per_pipeline(lambda stats: {
+            ('extract',): stats['queues']['extract'],
+            ('encode',): stats['queues']['encode']
+        })
+    )
+    metrics.counter(
+        'pipeline_stage_failures_total', 'Monitoring pipeline stage failures', ['reader', 'stage'],
+        fn=per_pipeline(lambda stats: {
+            (stage,): values['failed'] for stage, values in stats['stages'].items()
+        })
+    )
+    metrics.counter(
+        'pipeline_stalls_total', 'Captures that waited on a full extract queue', ['reader'],
+        fn=per_pipeline(lambda stats: {(): stats['stalls']})
+    )
+
+    metrics.gauge('scan_buffer_events', 'Scan events held for pollers and resumes',
+                  fn=lambda: scan_log.stats()['buffered'])
+    metrics.counter('scans_dropped_total', 'Scan events overwritten before any poller read them',
+                    fn=lambda: scan_log.stats()['dropped'])
+    metrics.counter('scans_published_total', 'Scan events published',
+                    fn=lambda: scan_events.stats()['published'])
+    metrics.gauge('stream_subscribers', 'Connected scan stream clients',
+                  fn=lambda: scan_events.stats()['subscribers'])
+    metrics.counter('stream_overflows_total', 'Stream clients dropped for falling behind',
+                    fn=lambda: scan_events.stats()['overflows'])
+
+    metrics.gauge('frame_buffer_frames', 'Raw frames held for on-demand image encoding',
+                  fn=lambda: frame_buffer.stats()['frames'])
+    metrics.counter(
+        'frame_buffer_total', 'Frame buffer activity', ['event'],
+        fn=lambda: {
+            (event,): frame_buffer.stats()[event]
+            for event in ('encoded', 'served', 'expired', 'evicted')
+        }
+    )
+    metrics.gauge('frame_pool_free', 'Pooled frame buffers free for captures',
+                  fn=lambda: frame_pool.stats()['free'])
+    metrics.counter(
+        'frame_pool_total', 'Frame pool acquisitions', ['source'],
+        fn=lambda: {
+            (source,): frame_pool.stats()[source]
+            for source in ('reused', 'allocated', 'oversized')
+        }
+    )
+
+    metrics.counter(
+        'compare_cache_total', 'Compare cache lookups', ['result'],
+        fn=lambda: {
+            ('hit',): compare_cache.stats()['hits'],
+            ('miss',): compare_cache.stats()['misses']
+        }
+    )
+    metrics.gauge('gallery_templates', 'Templates enrolled in the identification gallery',
+                  fn=lambda: len(gallery))
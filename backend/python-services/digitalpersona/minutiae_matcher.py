@@ -0,0 +1,227 @@
+# python-services/digitalpersona/minutiae_matcher.py
+"""
+Vectorized minutiae matcher for ANSI 378 templates
+Scores one probe against a whole batch of gallery templates with NumPy
+"""
+import numpy as np
+
+# Alignment (Hough) vote bins
+ANGLE_BINS = 24             # 15 degree rotation bins
+TRANSLATION_BIN = 16        # pixels
+MAX_ROTATION = np.deg2rad(60)
+
+# Pairing tolerances once the alignment is known
+DISTANCE_TOLERANCE = 15     # pixels
+ANGLE_TOLERANCE = np.deg2rad(20)
+
+# Probes/templates with fewer points than this never match
+MIN_MINUTIAE = 6
+
+# Gallery entries scored per vectorized step, bounds peak memory
+CHUNK_SIZE = 256
+
+
+def ansi_angle_to_radians(angle):
+    """
+    Convert ANSI angles (counter-clockwise, units of 2 degrees) to radians
+    in image coordinates (y pointing down)
+    """
+    return -np.deg2rad(angle.astype(np.float32) * 2)
+
+
+def minutiae_to_points(minutiae):
+    """Convert a MINUTIA_DTYPE array into float32 (x, y, theta) columns"""
+    points = np.empty((len(minutiae), 3), dtype=np.float32)
+    points[:, 0] = minutiae['x']
+    points[:, 1] = minutiae['y']
+    points[:, 2] = ansi_angle_to_radians(minutiae['angle'])
+    return points
+
+
+class PackedMinutiae:
+    """
+    Gallery minutiae padded into dense (templates x max_minutiae) arrays
+    so a probe can be scored against all of them at once
+    Points keep their compact ANSI integer types and are widened to
+    float32 one chunk at a time while scoring
+    """
+
+    __slots__ = ('x', 'y', 'angle', 'mask', 'counts')
+
+    def __init__(self, x, y, angle, mask, counts):
+        self.x = x
+        self.y = y
+        self.angle = angle
+        self.mask = mask
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.__slots__)
+
+    @classmethod
+    def from_minutiae(cls, minutiae_list, max_minutiae=None):
+        """Pack a list of MINUTIA_DTYPE arrays"""
+        counts = np.array([len(m) for m in minutiae_list], dtype=np.int32)
+        width = max_minutiae or (int(counts.max()) if len(counts) else 0)
+        width = max(width, 1)
+
+        shape = (len(minutiae_list), width)
+        x = np.zeros(shape, dtype=np.uint16)
+        y = np.zeros(shape, dtype=np.uint16)
+        angle = np.zeros(shape, dtype=np.uint8)
+
+        for row, minutiae in enumerate(minutiae_list):
+            n = min(len(minutiae), width)
+            x[row, :n] = minutiae['x'][:n]
+            y[row, :n] = minutiae['y'][:n]
+            angle[row, :n] = minutiae['angle'][:n]
+
+        counts = np.minimum(counts, width)
+        mask = np.arange(width)[None, :] < counts[:, None]
+        return cls(x, y, angle, mask, counts)
+
+    def take(self, rows):
+        """Copy of the given template rows"""
+        rows = np.asarray(rows, dtype=np.intp)
+        return PackedMinutiae(
+            self.x[rows], self.y[rows], self.angle[rows], self.mask[rows], self.counts[rows]
+        )
+
+    @classmethod
+    def concatenate(cls, parts):
+        """Stack packed batches, padding them to the widest one"""
+        width = max(part.x.shape[1] for part in parts)
+
+        def pad(array):
+            return np.pad(array, ((0, 0), (0, width - array.shape[1])))
+
+        return cls(
+            np.concatenate([pad(part.x) for part in parts]),
+            np.concatenate([pad(part.y) for part in parts]),
+            np.concatenate([pad(part.angle) for part in parts]),
+            np.concatenate([pad(part.mask) for part in parts]),
+            np.concatenate([part.counts for part in parts])
+        )
+
+    def slice(self, start, stop):
+        return PackedMinutiae(
+            self.x[start:stop], self.y[start:stop], self.angle[start:stop],
+            self.mask[start:stop], self.counts[start:stop]
+        )
+
+    def select(self, rows):
+        """Rows given as a slice (a view, no copy) or an index array (a copy)"""
+        if isinstance(rows, slice):
+            return self.slice(rows.start, rows.stop)
+        return self.take(rows)
+
+
+def _wrap_angle(angle):
+    """Wrap radians into [-pi, pi)"""
+    return (angle + np.pi) % (2 * np.pi) - np.pi
+
+
+def _score_chunk(probe, packed):
+    """Score a probe (n x 3 points) against one chunk of packed templates"""
+    g = len(packed)
+    n = len(probe)
+
+    px = probe[:, 0][None, :, None]
+    py = probe[:, 1][None, :, None]
+    pt = probe[:, 2][None, :, None]
+
+    gx = packed.x.astype(np.float32)[:, None, :]
+    gy = packed.y.astype(np.float32)[:, None, :]
+    gt = ansi_angle_to_radians(packed.angle)[:, None, :]
+
+    # Every probe/gallery pair proposes a rotation and a translation
+    rotation = _wrap_angle(gt - pt)                         # (g, n, m)
+    cos_r = np.cos(rotation)
+    sin_r = np.sin(rotation)
+    dx = gx - (cos_r * px - sin_r * py)
+    dy = gy - (sin_r * px + cos_r * py)
+
+    valid = packed.mask[:, None, :] & (np.abs(rotation) <= MAX_ROTATION)
+    valid = np.broadcast_to(valid, rotation.shape)
+
+    # Hough accumulator key: (template, rotation bin, dx bin, dy bin)
+    extent = float(max(np.abs(dx).max(initial=0), np.abs(dy).max(initial=0))) + 1
+    span = int(np.ceil(2 * extent / TRANSLATION_BIN)) + 1
+    bin_r = np.floor((rotation + np.pi) / (2 * np.pi / ANGLE_BINS)).astype(np.int64) % ANGLE_BINS
+    bin_x = np.floor((dx + extent) / TRANSLATION_BIN).astype(np.int64)
+    bin_y = np.floor((dy + extent) / TRANSLATION_BIN).astype(np.int64)
+    row = np.broadcast_to(np.arange(g, dtype=np.int64)[:, None, None], rotation.shape)
+
+    key = ((row * ANGLE_BINS + bin_r) * span + bin_x) * span + bin_y
+    key = key[valid]
+
+    if key.size == 0:
+        return np.zeros(g, dtype=np.float32)
+
+    cells, inverse, votes = np.unique(key, return_inverse=True, return_counts=True)
+    cell_row = cells // (ANGLE_BINS * span * span)
+
+    # Strongest cell per template: sort by (row, votes) and take the last of each row
+    order = np.lexsort((votes, cell_row))
+    last = np.r_[cell_row[order][1:] != cell_row[order][:-1], True]
+    peak = order[last]
+    peak_row = cell_row[peak]
+
+    # Mean transform of the votes that landed in each peak cell
+    sum_cos = np.bincount(inverse, weights=cos_r[valid], minlength=len(cells))[peak]
+    sum_sin = np.bincount(inverse, weights=sin_r[valid], minlength=len(cells))[peak]
+    sum_dx = np.bincount(inverse, weights=dx[valid], minlength=len(cells))[peak]
+    sum_dy = np.bincount(inverse, weights=dy[valid], minlength=len(cells))[peak]
+    count = votes[peak]
+
+    angle = np.zeros(g, dtype=np.float32)
+    tx = np.zeros(g, dtype=np.float32)
+    ty = np.zeros(g, dtype=np.float32)
+    angle[peak_row] = np.arctan2(sum_sin, sum_cos)
+    tx[peak_row] = sum_dx / count
+    ty[peak_row] = sum_dy / count
+
+    # Apply the alignment and pair up points within tolerance
+    cos_a = np.cos(angle)[:, None, None]
+    sin_a = np.sin(angle)[:, None, None]
+    ax = cos_a * px - sin_a * py + tx[:, None, None]
+    ay = sin_a * px + cos_a * py + ty[:, None, None]
+    at = pt + angle[:, None, None]
+
+    close = (
+        ((ax - gx) ** 2 + (ay - gy) ** 2 <= DISTANCE_TOLERANCE ** 2)
+        & (np.abs(_wrap_angle(at - gt)) <= ANGLE_TOLERANCE)
+        & packed.mask[:, None, :]
+    )
+
+    matched = np.minimum(close.any(axis=2).sum(axis=1), close.any(axis=1).sum(axis=1))
+
+    scores = 2.0 * matched / np.maximum(n + packed.counts, 1)
+    scores[packed.counts < MIN_MINUTIAE] = 0.0
+
+    return np.minimum(scores, 1.0).astype(np.float32)
+
+
+def score_batch(probe_minutiae, packed):
+    """
+    Score one probe against every template in a PackedMinutiae batch
+    Returns: float32 array of similarities in [0, 1], one per template
+    """
+    if len(probe_minutiae) < MIN_MINUTIAE or len(packed) == 0:
+        return np.zeros(len(packed), dtype=np.float32)
+
+    probe = minutiae_to_points(probe_minutiae)
+
+    return np.concatenate([
+        _score_chunk(probe, packed.slice(start, start + CHUNK_SIZE))
+        for start in range(0, len(packed), CHUNK_SIZE)
+    ])
+
+
+def score_pair(minutiae1, minutiae2):
+    """Similarity of two minutiae arrays in [0, 1]"""
+    return float(score_batch(minutiae1, PackedMinutiae.from_minutiae([minutiae2]))[0])
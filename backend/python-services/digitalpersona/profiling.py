@@ -0,0 +1,352 @@
+# python-services/digitalpersona/profiling.py
+"""
+Opt-in hot-path profiling
+Traces: a sampled fraction of requests records a span tree (capture stages,
+extraction, encoding, response) kept in a small ring for the admin endpoints.
+Unsampled requests pay one thread-local lookup per span
+Stacks: on demand, every thread's Python stack is sampled for a few seconds
+and returned as collapsed stacks ("frame;frame;frame count") for
+flamegraph.pl, speedscope or inferno
+With pre-forked workers, the owner shares its settings and the workers
+their traces through a directory (SharedProfile)
+"""
+import os
+import sys
+import glob
+import json
+import time
+import random
+import logging
+import threading
+from collections import Counter, deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_SECONDS = 60.0
+MAX_STACK_HZ = 1000
+
+
+class Span:
+    __slots__ = ('name', 'start', 'duration', 'children')
+
+    def __init__(self, name, start):
+        self.name = name
+        self.start = start
+        self.duration = None
+        self.children = []
+
+    def to_dict(self, origin):
+        return {
+            'name': self.name,
+            'startMs': round((self.start - origin) * 1000, 3),
+            'durationMs': round((self.duration or 0.0) * 1000, 3),
+            'children': [child.to_dict(origin) for child in self.children]
+        }
+
+
+class Trace:
+    """Span tree of one sampled request"""
+
+    __slots__ = ('root', 'open', 'timestamp', 'status', 'thread')
+
+    def __init__(self, name):
+        self.root = Span(name, time.perf_counter())
+        self.open = [self.root]     # innermost open span last
+        self.timestamp = time.time()
+        self.status = None
+        self.thread = threading.current_thread().name
+
+    def to_dict(self):
+        return {
+            'name': self.root.name,
+            'pid': os.getpid(),
+            'timestamp': datetime.fromtimestamp(self.timestamp).isoformat(),
+            'status': self.status,
+            'thread': self.thread,
+            'durationMs': round((self.root.duration or 0.0) * 1000, 3),
+            'spans': self.root.to_dict(self.root.start)['children']
+        }
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _SpanContext:
+    __slots__ = ('trace', 'span')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.span = Span(name, 0.0)
+
+    def __enter__(self):
+        self.trace.open[-1].children.append(self.span)
+        self.trace.open.append(self.span)
+        self.span.start = time.perf_counter()
+        return self.span
+
+    def __exit__(self, *exc):
+        self.span.duration = time.perf_counter() - self.span.start
+        self.trace.open.pop()
+        return False
+
+
+class Profiler:
+    """
+    Request sampling and span recording, switchable at runtime
+    A trace belongs to the thread that began it; spans opened on other
+    threads (monitoring pipeline) are not recorded. Handlers that hand work
+    to other threads (ASGI) begin an unbound trace and pass it along with
+    run_in()
+    """
+
+    def __init__(self, enabled=False, sample_rate=0.01, max_traces=100):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self._traces = deque(maxlen=max_traces)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sampled = 0
+        self._stacks_running = threading.Lock()
+
+    def configure(self, enabled=None, sample_rate=None):
+        if enabled is not None and not isinstance(enabled, bool):
+            raise ValueError('enabled must be true or false')
+        if sample_rate is not None:
+            sample_rate = float(sample_rate)
+            if not 0.0 <= sample_rate <= 1.0:
+                raise ValueError('sampleRate must be between 0 and 1')
+            self.sample_rate = sample_rate
+        if enabled is not None:
+            self.enabled = enabled
+
+    def begin(self, name, bind=True):
+        """
+        Start tracing a request if it is sampled
+        bind: make it this thread's trace; unbound traces are ended with end()
+        """
+        sampled = self.enabled and random.random() < self.sample_rate
+        trace = Trace(name) if sampled else None
+        if bind:
+            self._local.trace = trace
+        return trace
+
+    def finish(self, status=None):
+        """End this thread's trace, if any, and keep it; safe to call twice"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return None
+        self._local.trace = None
+        return self.end(trace, status)
+
+    def run_in(self, trace, fn, *args):
+        """Call fn with trace as this thread's trace, e.g. on an executor thread"""
+        if trace is None:
+            return fn(*args)
+        self._local.trace = trace
+        try:
+            return fn(*args)
+        finally:
+            self._local.trace = None
+
+    def end(self, trace, status=None):
+        """End an unbound trace and keep it"""
+        if trace is None:
+            return None
+        trace.root.duration = time.perf_counter() - trace.root.start
+        trace.status = status
+        with self._lock:
+            self._traces.append(trace)
+            self._sampled += 1
+        return trace
+
+    def span(self, name):
+        """Context manager recording a child span of the current one"""
+        trace = getattr(self._local, 'trace', None)
+        if trace is None:
+            return _NULL_SPAN
+        return _SpanContext(trace, name)
+
+    def traces(self, limit=None):
+        """Most recent traces first"""
+        with self._lock:
+            traces = list(self._traces)
+        traces.reverse()
+        return traces[:limit] if limit else traces
+
+    def clear(self):
+        with self._lock:
+            self._traces.clear()
+
+    def settings(self):
+        return {'enabled': self.enabled, 'sampleRate': self.sample_rate}
+
+    @property
+    def sampled(self):
+        return self._sampled
+
+    def status(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'sampleRate': self.sample_rate,
+                'sampled': self._sampled,
+                'buffered': len(self._traces),
+                'maxTraces': self._traces.maxlen,
+                'stacksRunning': self._stacks_running.locked()
+            }
+
+    def sample_stacks(self, seconds=5.0, hz=100):
+        """
+        Wall-clock stack samples of every other thread
+        Blocks for the sampling window; one window runs at a time
+        Returns: collapsed stacks text, or None if a window is already running
+        """
+        seconds = float(seconds)
+        hz = int(hz)
+        if not 0 < seconds <= MAX_STACK_SECONDS:
+            raise ValueError(f'seconds must be between 0 and {MAX_STACK_SECONDS:g}')
+        if not 0 < hz <= MAX_STACK_HZ:
+            raise ValueError(f'hz must be between 1 and {MAX_STACK_HZ}')
+        if not self._stacks_running.acquire(blocking=False):
+            return None
+        try:
+            return folded_text(collect_stacks(seconds, 1.0 / hz))
+        finally:
+            self._stacks_running.release()
+
+
+def _frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def collect_stacks(seconds, interval):
+    """Count each thread's stack, root first under its thread name, every interval"""
+    counts = Counter()
+    me = threading.get_ident()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f'thread-{ident}'))
+            stack.reverse()
+            counts[';'.join(stack)] += 1
+        time.sleep(interval)
+
+    return counts
+
+
+def folded_spans(traces):
+    """Trace dicts as collapsed stacks of span self time in microseconds"""
+    totals = Counter()
+
+    def add(prefix, name, duration_ms, children):
+        path = f'{prefix};{name}' if prefix else name
+        own = duration_ms - sum(child['durationMs'] for child in children)
+        totals[path] += max(int(own * 1000), 0)
+        for child in children:
+            add(path, child['name'], child['durationMs'], child['children'])
+
+    for trace in traces:
+        add('', trace['name'], trace['durationMs'], trace['spans'])
+    return folded_text(totals)
+
+
+def folded_text(counts):
+    return ''.join(f'{stack} {count}\n' for stack, count in sorted(counts.items()) if count)
+
+
+class SharedProfile:
+    """
+    Profiling across pre-forked workers, through a shared directory
+    The owner writes its settings (profile.json) whenever they change;
+    each worker follows them and writes its recent traces
+    (traces-<pid>.json) for the owner's /admin/profile/traces, both every
+    interval seconds
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.settings_path = os.path.join(directory, 'profile.json')
+        self._settings_stamp = None
+        self._written = None
+
+    def _write(self, path, value):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.directory, 'traces-*.json')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def write_settings(self, profiler):
+        self._write(self.settings_path, profiler.settings())
+
+    def start(self, profiler, interval=1.0):
+        def run():
+            while True:
+                try:
+                    self._follow(profiler)
+                    self._write_traces(profiler)
+                except Exception as e:
+                    logger.warning(f"Profile sync with {self.directory} failed: {e}")
+                time.sleep(interval)
+
+        threading.Thread(target=run, name='profile-sync', daemon=True).start()
+
+    def _follow(self, profiler):
+        try:
+            stat = os.stat(self.settings_path)
+        except FileNotFoundError:
+            return
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self._settings_stamp:
+            return
+        with open(self.settings_path) as f:
+            settings = json.load(f)
+        profiler.configure(settings.get('enabled'), settings.get('sampleRate'))
+        self._settings_stamp = stamp
+
+    def _write_traces(self, profiler):
+        if profiler.sampled == self._written:
+            return
+        self._written = profiler.sampled
+        path = os.path.join(self.directory, f'traces-{os.getpid()}.json')
+        self._write(path, [trace.to_dict() for trace in profiler.traces()])
+
+    def collect_traces(self):
+        """Trace dicts of every process but this one"""
+        own = os.path.join(self.directory, f'traces-{os.getpid()}.json')
+        traces = []
+        for path in glob.glob(os.path.join(self.directory, 'traces-*.json')):
+            if path == own:
+                continue
+            try:
+                with open(path) as f:
+                    traces.extend(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Unreadable trace file {path}: {e}")
+        return traces
@@ -0,0 +1,141 @@
+# python-services/digitalpersona/reader_registry.py
+"""
+Registry of every attached fingerprint reader
+Each reader gets its own capture pipeline; all of them publish into the
+same scan event stream, tagged with the reader id
+"""
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ReaderNotFound(LookupError):
+    """Raised when a request names a reader id that is not attached"""
+
+
+class ReaderRegistry:
+    """
+    enumerate_fn() -> ids of the attached readers, in a stable order
+    reader_factory(reader_id) -> reader object for one id
+    pipeline_factory(reader_id, reader) -> CapturePipeline for that reader
+    placeholder: id enumerate_fn stands in for "no reader attached" (a mock
+    reader); it is registered only until a real reader is
+    """
+
+    def __init__(self, enumerate_fn, reader_factory, pipeline_factory, placeholder=None):
+        self.enumerate_fn = enumerate_fn
+        self.reader_factory = reader_factory
+        self.pipeline_factory = pipeline_factory
+        self.placeholder = placeholder
+        self._readers = {}      # id -> reader, in enumeration order
+        self._pipelines = {}    # id -> CapturePipeline
+        self._present = set()   # ids listed by the last successful enumeration
+        self._lock = threading.RLock()
+
+    def refresh(self):
+        """
+        Pick up readers attached since the last call
+        Readers that disappeared are kept (disconnected) so their ids stay valid;
+        the placeholder is retired once a real reader is registered, so the
+        real one becomes the default
+        Returns: list of newly added reader ids
+        """
+        try:
+            attached = list(self.enumerate_fn())
+        except Exception as e:
+            logger.error(f"Reader enumeration error: {e}")
+            return []
+
+        added = []
+        retired = None
+        with self._lock:
+            self._present = set(attached)
+            real = [reader_id for reader_id in attached if reader_id != self.placeholder]
+            if real and self.placeholder in self._readers:
+                retired = (
+                    self._readers.pop(self.placeholder),
+                    self._pipelines.pop(self.placeholder)
+                )
+            elif not real and any(reader_id != self.placeholder for reader_id in self._readers):
+                # A real reader was unplugged; keep it the default rather than the placeholder
+                attached = []
+            for reader_id in attached:
+                if reader_id not in self._readers:
+                    reader = self.reader_factory(reader_id)
+                    self._readers[reader_id] = reader
+                    self._pipelines[reader_id] = self.pipeline_factory(reader_id, reader)
+                    added.append(reader_id)
+
+        for reader_id in added:
+            logger.info(f"Reader registered: {reader_id}")
+        if retired is not None:
+            # The placeholder may hold the device the real reader is about to open
+            reader, pipeline = retired
+            monitoring = pipeline.active
+            pipeline.stop()
+            reader.disconnect()
+            logger.info(f"Reader {self.placeholder} retired")
+            if monitoring:
+                # Monitoring carries over to the readers that replace it
+                for reader_id in added:
+                    self._pipelines[reader_id].start()
+        return added
+
+    def present(self, reader_id):
+        """Whether the reader was attached at the last refresh"""
+        with self._lock:
+            return reader_id in self._present
+
+    @property
+    def default_id(self):
+        with self._lock:
+            return next(iter(self._readers), None)
+
+    def ids(self):
+        with self._lock:
+            return list(self._readers)
+
+    def get(self, reader_id=None):
+        """Reader by id; without an id, the first attached reader"""
+        with self._lock:
+            if reader_id is None:
+                reader_id = self.default_id
+            reader = self._readers.get(reader_id)
+        if reader is None:
+            raise ReaderNotFound(f"Reader {reader_id} not found" if reader_id else "No reader attached")
+        return reader
+
+    def pipeline(self, reader_id=None):
+        with self._lock:
+            if reader_id is None:
+                reader_id = self.default_id
+            pipeline = self._pipelines.get(reader_id)
+        if pipeline is None:
+            raise ReaderNotFound(f"Reader {reader_id} not found" if reader_id else "No reader attached")
+        return pipeline
+
+    def select(self, reader_id=None):
+        """Ids a request addresses: one reader, or all of them without an id"""
+        if reader_id is None:
+            return self.ids()
+        self.get(reader_id)
+        return [reader_id]
+
+    def items(self):
+        with self._lock:
+            return list(self._readers.items())
+
+    def monitoring(self):
+        """Ids of readers whose capture pipeline is running"""
+        with self._lock:
+            return [
+                reader_id for reader_id, pipeline in self._pipelines.items()
+                if pipeline.active
+            ]
+
+    def stop_all(self):
+        with self._lock:
+            pipelines = list(self._pipelines.values())
+        for pipeline in pipelines:
+            pipeline.stop()
@@ -0,0 +1,249 @@
+# python-services/digitalpersona/reader_supervisor.py
+"""
+Reader connection supervisor
+One background thread owns reader setup: it connects readers as they are
+attached, notices when one stops answering or is unplugged, and reconnects
+with exponential backoff. Request threads and capture loops only ask whether
+a reader is ready, so they never pay for enumeration or a failing open
+"""
+import time
+import random
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONNECTED = 'connected'
+CONNECTING = 'connecting'       # not tried yet
+RECONNECTING = 'reconnecting'   # open failed or connection lost; retried after a backoff
+DETACHED = 'detached'           # no longer enumerated; retried once it is back
+RELEASED = 'disconnected'       # disconnected on request; left alone until connected again
+
+
+class ReaderConnection:
+    """Connection state of one reader"""
+
+    def __init__(self):
+        self.state = CONNECTING
+        self.failures = 0           # consecutive failed opens
+        self.next_attempt = 0.0     # monotonic time of the next open
+        self.connected_at = None
+        self.ready = threading.Event()
+        self.lock = threading.Lock()
+
+    def to_dict(self, now):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retryInMs': (
+                round(max(0.0, self.next_attempt - now) * 1000)
+                if self.state == RECONNECTING else None
+            ),
+            'connectedForS': round(now - self.connected_at, 1) if self.connected_at else None
+        }
+
+
+class ReaderSupervisor:
+    """
+    Keeps every reader of a ReaderRegistry connected
+    Readers may implement check() -> False once an open reader is gone;
+    without it only failed opens and hotplug removal are noticed
+    """
+
+    def __init__(self, readers, interval=2.0, backoff_min=1.0, backoff_max=60.0, hotplug=True):
+        self.readers = readers
+        self.interval = interval        # seconds between health and hotplug checks
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.hotplug = hotplug
+        self._connections = {}          # reader id -> ReaderConnection
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connection(self, reader_id):
+        with self._lock:
+            connection = self._connections.get(reader_id)
+            if connection is None:
+                connection = self._connections[reader_id] = ReaderConnection()
+            return connection
+
+    def start(self):
+        """Connect the attached readers now, then keep them connected in the background"""
+        self.check()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='reader-supervisor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """Run a check now rather than at the next interval"""
+        self._wake.set()
+
+    def _run(self):
+        logger.info("Reader supervisor started")
+        while not self._stop.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Reader supervisor error: {e}")
+            self._wake.wait(self._next_wait())
+            self._wake.clear()
+        logger.info("Reader supervisor stopped")
+
+    def _next_wait(self):
+        now = time.monotonic()
+        with self._lock:
+            retries = [
+                connection.next_attempt - now for connection in self._connections.values()
+                if connection.state == RECONNECTING
+            ]
+        return max(0.05, min([self.interval] + retries))
+
+    def _backoff(self, failures):
+        delay = min(self.backoff_max, self.backoff_min * 2 ** (failures - 1))
+        # Jitter keeps several readers on one hub from retrying in lockstep
+        return delay * random.uniform(0.8, 1.2)
+
+    def check(self):
+        """One pass: pick up attached readers, drop dead ones, retry those that are due"""
+        if self.hotplug:
+            for reader_id in self.readers.refresh():
+                self._connection(reader_id)
+            registered = set(self.readers.ids())
+            with self._lock:
+                for reader_id in set(self._connections) - registered:
+                    # Retired by the registry (a placeholder replaced by a real reader)
+                    self._connections.pop(reader_id).ready.clear()
+
+        for reader_id, device in self.readers.items():
+            connection = self._connection(reader_id)
+            with connection.lock:
+                self._check_reader(reader_id, device, connection)
+
+    def _check_reader(self, reader_id, device, connection):
+        now = time.monotonic()
+        if connection.state == RELEASED:
+            return
+
+        # Checked first so a reader without check() is still noticed when unplugged
+        present = self.readers.present(reader_id)
+        if device.is_connected:
+            if present and self._healthy(device):
+                self._mark_connected(reader_id, connection)
+                return
+            if present:
+                logger.warning(f"Reader {reader_id} stopped responding - reconnecting")
+            device.disconnect()
+            self._mark_lost(connection, RECONNECTING, now)
+
+        if not present:
+            if connection.state != DETACHED:
+                logger.warning(f"Reader {reader_id} detached")
+            self._mark_lost(connection, DETACHED, now)
+            return
+        if connection.state == DETACHED:
+            logger.info(f"Reader {reader_id} attached again")
+            connection.state = RECONNECTING
+
+        if now < connection.next_attempt:
+            return
+        if device.connect():
+            self._mark_connected(reader_id, connection)
+        else:
+            connection.failures += 1
+            connection.state = RECONNECTING
+            delay = self._backoff(connection.failures)
+            connection.next_attempt = now + delay
+            logger.warning(
+                f"Reader {reader_id} connection failed ({connection.failures} in a row) "
+                f"- retrying in {delay:.1f}s"
+            )
+
+    @staticmethod
+    def _healthy(device):
+        check = getattr(device, 'check', None)
+        if check is None:
+            return True
+        try:
+            return bool(check())
+        except Exception as e:
+            logger.warning(f"Reader health check error: {e}")
+            return False
+
+    @staticmethod
+    def _mark_connected(reader_id, connection):
+        if connection.state != CONNECTED:
+            logger.info(f"Reader {reader_id} connected")
+            connection.state = CONNECTED
+            connection.connected_at = time.monotonic()
+        connection.failures = 0
+        connection.next_attempt = 0.0
+        connection.ready.set()
+
+    @staticmethod
+    def _mark_lost(connection, state, now):
+        connection.ready.clear()
+        connection.connected_at = None
+        if connection.state == CONNECTED:
+            # Retry a dropped reader at once; backoff starts with failed opens
+            connection.failures = 0
+            connection.next_attempt = now
+        connection.state = state
+
+    def available(self, reader_id):
+        """Whether the reader is connected; never blocks on the device"""
+        return self._connection(reader_id).ready.is_set()
+
+    def wait_ready(self, reader_id, cancel, timeout):
+        """
+        Block until the supervisor has the reader connected
+        Returns: True once ready, False on timeout or when cancel is set
+        """
+        ready = self._connection(reader_id).ready
+        deadline = time.monotonic() + timeout
+        while not cancel.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            # Short slices so a stop through cancel is noticed promptly
+            if ready.wait(min(remaining, 0.25)):
+                return True
+        return False
+
+    def connect(self, reader_id):
+        """Connect a reader now (POST /reader/connect), resetting its backoff"""
+        device = self.readers.get(reader_id)
+        connection = self._connection(reader_id)
+        with connection.lock:
+            if device.is_connected and self._healthy(device):
+                self._mark_connected(reader_id, connection)
+                return True
+            connection.state = CONNECTING
+            connection.failures = 0
+            connection.next_attempt = 0.0
+            if device.connect():
+                self._mark_connected(reader_id, connection)
+                return True
+            connection.failures = 1
+            connection.state = RECONNECTING
+            connection.next_attempt = time.monotonic() + self._backoff(1)
+        self.wake()
+        return False
+
+    def disconnect(self, reader_id):
+        """Disconnect a reader and keep it disconnected until connect()"""
+        device = self.readers.get(reader_id)
+        connection = self._connection(reader_id)
+        with connection.lock:
+            device.disconnect()
+            connection.ready.clear()
+            connection.connected_at = None
+            connection.state = RELEASED
+
+    def status(self, reader_id):
+        return self._connection(reader_id).to_dict(time.monotonic())
@@ -0,0 +1,311 @@
+# python-services/digitalpersona/scan_events.py
+"""
+Scan event delivery
+Scans from the monitoring loop go into a bounded ring buffer with
+increasing sequence numbers. Pollers read "events after N" from it, and
+streaming clients get them pushed as Server-Sent Events with a resume
+token, so no client loses a scan to another or to a quick second touch
+"""
+import os
+import json
+import queue
+import asyncio
+import threading
+from collections import deque
+
+# Sent instead of an event when a subscriber fell too far behind
+_OVERFLOW = object()
+
+
+class ScanEventLog:
+    """
+    Thread-safe ring buffer of the most recent scan events
+    Sequence numbers start at 1 and never repeat within a run; events
+    pushed out of a full buffer before anyone read them count as dropped
+    """
+
+    def __init__(self, depth=256):
+        self.depth = depth
+        self._events = deque(maxlen=depth)  # (sequence, event)
+        self._sequence = 0
+        self._delivered = 0                 # highest sequence handed out
+        self._taken = 0                     # shared cursor of take()
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    @property
+    def sequence(self):
+        """Sequence of the newest event, 0 before the first"""
+        return self._sequence
+
+    def append(self, event):
+        """Store an event and return its sequence"""
+        with self._lock:
+            if len(self._events) == self.depth and self._events[0][0] > self._delivered:
+                self.dropped += 1
+            self._sequence += 1
+            self._events.append((self._sequence, event))
+            return self._sequence
+
+    def after(self, sequence, limit=None):
+        """
+        Events with a sequence greater than the given one, oldest first
+        Returns: (events as (sequence, event) pairs, number of events the
+        caller missed because they already left the buffer)
+        """
+        with self._lock:
+            oldest = self._events[0][0] if self._events else self._sequence + 1
+            missed = max(0, oldest - sequence - 1)
+            events = [item for item in self._events if item[0] > sequence]
+            if limit is not None:
+                events = events[:limit]
+            if events:
+                self._delivered = max(self._delivered, events[-1][0])
+            return events, missed
+
+    def take(self):
+        """
+        Next event for clients that poll without a sequence; each event is
+        handed out once across all of them
+        Returns: (sequence, event) or None
+        """
+        with self._lock:
+            for item in self._events:
+                if item[0] > self._taken:
+                    self._taken = item[0]
+                    self._delivered = max(self._delivered, item[0])
+                    return item
+            return None
+
+    def skip_pending(self):
+        """Move the take() cursor past every buffered event"""
+        with self._lock:
+            self._taken = self._sequence
+
+    def mark_delivered(self, sequence):
+        with self._lock:
+            self._delivered = max(self._delivered, sequence)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': self.depth,
+                'buffered': len(self._events),
+                'sequence': self._sequence,
+                'dropped': self.dropped
+            }
+
+
+class Subscriber:
+    """One streaming client's queue of pending events"""
+
+    def __init__(self, depth):
+        self.queue = queue.Queue(maxsize=depth)
+        self.overflowed = False
+        self.closed = False
+
+    def offer(self, item):
+        """Queue an event without blocking the publisher"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            # Drop the client; it reconnects and resumes from history
+            self.overflowed = True
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(_OVERFLOW)
+
+    def get(self, timeout):
+        """Next (token, event), None on timeout, or _OVERFLOW"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscriber:
+    """
+    A streaming client served from an asyncio event loop
+    offer() is called from publisher threads and never blocks; get() is
+    awaited on the loop, so an idle client holds no thread
+    """
+
+    def __init__(self, depth, loop):
+        self.depth = depth
+        self.loop = loop
+        self.overflowed = False
+        self.closed = False     # its event loop is gone
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+
+    def offer(self, item):
+        with self._lock:
+            if self.overflowed:
+                return
+            if len(self._items) >= self.depth:
+                # Drop the client; it reconnects and resumes from history
+                self.overflowed = True
+                self._items.clear()
+                item = _OVERFLOW
+            self._items.append(item)
+        try:
+            self.loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The loop closed (server shutdown) before the stream unsubscribed
+            with self._lock:
+                self.overflowed = self.closed = True
+                self._items.clear()
+
+    async def get(self, timeout):
+        """Next (token, event), None on timeout, or _OVERFLOW"""
+        deadline = self.loop.time() + timeout
+        while True:
+            with self._lock:
+                if self._items:
+                    return self._items.popleft()
+                self._ready.clear()
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(self._ready.wait(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+
+class ScanBroadcaster:
+    """
+    Publishes scan events to all subscribers
+    Tokens are '<epoch>-<sequence>'; the epoch changes on every service start
+    so a token from an earlier run replays everything still in the log
+    """
+
+    def __init__(self, log, subscriber_depth=64):
+        self.epoch = os.urandom(4).hex()
+        self.log = log
+        self.subscriber_depth = subscriber_depth
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self.published = 0
+        self.overflows = 0
+
+    def token(self, sequence):
+        return f"{self.epoch}-{sequence}"
+
+    def _after(self, token):
+        """Sequence a resume token points at, or 0 to replay all history"""
+        if not token:
+            return None
+        epoch, _, sequence = str(token).partition('-')
+        if epoch != self.epoch:
+            return 0
+        try:
+            return int(sequence)
+        except ValueError:
+            return 0
+
+    def publish(self, event):
+        """Append an event to the log and fan it out"""
+        with self._lock:
+            sequence = self.log.append(event)
+            item = (self.token(sequence), event)
+            if self._subscribers:
+                self.log.mark_delivered(sequence)
+            closed = []
+            for subscriber in self._subscribers:
+                if not subscriber.overflowed:
+                    subscriber.offer(item)
+                    if subscriber.closed:
+                        closed.append(subscriber)
+                    elif subscriber.overflowed:
+                        self.overflows += 1
+            self._subscribers.difference_update(closed)
+            self.published += 1
+            return item[0]
+
+    def subscribe(self, resume=None, loop=None):
+        """
+        Register a streaming client; an AsyncSubscriber when given an event loop
+        With a resume token, retained events after it are queued first
+        """
+        if loop is not None:
+            subscriber = AsyncSubscriber(self.subscriber_depth, loop)
+        else:
+            subscriber = Subscriber(self.subscriber_depth)
+        with self._lock:
+            after = self._after(resume)
+            if after is not None:
+                events, _ = self.log.after(after)
+                for sequence, event in events:
+                    subscriber.offer((self.token(sequence), event))
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def stats(self):
+        with self._lock:
+            sequence = self.log.sequence
+            return {
+                'subscribers': len(self._subscribers),
+                'published': self.published,
+                'overflows': self.overflows,
+                'lastToken': self.token(sequence) if sequence else None
+            }
+
+
+def format_sse(token, event, name='scan'):
+    return f"id: {token}\nevent: {name}\ndata: {json.dumps(event)}\n\n"
+
+
+def stream_events(broadcaster, subscriber, heartbeat=15.0, render=None):
+    """
+    SSE body for one subscriber: events as they arrive, comment lines as
+    keep-alives, and an end of stream if the client fell behind
+    render(event) -> event as this subscriber wants it, e.g. with its image
+    """
+    try:
+        yield 'retry: 2000\n\n'
+        while True:
+            item = subscriber.get(heartbeat)
+            if item is None:
+                yield ': keep-alive\n\n'
+            elif item is _OVERFLOW:
+                yield 'event: overflow\ndata: {}\n\n'
+                break
+            else:
+                token, event = item
+                yield format_sse(token, render(event) if render else event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
+
+
+async def stream_events_async(broadcaster, subscriber, heartbeat=15.0, render=None):
+    """
+    stream_events for an AsyncSubscriber
+    render runs in the loop's default executor, as it may encode an image
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        yield 'retry: 2000\n\n'
+        while True:
+            item = await subscriber.get(heartbeat)
+            if item is None:
+                yield ': keep-alive\n\n'
+            elif item is _OVERFLOW:
+                yield 'event: overflow\ndata: {}\n\n'
+                break
+            else:
+                token, event = item
+                if render:
+                    event = await loop.run_in_executor(None, render, event)
+                yield format_sse(token, event)
+    finally:
+        broadcaster.unsubscribe(subscriber)
@@ -8,7 +8,21 @@ if exist venv\Scripts\activate.bat (
     call venv\Scripts\activate.bat
 )
 
-REM Start the service
-python digitalpersona_service.py
+REM FINGERPRINT_SERVICE=usb serves the USB service instead of the SDK one,
+REM as in wsgi_service.py and asgi_service.py
+set SERVICE_SCRIPT=digitalpersona_service.py
+if "%FINGERPRINT_SERVICE%"=="usb" set SERVICE_SCRIPT=digitalpersona_service_usb.py
+if not "%FINGERPRINT_SERVICE%"=="" if not "%FINGERPRINT_SERVICE%"=="sdk" if not "%FINGERPRINT_SERVICE%"=="usb" (
+    echo FINGERPRINT_SERVICE must be sdk or usb, not %FINGERPRINT_SERVICE%
+    exit /b 1
+)
+
+REM Start the service (FINGERPRINT_ASGI=1 serves it with uvicorn in asyncio mode)
+if "%FINGERPRINT_SERVICE_PORT%"=="" set FINGERPRINT_SERVICE_PORT=5000
+if "%FINGERPRINT_ASGI%"=="1" (
+    uvicorn asgi_service:app --host 0.0.0.0 --port %FINGERPRINT_SERVICE_PORT%
+) else (
+    python %SERVICE_SCRIPT%
+)
 
 pause
\ No newline at end of file
@@ -8,5 +8,24 @@ if [ -d "venv" ]; then
     source venv/bin/activate
 fi
 
-# Start the service
-python digitalpersona_service.py
\ No newline at end of file
+# FINGERPRINT_SERVICE=usb serves the USB service instead of the SDK one,
+# as in wsgi_service.py and asgi_service.py
+case "${FINGERPRINT_SERVICE:-sdk}" in
+    sdk) SERVICE_SCRIPT=digitalpersona_service.py ;;
+    usb) SERVICE_SCRIPT=digitalpersona_service_usb.py ;;
+    *) echo "FINGERPRINT_SERVICE must be sdk or usb, not $FINGERPRINT_SERVICE"; exit 1 ;;
+esac
+
+# Start the service (FINGERPRINT_ASGI=1 serves it with uvicorn in asyncio mode;
+# FINGERPRINT_WORKERS=N runs a device-owner process behind N gunicorn workers)
+if [ -n "$FINGERPRINT_WORKERS" ]; then
+    FINGERPRINT_ROLE=owner python "$SERVICE_SCRIPT" &
+    OWNER_PID=$!
+    trap 'kill $OWNER_PID' EXIT
+    FINGERPRINT_ROLE=worker gunicorn -w "$FINGERPRINT_WORKERS" --threads 8 \
+        -b "0.0.0.0:${FINGERPRINT_SERVICE_PORT:-5000}" wsgi_service:app
+elif [ "$FINGERPRINT_ASGI" = "1" ]; then
+    uvicorn asgi_service:app --host 0.0.0.0 --port "${FINGERPRINT_SERVICE_PORT:-5000}"
+else
+    python "$SERVICE_SCRIPT"
+fi
\ No newline at end of file
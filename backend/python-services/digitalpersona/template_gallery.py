@@ -0,0 +1,653 @@
+# python-services/digitalpersona/template_gallery.py
+"""
+In-memory fingerprint template gallery
+Holds enrolled templates inside the service for 1:N identification
+Templates are decoded and parsed once at enrollment, so matching never
+touches base64. With a GalleryStore the gallery survives restarts: a
+memory-mapped snapshot is the base and later changes sit on top of it
+A coarse triplet index narrows identification to likely candidates
+"""
+import base64
+import binascii
+import threading
+import logging
+
+import numpy as np
+
+from ansi378 import MINUTIA_DTYPE, TemplateFormatError, parse_template
+from gallery_index import MIN_GALLERY, CoarseIndex, TripletIndex
+from gallery_search import SearchOptions, SearchStats, top_k
+from gallery_snapshot import OP_CLEAR, OP_ENROLL, OP_REMOVE, MappedSnapshot
+from minutiae_matcher import PackedMinutiae
+
+logger = logging.getLogger(__name__)
+
+EMPTY_MINUTIAE = np.empty(0, dtype=MINUTIA_DTYPE)
+
+
+def template_entries(items):
+    """
+    Validate a request list of {id, template} objects
+    Returns: list of (id, template) pairs
+    """
+    if not isinstance(items, list):
+        raise ValueError('Templates must be a list of {id, template} objects')
+
+    entries = []
+    for item in items:
+        template_id = item.get('id') if isinstance(item, dict) else None
+        template = item.get('template') if isinstance(item, dict) else None
+        if not template_id or not template:
+            raise ValueError('Every entry needs an id and a template')
+        entries.append((str(template_id), template))
+
+    return entries
+
+
+class StoredTemplate:
+    """One enrolled template: raw FMR bytes plus its parsed ANSI 378 record"""
+
+    __slots__ = ('template_id', 'data', 'record')
+
+    def __init__(self, template_id, data, record):
+        self.template_id = template_id
+        self.data = data
+        self.record = record
+
+    @classmethod
+    def from_bytes(cls, template_id, data):
+        """Parse raw template bytes; non-ANSI data is kept unparsed"""
+        try:
+            record = parse_template(data)
+        except TemplateFormatError:
+            record = None
+
+        return cls(str(template_id), bytes(data), record)
+
+    @classmethod
+    def from_base64(cls, template_id, template):
+        """Decode and parse a base64 template"""
+        if not template_id or not template:
+            raise ValueError('Template id and template are required')
+
+        try:
+            data = base64.b64decode(template)
+        except (binascii.Error, TypeError) as e:
+            raise ValueError(f"Template {template_id} is not valid base64: {e}")
+
+        if not data:
+            raise ValueError(f"Template {template_id} is empty")
+
+        return cls.from_bytes(template_id, data)
+
+    @property
+    def minutiae(self):
+        return self.record.minutiae if self.record is not None else EMPTY_MINUTIAE
+
+
+class GalleryView:
+    """
+    Immutable snapshot of the gallery laid out for batch scoring
+    Row i of every field belongs to ids[i]; path is set when the view is
+    a snapshot file mapped as-is
+    """
+
+    __slots__ = ('ids', 'data', 'packed', 'path')
+
+    def __init__(self, ids, data, packed, path=None):
+        self.ids = ids
+        self.data = data
+        self.packed = packed
+        self.path = path
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def empty(cls):
+        return cls.from_stored([])
+
+    @classmethod
+    def from_stored(cls, stored):
+        return cls(
+            [entry.template_id for entry in stored],
+            [entry.data for entry in stored],
+            PackedMinutiae.from_minutiae([entry.minutiae for entry in stored])
+        )
+
+    @classmethod
+    def from_entries(cls, entries):
+        """Build a throwaway view from request (id, base64 template) pairs"""
+        return cls.from_stored([
+            StoredTemplate.from_base64(template_id, template)
+            for template_id, template in entries
+        ])
+
+    def take(self, rows):
+        """Copy of the given rows"""
+        return GalleryView(
+            [self.ids[row] for row in rows],
+            [self.data[row] for row in rows],
+            self.packed.take(rows)
+        )
+
+    def concat(self, other):
+        """Copy of this view followed by another"""
+        return GalleryView(
+            list(self.ids) + list(other.ids),
+            list(self.data) + list(other.data),
+            PackedMinutiae.concatenate([self.packed, other.packed])
+        )
+
+
+class TemplateGallery:
+    """
+    Thread-safe store of enrolled templates keyed by template id
+    Templates are split between an immutable base view (the mapped
+    snapshot, when persistent) and an overlay of changes made since
+    """
+
+    def __init__(self, store=None, read_only=False, prefilter=True):
+        self._store = store
+        self._read_only = read_only
+        self.prefilter = prefilter
+        self._snapshot = None
+        self._base = GalleryView.empty()
+        self._base_index = {}
+        self._overlay = {}
+        self._shadowed = set()  # base ids removed or replaced since the snapshot
+        self._sequence = 0
+        self._stamp = None          # store stamp as of the last load/refresh
+        self._view = None
+        self._base_triplets = None  # TripletIndex of the base, built on first use
+        self._coarse = None         # (view, CoarseIndex)
+        self._lock = threading.RLock()
+        self._compact_lock = threading.Lock()
+        self._listeners = []
+        self._compactor = None
+        self._stop_compactor = threading.Event()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._base_index) - len(self._shadowed) + len(self._overlay)
+
+    def __contains__(self, template_id):
+        template_id = str(template_id)
+        with self._lock:
+            return template_id in self._overlay or (
+                template_id in self._base_index and template_id not in self._shadowed
+            )
+
+    # ---------- persistence ----------
+
+    def load(self):
+        """
+        Map the newest snapshot and replay the delta log on top of it
+        Returns: number of templates in the gallery
+        """
+        if self._store is None:
+            return len(self)
+
+        # Stamped before reading, so a change made meanwhile is seen by refresh()
+        stamp = self._store.stamp()
+        snapshot = self._store.open_snapshot()
+
+        with self._lock:
+            self._set_base(snapshot)
+            records = self._store.log.replay(self._sequence, repair=not self._read_only)
+            self._replay(records)
+            self._stamp = stamp
+
+        if snapshot is not None:
+            logger.info(f"Mapped gallery snapshot {snapshot.path} ({snapshot.count} templates)")
+        if records:
+            logger.info(f"Replayed {len(records)} gallery changes from the delta log")
+
+        return len(self)
+
+    def refresh(self):
+        """
+        Catch up with changes another process wrote to the store
+        For read-only galleries that share a directory with the writing
+        process; costs a stat and a directory listing when nothing changed
+        Returns: True if the gallery changed
+        """
+        if self._store is None:
+            return False
+
+        stamp = self._store.stamp()
+        remapped = None
+        with self._lock:
+            if stamp == self._stamp:
+                return False
+
+            current = self._snapshot.path if self._snapshot is not None else None
+            if stamp[0] != current:
+                # Compacted since: map the new snapshot from scratch
+                remapped = self._snapshot
+                self.load()
+                previous = None
+                changed = True
+            else:
+                records = self._store.log.replay(self._sequence, repair=False)
+                previous = []
+                for record in records:
+                    _, op, template_id, _ = record
+                    if op == OP_CLEAR:
+                        previous = None
+                    elif previous is not None:
+                        data = self._template_data(template_id)
+                        if data is not None:
+                            previous.append(data)
+                    self._replay([record])
+                self._stamp = stamp
+                changed = bool(records)
+
+        if remapped is not None:
+            remapped.close()
+        if changed:
+            self._notify(previous)
+        return changed
+
+    def _set_base(self, snapshot):
+        """Make a mapped snapshot (or nothing) the base; caller holds the lock"""
+        self._snapshot = snapshot
+        if snapshot is not None:
+            self._base = GalleryView(snapshot.ids, snapshot.data, snapshot.packed, snapshot.path)
+            self._sequence = snapshot.sequence
+        else:
+            self._base = GalleryView.empty()
+        self._base_index = {template_id: row for row, template_id in enumerate(self._base.ids)}
+        self._base_triplets = None
+        self._overlay = {}
+        self._shadowed = set()
+        self._view = None
+
+    def _replay(self, records):
+        """Apply delta log records without logging them again"""
+        for sequence, op, template_id, data in records:
+            if op == OP_ENROLL:
+                self._apply_enroll(StoredTemplate.from_bytes(template_id, data))
+            elif op == OP_REMOVE:
+                self._apply_remove(template_id)
+            elif op == OP_CLEAR:
+                self._apply_clear()
+            self._sequence = max(self._sequence, sequence)
+
+    def _log(self, op, template_id='', data=b''):
+        """Append a change to the delta log; caller holds the lock"""
+        if self._store is not None:
+            self._sequence += 1
+            self._store.log.append(self._sequence, op, template_id, data)
+
+    def _sync(self):
+        if self._store is not None:
+            self._store.log.sync()
+
+    def _check_writable(self):
+        if self._read_only:
+            raise RuntimeError('Gallery is read-only in this process')
+
+    def compact(self):
+        """
+        Fold the delta log into a new snapshot and map it as the new base
+        Changes made while the snapshot is written stay in the log
+        Returns: True if a new snapshot was written
+        """
+        if self._store is None or self._read_only:
+            return False
+
+        with self._compact_lock:
+            with self._lock:
+                if self._store.log.records == 0:
+                    return False
+                self._sync()
+                view = self.view()
+                sequence = self._sequence
+
+            path = self._store.write_snapshot(view, sequence)
+            snapshot = MappedSnapshot(path)
+
+            with self._lock:
+                self._sync()
+                remaining = self._store.log.replay(sequence)
+                self._store.log.rewrite(remaining)
+                previous = self._snapshot
+                self._set_base(snapshot)
+                self._replay(remaining)
+
+            if previous is not None:
+                previous.close()
+            self._store.remove_old_snapshots(path)
+
+        logger.info(f"Gallery compacted into {path} ({snapshot.count} templates)")
+        return True
+
+    def start_compactor(self, interval=60, min_records=1000):
+        """Compact in a background thread whenever the delta log grows large"""
+        if self._store is None or self._read_only or self._compactor is not None:
+            return
+
+        def run():
+            while not self._stop_compactor.wait(interval):
+                try:
+                    if self._store.log.records >= min_records:
+                        self.compact()
+                except Exception as e:
+                    logger.error(f"Gallery compaction error: {e}")
+
+        self._compactor = threading.Thread(target=run, daemon=True)
+        self._compactor.start()
+
+    def stop_compactor(self):
+        self._stop_compactor.set()
+
+    def persistence_status(self):
+        """Snapshot and delta log details, or None for a memory-only gallery"""
+        if self._store is None:
+            return None
+
+        with self._lock:
+            return {
+                'directory': self._store.directory,
+                'snapshot': self._snapshot.path if self._snapshot is not None else None,
+                'snapshotTemplates': len(self._base),
+                'sequence': self._sequence,
+                'logRecords': self._store.log.records,
+                'readOnly': self._read_only
+            }
+
+    # ---------- changes ----------
+
+    def add_listener(self, callback):
+        """
+        Call callback(templates) after templates leave the gallery
+        templates is a list of the raw bytes removed or replaced, or None
+        when the whole gallery was cleared
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, templates):
+        if templates == []:
+            return
+        for callback in self._listeners:
+            try:
+                callback(templates)
+            except Exception as e:
+                logger.error(f"Gallery listener error: {e}")
+
+    def _template_data(self, template_id):
+        """Raw bytes currently enrolled under an id, or None; caller holds the lock"""
+        entry = self._overlay.get(template_id)
+        if entry is not None:
+            return entry.data
+        row = self._base_index.get(template_id)
+        if row is not None and template_id not in self._shadowed:
+            return self._base.data[row]
+        return None
+
+    def _apply_enroll(self, entry):
+        if entry.template_id in self._base_index:
+            self._shadowed.add(entry.template_id)
+        self._overlay[entry.template_id] = entry
+        self._view = None
+
+    def _apply_remove(self, template_id):
+        removed = self._overlay.pop(template_id, None) is not None
+        if template_id in self._base_index and template_id not in self._shadowed:
+            self._shadowed.add(template_id)
+            removed = True
+        if removed:
+            self._view = None
+        return removed
+
+    def _apply_clear(self):
+        self._overlay.clear()
+        self._shadowed = set(self._base_index)
+        self._view = None
+
+    def enroll(self, template_id, template):
+        """
+        Add or replace a template in the gallery
+        Returns: True if an existing entry was replaced
+        """
+        self._check_writable()
+        entry = StoredTemplate.from_base64(template_id, template)
+
+        with self._lock:
+            previous = self._template_data(entry.template_id)
+            self._apply_enroll(entry)
+            self._log(OP_ENROLL, entry.template_id, entry.data)
+            self._sync()
+
+        if previous is not None:
+            self._notify([previous])
+        return previous is not None
+
+    def enroll_many(self, entries, replace_all=False):
+        """
+        Enroll a list of {id, template} entries in one step
+        With replace_all the gallery is swapped for exactly these entries
+        """
+        self._check_writable()
+        stored = [
+            StoredTemplate.from_base64(template_id, template)
+            for template_id, template in template_entries(entries)
+        ]
+
+        with self._lock:
+            if replace_all:
+                previous = None
+                self._apply_clear()
+                self._log(OP_CLEAR)
+            else:
+                previous = [self._template_data(entry.template_id) for entry in stored]
+                previous = [data for data in previous if data is not None]
+            for entry in stored:
+                self._apply_enroll(entry)
+                self._log(OP_ENROLL, entry.template_id, entry.data)
+            self._sync()
+            size = len(self)
+
+        self._notify(previous)
+        return size
+
+    def remove(self, template_id):
+        """
+        Remove a template from the gallery
+        Returns: True if the id was enrolled
+        """
+        self._check_writable()
+        template_id = str(template_id)
+
+        with self._lock:
+            previous = self._template_data(template_id)
+            removed = self._apply_remove(template_id)
+            if removed:
+                self._log(OP_REMOVE, template_id)
+                self._sync()
+
+        if removed:
+            self._notify([previous])
+        return removed
+
+    def clear(self):
+        """Remove every enrolled template"""
+        self._check_writable()
+        with self._lock:
+            self._apply_clear()
+            self._log(OP_CLEAR)
+            self._sync()
+
+        self._notify(None)
+
+    # ---------- reads ----------
+
+    def ids(self):
+        """List the enrolled template ids"""
+        with self._lock:
+            base_ids = [i for i in self._base.ids if i not in self._shadowed]
+            return base_ids + list(self._overlay.keys())
+
+    def view(self):
+        """
+        Current GalleryView, rebuilt only after the gallery changed
+        Without pending changes this is the mapped snapshot itself
+        Safe to use without the lock once returned
+        """
+        with self._lock:
+            if self._view is None:
+                if not self._overlay and not self._shadowed:
+                    self._view = self._base
+                else:
+                    base = self._base
+                    if self._shadowed:
+                        base = base.take([
+                            row for row, template_id in enumerate(base.ids)
+                            if template_id not in self._shadowed
+                        ])
+                    overlay = GalleryView.from_stored(list(self._overlay.values()))
+                    self._view = base.concat(overlay) if len(base) else overlay
+            return self._view
+
+    def memory_stats(self):
+        """Byte counts for everything the gallery keeps resident"""
+        with self._lock:
+            overlay = list(self._overlay.values())
+            base = self._base
+            view = self._view
+            coarse = self._coarse
+            mapped_bytes = self._snapshot.nbytes if self._snapshot is not None else 0
+            templates = len(self)
+
+        parsed = [entry for entry in overlay if entry.record is not None]
+        raw_bytes = sum(len(entry.data) for entry in overlay)
+        minutiae_bytes = sum(entry.minutiae.nbytes for entry in parsed)
+        packed_bytes = view.packed.nbytes if view is not None and view is not base else 0
+        index_bytes = coarse[1].nbytes if coarse is not None else 0
+        heap_bytes = raw_bytes + minutiae_bytes + packed_bytes + index_bytes
+        total = heap_bytes + mapped_bytes
+
+        return {
+            'templates': templates,
+            'snapshotTemplates': len(base),
+            'overlayTemplates': len(overlay),
+            'parsedTemplates': int(np.count_nonzero(base.packed.counts)) + len(parsed),
+            'minutiae': int(base.packed.counts.sum()) + sum(len(e.minutiae) for e in parsed),
+            'rawBytes': raw_bytes,
+            'minutiaeBytes': minutiae_bytes,
+            'packedBytes': packed_bytes,
+            'indexBytes': index_bytes,
+            'mappedBytes': mapped_bytes,
+            'heapBytes': heap_bytes,
+            'totalBytes': total,
+            'bytesPerTemplate': round(total / templates, 1) if templates else 0
+        }
+
+    def coarse_index(self):
+        """
+        Current view with its CoarseIndex, built only after the gallery changed
+        The base's triplets are indexed once per snapshot; later builds only
+        index the overlay and remap the base rows still in the view
+        Returns: (view, CoarseIndex)
+        """
+        with self._lock:
+            view = self.view()
+            if self._coarse is not None and self._coarse[0] is view:
+                return self._coarse
+            base = self._base
+            base_triplets = self._base_triplets
+            shadowed = set(self._shadowed)
+            overlay = bool(self._overlay)
+
+        # Index outside the lock so enrollment is not blocked meanwhile
+        if base_triplets is None:
+            base_triplets = TripletIndex.build(base.packed)
+            with self._lock:
+                if self._base is base:
+                    self._base_triplets = base_triplets
+
+        base_rows = np.arange(len(base))
+        if shadowed:
+            kept = np.fromiter(
+                (template_id not in shadowed for template_id in base.ids), dtype=bool, count=len(base)
+            )
+            base_rows = np.full(len(base), -1)
+            base_rows[kept] = np.arange(np.count_nonzero(kept))
+
+        parts = [(base_triplets, base_rows)]
+        overlay_start = int(np.count_nonzero(base_rows >= 0))
+        if overlay:
+            overlay_triplets = TripletIndex.build(view.packed.slice(overlay_start, len(view)))
+            parts.append((overlay_triplets, np.arange(overlay_start, len(view))))
+
+        coarse = (view, CoarseIndex(len(view), parts))
+        with self._lock:
+            if self._view is view:
+                self._coarse = coarse
+        return coarse
+
+    def _candidates(self, probe, options):
+        """
+        View to search and the pre-filtered rows of it (None for all rows)
+        Returns: (view, rows, info)
+        """
+        enabled = self.prefilter if options.prefilter is None else options.prefilter
+        view = self.view()
+
+        if not enabled:
+            return view, None, {'used': False, 'candidates': len(view), 'reason': 'disabled'}
+        if len(view) < MIN_GALLERY:
+            return view, None, {'used': False, 'candidates': len(view), 'reason': 'gallery below prefilter minimum'}
+
+        try:
+            minutiae = StoredTemplate.from_base64('probe', probe).minutiae
+        except ValueError:
+            minutiae = None
+
+        view, index = self.coarse_index()
+        rows, info = index.candidates(minutiae, options.max_candidates)
+        return view, rows, info
+
+    def identify(self, probe, rank_fn, threshold=0.6, options=None):
+        """
+        Search the gallery for the best matches of a probe template
+        rank_fn(view, options, rows) -> (rows, scores, stats), best first,
+        scores the probe (decoded once by the caller); rows limits the search
+        to candidate rows (None for all)
+        Only pre-filtered candidates are scored first; without a match among
+        them the rest of the gallery is searched, unless the options turn
+        that fallback off or the search budget is spent
+        Returns: (candidates sorted by similarity, SearchStats)
+        """
+        options = options or SearchOptions()
+        view, rows, prefilter = self._candidates(probe, options)
+        if len(view) == 0:
+            return [], SearchStats(0).finish()
+
+        found, scores, stats = rank_fn(view, options, rows)
+        prefilter['fallback'] = False
+
+        matched = len(scores) and scores[0] >= threshold
+        if rows is not None and not matched and options.prefilter_fallback and not stats.budget_exhausted:
+            rest = np.setdiff1d(np.arange(len(view)), rows, assume_unique=True)
+            more, more_scores, more_stats = rank_fn(view, options.remaining(stats), rest)
+            stats.merge(more_stats)
+            found = np.concatenate([found, more])
+            order, scores = top_k(np.concatenate([scores, more_scores]), options.limit)
+            found = found[order]
+            prefilter['fallback'] = True
+
+        stats.prefilter = prefilter
+        stats.finish()
+
+        candidates = [
+            {
+                'id': view.ids[row],
+                'match': bool(score >= threshold),
+                'similarity': float(score)
+            }
+            for row, score in zip(found, scores)
+        ]
+
+        return candidates, stats
@@ -0,0 +1,31 @@
+# python-services/digitalpersona/wsgi_service.py
+"""
+WSGI entry point for pre-forked HTTP workers
+Each worker serves compare/identify/health itself and forwards reader,
+monitoring and gallery-write requests to the device-owner process
+Run (without --preload, so each worker starts its own matching state):
+  FINGERPRINT_ROLE=owner python digitalpersona_service.py
+  gunicorn -w 4 --threads 8 -b 0.0.0.0:5000 wsgi_service:app
+FINGERPRINT_SERVICE=usb serves the USB service instead of the SDK one
+/metrics is answered by the owner, with the workers' counters and histograms
+added from FINGERPRINT_METRICS_DIR (written every FINGERPRINT_METRICS_WRITE_INTERVAL s)
+/admin/profile settings reach the workers, and their sampled traces the
+owner's /admin/profile/traces, through the same directory; /admin/profile/stacks
+samples the worker that answers (?process=owner for the owner)
+Without FINGERPRINT_ADMIN_TOKEN, /admin endpoints answer only local clients
+"""
+import os
+import importlib
+
+SERVICE_MODULES = {
+    'sdk': 'digitalpersona_service',
+    'usb': 'digitalpersona_service_usb'
+}
+
+os.environ.setdefault('FINGERPRINT_ROLE', 'worker')
+# The service module registers its reader class with the shared app
+importlib.import_module(SERVICE_MODULES[os.getenv('FINGERPRINT_SERVICE', 'sdk')])
+service = importlib.import_module('fingerprint_service')
+service.start_service()
+
+app = service.app